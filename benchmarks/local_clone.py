@@ -0,0 +1,138 @@
+"""
+Checks scans of a local clone against the api scan they stand in for. A synthetic repository is written to a bare git
+repository in a temporary directory, with a commit per branch dated like its head, and served by the mock api.
+
+Scanning the bare repository and a full clone of it must find the same branches as the REST scan. Clones missing
+branches must be refused: one made with --single-branch, and one made like actions/checkout does by default, which
+fetches a single branch into a clone otherwise set up to fetch them all. Run from the root of the repository, exits
+with 1 when a check fails:
+
+    python -m benchmarks.local_clone --branches 2000
+"""
+import argparse
+import calendar
+import contextlib
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.mock_github import DATE_FORMAT, MockGithub, SyntheticRepository
+from src.github import Github
+from src.local_git import LocalRepository
+from src.matcher import BranchMatcher
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Check scans of a local clone against the REST scan')
+    parser.add_argument('--branches', type=int, default=2000)
+    parser.add_argument('--last-commit-age-days', type=int, default=60)
+    parser.add_argument('--concurrency', type=int, default=8, help='Branches the REST scan evaluates in parallel')
+    parser.add_argument('--seed', type=int, default=1)
+
+    return parser.parse_args()
+
+
+def git(*args: str, input: str = None) -> str:
+    return subprocess.run(['git', *args], input=input, capture_output=True, text=True, check=True).stdout
+
+
+def write_bare_repository(repository: SyntheticRepository, path: str) -> None:
+    """
+    Writes a commit per branch of the repository, dated like its head, then gives the branches of the repository the
+    shas git made for them
+    """
+    git('init', '--quiet', '--bare', '--initial-branch', repository.default_branch, path)
+
+    stream = []
+    for mark, (name, branch) in enumerate(sorted(repository.branches.items()), start=1):
+        timestamp = calendar.timegm(time.strptime(branch['date'], DATE_FORMAT))
+        message = f'Head of {name}'
+        stream.append(
+            f'commit refs/heads/{name}\nmark :{mark}\ncommitter Octo <octo@example.com> {timestamp} +0000\n'
+            f'data {len(message)}\n{message}\n'
+        )
+    git('-C', path, 'fast-import', '--quiet', input=''.join(stream))
+
+    shas = {}
+    for line in git('-C', path, 'for-each-ref', '--format=%(refname:strip=2) %(objectname)', 'refs/heads/').splitlines():
+        name, sha = line.split(' ')
+        shas[name] = sha
+    repository.replace_commits(shas=shas)
+
+
+def scan(github: Github, args: argparse.Namespace, local_repository: LocalRepository = None) -> list[str]:
+    options = {
+        'last_commit_age_days': args.last_commit_age_days,
+        'ignore_branches': BranchMatcher(rules=[]),
+        'allowed_prefixes': BranchMatcher(rules=[]),
+        'branch_limit': sys.maxsize,
+    }
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        if local_repository is None:
+            return github.get_deletable_branches(**options)
+
+        return github.get_deletable_branches_from_local_clone(local_repository=local_repository, **options)
+
+
+def main() -> None:
+    args = parse_args()
+    failed = False
+
+    repository = SyntheticRepository(branches=args.branches, seed=args.seed)
+    mock = MockGithub(repository=repository)
+    with tempfile.TemporaryDirectory() as directory:
+        bare = os.path.join(directory, 'repository.git')
+        write_bare_repository(repository=repository, path=bare)
+
+        full_clone = os.path.join(directory, 'full')
+        git('clone', '--quiet', '--no-checkout', f'file://{bare}', full_clone)
+
+        single_branch = os.path.join(directory, 'single-branch')
+        git('clone', '--quiet', '--no-checkout', '--single-branch', '--depth=1', f'file://{bare}', single_branch)
+
+        # Like actions/checkout: origin is set up to fetch every branch, but only the one checked out is fetched
+        checkout = os.path.join(directory, 'checkout')
+        git('init', '--quiet', checkout)
+        git('-C', checkout, 'remote', 'add', 'origin', f'file://{bare}')
+        git('-C', checkout, 'fetch', '--quiet', '--depth=1', 'origin',
+            f'+refs/heads/{repository.default_branch}:refs/remotes/origin/{repository.default_branch}')
+
+        base_url = mock.start()
+        try:
+            github = Github(
+                repo=repository.full_name,
+                token='token',
+                base_url=base_url,
+                owner=repository.owner,
+                concurrency=args.concurrency,
+            )
+            expected = scan(github=github, args=args)
+            print(f'REST scan       {len(expected)} branches deletable')
+
+            for name, path in (('bare', bare), ('full clone', full_clone)):
+                found = scan(github=github, args=args, local_repository=LocalRepository(path=path))
+                mismatch = found != expected
+                failed = failed or mismatch
+                print(f'{name:<14}  {len(found)} branches deletable{", not the same as the REST scan" if mismatch else ""}')
+
+            for name, path in (('single branch', single_branch), ('checkout', checkout)):
+                try:
+                    scan(github=github, args=args, local_repository=LocalRepository(path=path))
+                except RuntimeError as ex:
+                    print(f'{name:<14}  refused: {ex}')
+                else:
+                    failed = True
+                    print(f'{name:<14}  scanned although the clone is missing branches')
+        finally:
+            mock.stop()
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
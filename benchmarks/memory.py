@@ -0,0 +1,79 @@
+"""
+Checks that the memory a scan needs grows no faster with the size of the repository than it should. Every scan mode is
+run against increasingly large synthetic repositories, and the growth of its peak memory between the smallest and the
+largest one is reported per branch. What a scan has to keep per branch (its name in the results, the pull requests and
+state it looks branches up in) is a few hundred bytes. A page is let go of once evaluated, so anything that holds on to
+the responses shows up as kilobytes per branch.
+
+Run from the root of the repository, exits with 1 when a mode goes over --max-bytes-per-branch:
+
+    python -m benchmarks.memory --branches 2000,10000,50000 --modes graphql,closed_prs
+"""
+import argparse
+import sys
+
+from benchmarks.run import MODES, mock_server, run_scan
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Check how the peak memory of scans grows with the repository size')
+    parser.add_argument('--branches', default='2000,10000', help='Comma-separated repository sizes, in branches')
+    parser.add_argument('--pull-requests', type=int, default=None, help='Pull requests per repository. Defaults to half the branches')
+    parser.add_argument('--modes', default='graphql,closed_prs', help=f'Comma-separated scan modes out of {", ".join(MODES)}')
+    parser.add_argument('--max-bytes-per-branch', type=int, default=300, help='Peak memory growth allowed per branch')
+    parser.add_argument('--repeat', type=int, default=3, help='Scans per size and mode, the lowest peak is kept')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--use-async', action='store_true', help='Scan with AsyncGithub instead of Github')
+    parser.add_argument('--last-commit-age-days', type=int, default=60)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    # Only what the mock is started with, memory doesn't depend on latency or rate limits
+    args.latency_ms = 0.0
+    args.rate_limit = 0
+    args.rate_limit_window = 3600
+
+    return args
+
+
+def scan_peak_memory_mb(args: argparse.Namespace, branches: int, mode: str) -> float:
+    # A mock of its own for every scan, the GraphQL points of the mock never come back
+    with mock_server(args=args, branches=branches) as base_url:
+        return run_scan(args=args, base_url=base_url, mode=mode)['peak_memory_mb']
+
+
+def main() -> None:
+    args = parse_args()
+    modes = args.modes.split(',')
+    for mode in modes:
+        if mode not in MODES:
+            raise RuntimeError(f'Unknown mode `{mode}`, possible values: {", ".join(MODES)}')
+
+    sizes = sorted(int(size) for size in args.branches.split(','))
+    if len(sizes) < 2:
+        raise RuntimeError('Growth is measured between repository sizes, at least two are needed')
+
+    peaks = {mode: {} for mode in modes}
+    for branches in sizes:
+        for mode in modes:
+            # A collection of what earlier scans left behind can land in the middle of one and inflate its peak
+            peak_memory_mb = min(scan_peak_memory_mb(args=args, branches=branches, mode=mode) for _ in range(args.repeat))
+            peaks[mode][branches] = peak_memory_mb * 1024 * 1024
+            print(f'{branches:>7} branches  {mode:<11}  {peak_memory_mb:>8.2f} MB')
+
+    failed = False
+    for mode in modes:
+        growth = (peaks[mode][sizes[-1]] - peaks[mode][sizes[0]]) / (sizes[-1] - sizes[0])
+        over = growth > args.max_bytes_per_branch
+        failed = failed or over
+        print(
+            f'{mode:<11}  {growth:>6.0f} bytes per branch from {sizes[0]} to {sizes[-1]} branches'
+            f'{f", over the {args.max_bytes_per_branch} allowed" if over else ""}'
+        )
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
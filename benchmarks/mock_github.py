@@ -0,0 +1,522 @@
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlencode, urlparse
+
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+BRANCH_PREFIXES = ('feature/', 'bugfix/', 'release/', 'dependabot/')
+
+
+class SyntheticRepository:
+    """
+    A repository made up from a seed: branches with a head commit of random age, a few of them protected, and pull
+    requests, open or closed, between them. The same arguments always make the same repository.
+    """
+
+    def __init__(
+            self,
+            branches: int = 1000,
+            pull_requests: int = None,
+            seed: int = 1,
+            owner: str = 'octo',
+            name: str = 'repo',
+            default_branch: str = 'main',
+    ):
+        self.owner = owner
+        self.name = name
+        self.default_branch = default_branch
+        self.lock = threading.Lock()
+
+        rng = random.Random(seed)
+        now = datetime.now()
+
+        self.branches: dict[str, dict] = {}
+        names = [default_branch] + [f'{rng.choice(BRANCH_PREFIXES)}{index:06d}' for index in range(branches)]
+        for branch in names:
+            self.branches[branch] = {
+                'sha': '%040x' % rng.getrandbits(160),
+                'date': (now - timedelta(days=rng.randint(0, 400))).strftime(DATE_FORMAT),
+                'protected': branch == default_branch or rng.random() < 0.02,
+            }
+
+        # Sorted like the api lists them, unprotected ones apart for ?protected=false
+        self.names = sorted(self.branches)
+        self.unprotected_names = [name for name in self.names if self.branches[name]['protected'] is False]
+        self.by_sha = {branch['sha']: name for name, branch in self.branches.items()}
+
+        if pull_requests is None:
+            pull_requests = branches // 2
+
+        self.pull_requests: list[dict] = []
+        for number in range(1, pull_requests + 1):
+            head = rng.choice(names[1:])
+            self.pull_requests.append({
+                'number': number,
+                'head': head,
+                'head_sha': self.branches[head]['sha'],
+                'base': default_branch if rng.random() < 0.9 else rng.choice(names),
+                'state': 'open' if rng.random() < 0.3 else 'closed',
+                'updated_at': (now - timedelta(days=rng.randint(0, 400))).strftime(DATE_FORMAT),
+            })
+
+        self.pull_requests_by_sha: dict[str, list[dict]] = {}
+        for pull_request in self.pull_requests:
+            self.pull_requests_by_sha.setdefault(pull_request['head_sha'], []).append(pull_request)
+
+        self.open_pull_requests = [pull_request for pull_request in self.pull_requests if pull_request['state'] == 'open']
+        self.open_pull_request_counts: dict[str, int] = {}
+        for pull_request in self.open_pull_requests:
+            self.open_pull_request_counts[pull_request['head']] = self.open_pull_request_counts.get(pull_request['head'], 0) + 1
+        self.closed_pull_requests = sorted(
+            [pull_request for pull_request in self.pull_requests if pull_request['state'] == 'closed'],
+            key=lambda pull_request: pull_request['updated_at'],
+            reverse=True,
+        )
+
+    @property
+    def full_name(self) -> str:
+        return f'{self.owner}/{self.name}'
+
+    def delete(self, branch: str) -> bool:
+        with self.lock:
+            if branch not in self.branches:
+                return False
+
+            if self.branches.pop(branch)['protected'] is False:
+                del self.unprotected_names[bisect_left(self.unprotected_names, branch)]
+            del self.names[bisect_left(self.names, branch)]
+
+            return True
+
+    def push(self, branch: str, sha: str, date: str) -> None:
+        """
+        Moves the head of a branch, creating it if needed, as a push would
+        """
+        with self.lock:
+            if branch not in self.branches:
+                insort(self.names, branch)
+                insort(self.unprotected_names, branch)
+                self.branches[branch] = {'protected': False}
+            self.branches[branch].update({'sha': sha, 'date': date})
+            self.by_sha[sha] = branch
+
+    def replace_commits(self, shas: dict[str, str]) -> None:
+        """
+        Gives branches other head commits, by name, and moves their pull requests along, for a repository written to
+        git where commits get shas of their own
+        """
+        with self.lock:
+            for branch, sha in shas.items():
+                self.branches[branch]['sha'] = sha
+            self.by_sha = {branch['sha']: name for name, branch in self.branches.items()}
+
+            self.pull_requests_by_sha = {}
+            for pull_request in self.pull_requests:
+                pull_request['head_sha'] = self.branches[pull_request['head']]['sha']
+                self.pull_requests_by_sha.setdefault(pull_request['head_sha'], []).append(pull_request)
+
+
+class RateLimit:
+    """
+    A quota of requests per window, like GitHub's primary rate limit, kept separately for REST (core) and GraphQL
+    """
+
+    def __init__(self, limit: int, window_seconds: float):
+        self.limit = limit
+        self.window_seconds = window_seconds
+        self.lock = threading.Lock()
+        self.used: Counter = Counter()
+        self.resets: dict[str, float] = {}
+
+    def take(self, resource: str) -> tuple[bool, int, int]:
+        """
+        Counts a request against the quota. Returns whether it's allowed, the quota left and when it resets.
+        """
+        with self.lock:
+            now = time.time()
+            if self.resets.get(resource, 0) <= now:
+                self.resets[resource] = now + self.window_seconds
+                self.used[resource] = 0
+
+            allowed = self.used[resource] < self.limit
+            if allowed:
+                self.used[resource] += 1
+
+            return allowed, self.limit - self.used[resource], int(self.resets[resource]) + 1
+
+
+class MockGithub:
+    """
+    Local stand-in for the parts of the GitHub REST and GraphQL apis this action calls. Serves a SyntheticRepository
+    over plain HTTP with an optional latency per request and primary rate limit, answers conditional requests with
+    304s and counts requests per endpoint.
+
+    Use it from a thread of the process under test (start / stop), or run it in a process of its own with
+    `python -m benchmarks.mock_github` so it doesn't compete for the GIL and memory being measured.
+    """
+
+    def __init__(
+            self,
+            repository: SyntheticRepository,
+            latency: float = 0.0,
+            rate_limit: int = 0,
+            rate_limit_window: float = 3600,
+            host: str = '127.0.0.1',
+            port: int = 0,
+            graphql_timeout_nodes: int = 0,
+    ):
+        self.repository = repository
+        self.latency = latency
+        self.graphql_timeout_nodes = graphql_timeout_nodes
+        self.graphql_points = 0
+        self.rate_limit = RateLimit(limit=rate_limit, window_seconds=rate_limit_window) if rate_limit > 0 else None
+        self.counts: Counter = Counter()
+        self.counts_lock = threading.Lock()
+
+        # Wall clock time of the first request since the counts were reset, for clients started in another process
+        self.first_request_at: float = None
+
+        handler = type('Handler', (MockGithubHandler,), {'mock': self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.thread: threading.Thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> str:
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+        return self.base_url
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count(self, endpoint: str) -> None:
+        with self.counts_lock:
+            if self.first_request_at is None:
+                self.first_request_at = time.time()
+            self.counts[endpoint] += 1
+
+    def reset_counts(self) -> dict:
+        with self.counts_lock:
+            counts = dict(self.counts)
+            self.counts.clear()
+            self.first_request_at = None
+
+        return counts
+
+
+class MockGithubHandler(BaseHTTPRequestHandler):
+    mock: MockGithub = None
+
+    # Keep-alive, like the real api
+    protocol_version = 'HTTP/1.1'
+
+    # Headers and body are written separately, which would otherwise wait on the client's delayed ACK on every
+    # response of a kept-alive connection
+    disable_nagle_algorithm = True
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+    @property
+    def repository(self) -> SyntheticRepository:
+        return self.mock.repository
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        path = unquote(url.path)
+
+        if path == '/_mock/counts':
+            return self.send(200, self.mock.reset_counts(), count=None)
+
+        match = re.match(r'^/repos/[^/]+/[^/]+(/.*)?$', path)
+        if match is None:
+            return self.send(404, {'message': 'Not Found'}, count='GET other')
+
+        rest = match.group(1) or ''
+        if rest == '':
+            return self.send(200, {'full_name': self.repository.full_name, 'default_branch': self.repository.default_branch}, count='GET /repos/{repo}')
+
+        if rest == '/branches':
+            per_page, page = int(query.get('per_page', 30)), max(int(query.get('page', 1)), 1)
+            with self.repository.lock:
+                names = self.repository.names
+                if query.get('protected') == 'false':
+                    names = self.repository.unprotected_names
+                elif query.get('protected') == 'true':
+                    names = [name for name in names if self.repository.branches[name]['protected'] is True]
+                branches = [self.make_branch(name) for name in names[(page - 1) * per_page:page * per_page]]
+                last_page = max((len(names) + per_page - 1) // per_page, 1)
+
+            # Like the api, the last page is linked to whenever there are several
+            links = {}
+            if last_page > 1:
+                last_query = urlencode({**query, 'page': last_page})
+                links['last'] = f'http://{self.headers["host"]}{url.path}?{last_query}'
+
+            return self.send(200, branches, count='GET /branches', links=links)
+
+        if rest.startswith('/branches/'):
+            branch = rest[len('/branches/'):]
+            if branch not in self.repository.branches:
+                return self.send(404, {'message': 'Branch not found'}, count='GET /branches/{branch}')
+
+            return self.send(200, self.make_branch(branch), count='GET /branches/{branch}')
+
+        match = re.match(r'^/commits/(\w+)(/pulls)?$', rest)
+        if match is not None:
+            sha = match.group(1)
+            if match.group(2) is not None:
+                pull_requests = self.repository.pull_requests_by_sha.get(sha, [])
+                return self.send(200, [self.make_pull_request(pull_request) for pull_request in pull_requests], count='GET /commits/{sha}/pulls')
+
+            branch = self.repository.by_sha.get(sha)
+            if branch is None or branch not in self.repository.branches:
+                return self.send(404, {'message': 'No commit found for SHA'}, count='GET /commits/{sha}')
+
+            date = self.repository.branches[branch]['date']
+            commit = {'sha': sha, 'commit': {'author': {'date': date}, 'committer': {'date': date}}}
+
+            return self.send(200, commit, count='GET /commits/{sha}')
+
+        if rest == '/pulls':
+            state = query.get('state', 'open')
+            pull_requests = self.repository.pull_requests
+            if state != 'all':
+                pull_requests = [pull_request for pull_request in pull_requests if pull_request['state'] == state]
+            if 'base' in query:
+                pull_requests = [pull_request for pull_request in pull_requests if pull_request['base'] == query['base']]
+
+            per_page, page = int(query.get('per_page', 30)), max(int(query.get('page', 1)), 1)
+            pull_requests = pull_requests[(page - 1) * per_page:page * per_page]
+
+            return self.send(200, [self.make_pull_request(pull_request) for pull_request in pull_requests], count='GET /pulls')
+
+        return self.send(404, {'message': 'Not Found'}, count='GET other')
+
+    def do_DELETE(self) -> None:
+        match = re.match(r'^/repos/[^/]+/[^/]+/git/refs/heads/(.*)$', unquote(urlparse(self.path).path))
+        if match is not None and self.repository.delete(match.group(1)):
+            return self.send(204, None, count='DELETE /git/refs/heads/{branch}')
+
+        return self.send(422, {'message': 'Reference does not exist'}, count='DELETE /git/refs/heads/{branch}')
+
+    def do_POST(self) -> None:
+        body = json.loads(self.rfile.read(int(self.headers.get('content-length', 0))) or b'{}')
+        query: str = body.get('query', '')
+
+        first_match = re.search(r'first:\s*(\d+)', query)
+        first = int(first_match.group(1)) if first_match is not None else 100
+        after_match = re.search(r'after:\s*"([^"]*)"', query)
+        after = int(after_match.group(1)) if after_match is not None else 0
+
+        if query.strip().startswith('mutation'):
+            return self.send(200, self.delete_refs(query=query), count='POST graphql deleteRef', resource='graphql')
+
+        if 'qualifiedName' in query:
+            body = self.with_cost(query, self.find_refs(query=query), cost=1)
+            return self.send(200, body, count='POST graphql ref ids', resource='graphql')
+
+        # Like GitHub, give up on queries asking for too much at once
+        if 0 < self.mock.graphql_timeout_nodes < first and ('refs(' in query or 'pullRequests(' in query):
+            return self.send(502, {'message': 'Server Error'}, count='POST graphql timeout', resource='graphql')
+
+        if 'refs(' in query:
+            # Like the pull requests of a page, the nodes only ask for how many open pull requests they have
+            cost = max(1, math.ceil(first / 100))
+            body = self.with_cost(query, self.list_refs(first=first, after=after), cost=cost)
+            return self.send(200, body, count='POST graphql refs', resource='graphql')
+
+        if 'pullRequests(' in query:
+            cost = max(1, math.ceil(first / 100))
+            body = self.with_cost(query, self.list_closed_pull_requests(first=first, after=after), cost=cost)
+            return self.send(200, body, count='POST graphql pullRequests', resource='graphql')
+
+        return self.send(200, {'errors': [{'message': 'Unsupported query'}]}, count='POST graphql other', resource='graphql')
+
+    def with_cost(self, query: str, body: dict, cost: int) -> dict:
+        """
+        Adds the rateLimit of the query if it asked for it. Points come out of a quota of 5000 that never resets.
+        """
+        self.mock.graphql_points += cost
+        if 'rateLimit' in query:
+            body['data']['rateLimit'] = {
+                'cost': cost,
+                'remaining': max(5000 - self.mock.graphql_points, 0),
+                'resetAt': (datetime.now(timezone.utc) + timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M:%SZ'),
+            }
+
+        return body
+
+    def make_branch(self, name: str) -> dict:
+        branch = self.repository.branches[name]
+        base_url = f'http://{self.headers["host"]}/repos/{self.repository.full_name}'
+
+        return {
+            'name': name,
+            'commit': {'sha': branch['sha'], 'url': f'{base_url}/commits/{branch["sha"]}'},
+            'protected': branch['protected'],
+        }
+
+    def make_pull_request(self, pull_request: dict) -> dict:
+        return {
+            'number': pull_request['number'],
+            'state': pull_request['state'],
+            'updated_at': pull_request['updated_at'],
+            'head': {'ref': pull_request['head'], 'sha': pull_request['head_sha'], 'repo': {'full_name': self.repository.full_name}},
+            'base': {'ref': pull_request['base']},
+        }
+
+    def list_refs(self, first: int, after: int) -> dict:
+        with self.repository.lock:
+            names = self.repository.names[after:after + first]
+            has_next_page = after + first < len(self.repository.names)
+
+        nodes = []
+        for name in names:
+            branch = self.repository.branches[name]
+            nodes.append({
+                'name': name,
+                'branchProtectionRule': {'id': name} if branch['protected'] else None,
+                'associatedPullRequests': {'totalCount': self.repository.open_pull_request_counts.get(name, 0)},
+                'target': {'oid': branch['sha'], 'committedDate': branch['date']},
+            })
+
+        return {'data': {'repository': {
+            'defaultBranchRef': {'name': self.repository.default_branch},
+            'refs': {'nodes': nodes, 'pageInfo': {'hasNextPage': has_next_page, 'endCursor': str(after + first)}},
+        }}}
+
+    def list_closed_pull_requests(self, first: int, after: int) -> dict:
+        pull_requests = self.repository.closed_pull_requests
+
+        nodes = []
+        for pull_request in pull_requests[after:after + first]:
+            nodes.append({
+                'title': f'Pull request #{pull_request["number"]}',
+                'url': f'https://github.com/{self.repository.full_name}/pull/{pull_request["number"]}',
+                'updatedAt': pull_request['updated_at'],
+                'isCrossRepository': False,
+                'headRef': self.make_head_ref(name=pull_request['head']),
+                'headRefName': pull_request['head'],
+            })
+
+        return {'data': {'repository': {'pullRequests': {
+            'totalCount': len(pull_requests),
+            'nodes': nodes,
+            'pageInfo': {'hasNextPage': after + first < len(pull_requests), 'endCursor': str(after + first)},
+        }}}}
+
+    def make_head_ref(self, name: str) -> dict:
+        branch = self.repository.branches.get(name)
+        if branch is None:
+            return None
+
+        return {
+            'name': name,
+            'branchProtectionRule': {'id': name} if branch['protected'] else None,
+            'associatedPullRequests': {'totalCount': self.repository.open_pull_request_counts.get(name, 0)},
+            'target': {'oid': branch['sha'], 'committedDate': branch['date']},
+        }
+
+    def find_refs(self, query: str) -> dict:
+        refs = {}
+        for alias, qualified_name in re.findall(r'(\w+): ref\(qualifiedName: "([^"]*)"\)', query):
+            branch = qualified_name[len('refs/heads/'):]
+            branch_info = self.repository.branches.get(branch)
+            refs[alias] = {'id': f'ref:{branch}', 'target': {'oid': branch_info['sha']}} if branch_info is not None else None
+
+        return {'data': {'repository': refs}}
+
+    def delete_refs(self, query: str) -> dict:
+        data = {}
+        errors = []
+        for alias, ref_id in re.findall(r'(\w+): deleteRef\(input: \{refId: "([^"]*)"\}\)', query):
+            if self.repository.delete(ref_id[len('ref:'):]):
+                data[alias] = {'clientMutationId': None}
+            else:
+                data[alias] = None
+                errors.append({'type': 'NOT_FOUND', 'path': [alias], 'message': f'Could not resolve {ref_id}'})
+
+        return {'data': data, **({'errors': errors} if len(errors) > 0 else {})}
+
+    def send(self, status: int, body, count: str, resource: str = 'core', links: dict = None) -> None:
+        if count is not None:
+            self.mock.count(count)
+            if self.mock.latency > 0:
+                time.sleep(self.mock.latency)
+
+        headers = {}
+        if links:
+            headers['link'] = ', '.join(f'<{url}>; rel="{rel}"' for rel, url in links.items())
+        if count is not None and self.mock.rate_limit is not None:
+            allowed, remaining, reset = self.mock.rate_limit.take(resource=resource)
+            headers.update({
+                'x-ratelimit-limit': str(self.mock.rate_limit.limit),
+                'x-ratelimit-remaining': str(remaining),
+                'x-ratelimit-reset': str(reset),
+                'x-ratelimit-resource': resource,
+            })
+            if allowed is False:
+                self.mock.count('rate limited')
+                status, body = 403, {'message': 'API rate limit exceeded'}
+
+        data = json.dumps(body).encode() if body is not None else b''
+
+        if status == 200 and self.command == 'GET':
+            headers['etag'] = f'"{hashlib.md5(data).hexdigest()}"'
+            if self.headers.get('if-none-match') == headers['etag']:
+                self.mock.count('not modified')
+                status, data = 304, b''
+
+        self.send_response(status)
+        self.send_header('content-type', 'application/json')
+        self.send_header('content-length', str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Serve a synthetic repository through a mock GitHub api')
+    parser.add_argument('--branches', type=int, default=1000)
+    parser.add_argument('--pull-requests', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--rate-limit', type=int, default=0, help='Requests per window, 0 for no limit')
+    parser.add_argument('--rate-limit-window', type=float, default=3600)
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--graphql-timeout-nodes', type=int, default=0, help='Pages larger than this time out, 0 for never')
+    args = parser.parse_args()
+
+    mock = MockGithub(
+        repository=SyntheticRepository(branches=args.branches, pull_requests=args.pull_requests, seed=args.seed),
+        latency=args.latency_ms / 1000,
+        rate_limit=args.rate_limit,
+        rate_limit_window=args.rate_limit_window,
+        port=args.port,
+        graphql_timeout_nodes=args.graphql_timeout_nodes,
+    )
+
+    # The benchmark reads the address off the first line
+    print(mock.base_url, flush=True)
+    mock.server.serve_forever()
@@ -0,0 +1,159 @@
+"""
+Measures how scans scale against a mock GitHub api serving synthetic repositories. For every repository size and scan
+mode, reports wall time, requests made per endpoint and the peak memory allocated by the scan.
+
+Run from the root of the repository:
+
+    python -m benchmarks.run --branches 1000,10000 --modes rest,closed_prs --latency-ms 20 --concurrency 8
+"""
+import argparse
+import contextlib
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import requests
+
+from src.async_github import AsyncGithubFacade
+from src.github import Github
+from src.matcher import BranchMatcher
+from src.ratelimit import RateLimiter
+from src.requests import DEFAULT_POOL_SIZE, Transport
+
+MODES = {
+    'rest': 'get_deletable_branches',
+    'graphql': 'get_deletable_branches_from_graphql',
+    'closed_prs': 'get_deletable_branches_from_closed_pull_requests',
+}
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Benchmark branch scans against a mock GitHub api')
+    parser.add_argument('--branches', default='1000,10000', help='Comma-separated repository sizes, in branches')
+    parser.add_argument('--pull-requests', type=int, default=None, help='Pull requests per repository. Defaults to half the branches')
+    parser.add_argument('--modes', default='rest,closed_prs', help=f'Comma-separated scan modes out of {", ".join(MODES)}')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='Latency the mock adds to every request')
+    parser.add_argument('--rate-limit', type=int, default=0, help='Requests the mock allows per window, 0 for no limit')
+    parser.add_argument('--rate-limit-window', type=float, default=3600, help='Length of a rate limit window, in seconds')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--use-async', action='store_true', help='Scan with AsyncGithub instead of Github')
+    parser.add_argument('--last-commit-age-days', type=int, default=60)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', dest='json_path', help='Also write the results to this file as json')
+
+    return parser.parse_args()
+
+
+@contextlib.contextmanager
+def mock_server(args: argparse.Namespace, branches: int):
+    """
+    Runs the mock in a process of its own, so serving requests neither slows down nor allocates in the scan measured
+    """
+    command = [
+        sys.executable, '-m', 'benchmarks.mock_github',
+        f'--branches={branches}',
+        f'--seed={args.seed}',
+        f'--latency-ms={args.latency_ms}',
+        f'--rate-limit={args.rate_limit}',
+        f'--rate-limit-window={args.rate_limit_window}',
+    ]
+    if args.pull_requests is not None:
+        command.append(f'--pull-requests={args.pull_requests}')
+
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    try:
+        yield process.stdout.readline().strip()
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def run_scan(args: argparse.Namespace, base_url: str, mode: str) -> dict:
+    rate_limiter = RateLimiter()
+    pool_size = max(args.concurrency, DEFAULT_POOL_SIZE)
+
+    if args.use_async:
+        from src.async_requests import AsyncTransport
+
+        github = AsyncGithubFacade(
+            repo='octo/repo',
+            token='token',
+            base_url=base_url,
+            owner='octo',
+            concurrency=args.concurrency,
+            transport=AsyncTransport(token='token', pool_size=pool_size, rate_limiter=rate_limiter),
+        )
+    else:
+        github = Github(
+            repo='octo/repo',
+            token='token',
+            base_url=base_url,
+            owner='octo',
+            concurrency=args.concurrency,
+            transport=Transport(token='token', pool_size=pool_size, rate_limiter=rate_limiter),
+        )
+
+    # The scan logs every branch, which would only measure the terminal
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        tracemalloc.start()
+        started = time.perf_counter()
+        try:
+            branches = getattr(github, MODES[mode])(
+                last_commit_age_days=args.last_commit_age_days,
+                ignore_branches=BranchMatcher(rules=[]),
+                allowed_prefixes=BranchMatcher(rules=[]),
+                branch_limit=sys.maxsize,
+            )
+        finally:
+            wall_time = time.perf_counter() - started
+            _, peak_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            github.close()
+
+    return {
+        'mode': mode,
+        'deletable_branches': len(branches),
+        'wall_time_seconds': round(wall_time, 3),
+        'peak_memory_mb': round(peak_memory / 1024 / 1024, 2),
+        'requests': requests.get(f'{base_url}/_mock/counts').json(),
+        'retries': rate_limiter.retries,
+    }
+
+
+def print_result(branches: int, result: dict) -> None:
+    print(
+        f'{branches:>7} branches  {result["mode"]:<11}  {result["wall_time_seconds"]:>8.2f}s  '
+        f'{result["peak_memory_mb"]:>8.2f} MB  {sum(result["requests"].values()):>7} requests  '
+        f'{result["deletable_branches"]:>6} deletable'
+    )
+    for endpoint, count in sorted(result['requests'].items()):
+        print(f'{"":>30}{count:>7}  {endpoint}')
+
+
+def main() -> None:
+    args = parse_args()
+    modes = args.modes.split(',')
+    for mode in modes:
+        if mode not in MODES:
+            raise RuntimeError(f'Unknown mode `{mode}`, possible values: {", ".join(MODES)}')
+
+    results = []
+    for branches in [int(size) for size in args.branches.split(',')]:
+        with mock_server(args=args, branches=branches) as base_url:
+            # Scans don't change the repository, so they can all run against the same one
+            for mode in modes:
+                result = run_scan(args=args, base_url=base_url, mode=mode)
+                result['branches'] = branches
+                results.append(result)
+                print_result(branches=branches, result=result)
+
+    if args.json_path is not None:
+        with open(args.json_path, 'w') as json_file:
+            json.dump(results, json_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""
+Measures the fixed cost every run of the action pays before its first request: starting the interpreter, importing
+main.py, parsing the inputs and setting up the transport. A scheduled run over a small repository spends most of its
+time there.
+
+For every scan mode, main.py is run against a mock GitHub api and timed until the mock gets its first request. The
+modules each mode imported are checked against the ones only other modes need, and the time to import main.py is
+checked against a budget on top of the time to import `requests` alone. Most of main.py's import is `requests`, so
+measuring both on the same machine keeps the budget about the action's own modules and not about how fast the
+machine is. Run from the root of the repository, exits with 1 when either check fails:
+
+    python -m benchmarks.startup --runs 10 --max-extra-import-ms 100
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.mock_github import MockGithub, SyntheticRepository
+
+# Command line of main.py for every mode, on top of what they share
+MODES = {
+    'rest': [],
+    'graphql': ['--use-graphql=yes'],
+    'closed_prs': ['--only-closed-prs=yes'],
+    'async': ['--use-async=yes'],
+}
+
+# Modules only some runs need, and the modes that do. The others must not pay for importing them.
+DEFERRED_MODULES = {
+    'aiohttp': {'async'},
+    'asyncio': {'async'},
+    # Only runs with a cache_dir, a local clone or merging shards, and asyncio imports subprocess
+    'sqlite3': set(),
+    'subprocess': {'async'},
+    'glob': set(),
+}
+
+IMPORT_TIME_LINE = re.compile(r'^import time:\s+\d+ \|\s+(\d+) \|\s*(\S+)$')
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Measure how long runs of the action take to get to their first request')
+    parser.add_argument('--runs', type=int, default=10, help='Runs per measure, the median is reported')
+    parser.add_argument('--modes', default=','.join(MODES), help=f'Comma-separated scan modes out of {", ".join(MODES)}')
+    parser.add_argument(
+        '--max-extra-import-ms', type=float, default=100,
+        help='Time importing main.py may take on top of importing requests alone',
+    )
+
+    return parser.parse_args()
+
+
+def parse_import_times(output: str) -> dict[str, int]:
+    """
+    Cumulative microseconds spent importing each module, out of the stderr of `python -X importtime`
+    """
+    import_times = {}
+    for line in output.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match is not None:
+            import_times[match.group(2)] = int(match.group(1))
+
+    return import_times
+
+
+def measure_import_ms(module: str) -> float:
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    return parse_import_times(process.stderr)[module] / 1000
+
+
+def run_main(mock: MockGithub, mode: str, output_path: str) -> tuple[float, set[str]]:
+    """
+    Returns the milliseconds main.py took to make its first request and the modules it imported along its run
+    """
+    env = {
+        **os.environ,
+        'GITHUB_REPOSITORY': 'octo/repo',
+        'GITHUB_REPOSITORY_OWNER': 'octo',
+        'GITHUB_OUTPUT': output_path,
+    }
+    command = [
+        sys.executable, '-X', 'importtime', 'main.py',
+        '--github-token=token',
+        f'--github-base-url={mock.base_url}',
+        '--dry-run=yes',
+        *MODES[mode],
+    ]
+
+    mock.reset_counts()
+    started = time.time()
+    process = subprocess.run(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    if process.returncode != 0:
+        raise RuntimeError(f'main.py failed in {mode} mode: {process.stderr[-2000:]}')
+
+    return (mock.first_request_at - started) * 1000, set(parse_import_times(process.stderr))
+
+
+def main() -> None:
+    args = parse_args()
+    modes = args.modes.split(',')
+    for mode in modes:
+        if mode not in MODES:
+            raise RuntimeError(f'Unknown mode `{mode}`, possible values: {", ".join(MODES)}')
+
+    failed = False
+
+    # Interleaved, so that anything else slowing the machine down weighs on both alike
+    import_runs = [(measure_import_ms('main'), measure_import_ms('requests')) for _ in range(args.runs)]
+    import_ms = statistics.median(main_ms for main_ms, _ in import_runs)
+    requests_ms = statistics.median(requests_ms for _, requests_ms in import_runs)
+    extra_ms = import_ms - requests_ms
+    over = extra_ms > args.max_extra_import_ms
+    failed = failed or over
+    print(f'import requests  {requests_ms:>8.1f} ms')
+    print(
+        f'import main      {import_ms:>8.1f} ms, {extra_ms:.1f} ms on top of requests'
+        f'{f", over the {args.max_extra_import_ms:.0f} ms allowed" if over else ""}'
+    )
+
+    # A repository small enough for the scan after the first request not to matter
+    mock = MockGithub(repository=SyntheticRepository(branches=50, seed=1))
+    mock.start()
+    try:
+        with tempfile.TemporaryDirectory() as output_dir:
+            output_path = os.path.join(output_dir, 'output')
+            for mode in modes:
+                runs = [run_main(mock=mock, mode=mode, output_path=output_path) for _ in range(args.runs)]
+                first_request_ms = statistics.median(first_request_ms for first_request_ms, _ in runs)
+                modules = set.union(*(modules for _, modules in runs))
+
+                unneeded = sorted(
+                    module for module, needed_by in DEFERRED_MODULES.items()
+                    if module in modules and mode not in needed_by
+                )
+                failed = failed or len(unneeded) > 0
+                print(
+                    f'{mode:<15}  {first_request_ms:>8.1f} ms to the first request'
+                    f'{f", imported {unneeded} it does not need" if len(unneeded) > 0 else ""}'
+                )
+    finally:
+        mock.stop()
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
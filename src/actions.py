@@ -1,37 +1,392 @@
-from src.github import Github
-from src.io import Options
+import os
 
+from src import log
+from src.cache import CommitDateCache, ResponseCache
+from src.checkpoint import SCAN_SHARE, Checkpoint, Deadline, SweepCheckpoint
+from src.github import ALREADY_GONE, DELETED, FAILED, MOVED, Github
+from src.io import Options, write_step_summary
+from src.local_git import LocalRepository
+from src.metrics import Metrics
+from src.owner import Owner
+from src.plan import read_plan, write_plan
+from src.ratelimit import RateLimiter, RequestBudgetExhausted
+from src.requests import DEFAULT_POOL_SIZE, Transport
+from src.shard import merge_shard_results, write_shard_result
 
-def run_action(options: Options) -> list:
+# Requests a scan makes before it gets to its first branch: the default branch, open pull requests and a first page
+SCAN_SETUP_REQUESTS = 3
+
+
+def run_action(options: Options):
+    """
+    Returns the list of deleted branches, or a dict of them by repository when sweeping a whole owner
+    """
     print(f"Starting github action to cleanup old branches. Input: {options}")
+    log.set_verbose(options.verbose)
+
+    if options.merge_shards is True:
+        if options.shard_results_dir is None:
+            raise RuntimeError('Merging shards needs the shard_results_dir they wrote their results to')
+
+        result = merge_shard_results(results_dir=options.shard_results_dir)
+        print(f'Merged the results of every shard: {result}')
+
+        return result
 
-    github = Github(
-        repo=options.github_repo,
+    if options.apply_plan is True and options.plan_file is None:
+        raise RuntimeError('Applying a deletion plan needs the plan_file it was written to')
+
+    # The rest of max_runtime is left to act on what the scan found
+    deadline = Deadline(seconds=options.max_runtime * 60 * SCAN_SHARE)
+
+    if options.org_sweep is True and options.local_clone is not None:
+        raise RuntimeError('A local clone only has the branches of one repository, it cannot be used to sweep an owner')
+
+    commit_cache = None
+    response_cache = None
+    if options.cache_dir is not None:
+        os.makedirs(options.cache_dir, exist_ok=True)
+        commit_cache = CommitDateCache(path=os.path.join(options.cache_dir, 'commit_dates.sqlite'))
+        response_cache = ResponseCache(path=os.path.join(options.cache_dir, 'responses.sqlite'))
+
+    # Shared by every repository of the run, so they share one connection pool and one view of the rate limits
+    metrics = Metrics()
+    transport = Transport(
+        token=options.github_token,
+        pool_size=max(options.concurrency, DEFAULT_POOL_SIZE),
+        rate_limiter=RateLimiter(request_budget=options.request_budget, point_budget=options.graphql_point_budget),
+        response_cache=response_cache,
+        metrics=metrics,
+    )
+
+    # Deletable branches by repository, when the scan writes a deletion plan
+    plan = {} if options.plan_file is not None and options.apply_plan is False else None
+
+    try:
+        if options.apply_plan is True:
+            result = apply_plan(options=options, transport=transport)
+        elif options.org_sweep is True:
+            result = sweep_owner(
+                options=options,
+                transport=transport,
+                commit_cache=commit_cache,
+                deadline=deadline,
+                plan=plan,
+            )
+        else:
+            checkpoint_path = None
+            if options.cache_dir is not None and options.max_runtime > 0:
+                checkpoint_path = os.path.join(options.cache_dir, 'checkpoint.json')
+
+            result = clean_repository(
+                repo=options.github_repo,
+                options=options,
+                transport=transport,
+                commit_cache=commit_cache,
+                checkpoint=Checkpoint(path=checkpoint_path, mode=get_scan_mode(options=options), deadline=deadline),
+                plan=plan,
+            )
+    finally:
+        if commit_cache is not None:
+            commit_cache.close()
+            print(f'Commit date cache: {commit_cache.report()}')
+        if response_cache is not None:
+            response_cache.close()
+            print(f'Response cache: {response_cache.report()}')
+        transport.close()
+
+    print(f'Rate limit usage: {transport.rate_limiter.report()}')
+    report_metrics(metrics=metrics, options=options)
+
+    if plan is not None:
+        write_plan(path=options.plan_file, plan=plan)
+
+    if options.shard_results_dir is not None:
+        write_shard_result(
+            results_dir=options.shard_results_dir,
+            shard=options.shard,
+            branch_limit=options.branch_limit,
+            dry_run=options.dry_run,
+            result=result,
+        )
+
+    return result
+
+
+def report_metrics(metrics: Metrics, options: Options) -> None:
+    report = metrics.report()
+    print(f'Made {report["requests"]} requests. Time spent per phase: {report["phases_seconds"]}')
+    for endpoint, stats in report['endpoints'].items():
+        print(f'  {endpoint}: {stats["requests"]} requests, {stats["errors"]} errors, {stats["mean_ms"]} ms on average')
+
+    write_step_summary(metrics.format_summary())
+    if options.metrics_file is not None:
+        metrics.write_report(path=options.metrics_file)
+        print(f'Metrics written to {options.metrics_file}')
+
+
+def sweep_owner(
+        options: Options,
+        transport: Transport,
+        commit_cache: CommitDateCache,
+        deadline: Deadline,
+        plan: dict[str, list[dict]] = None,
+) -> dict[str, list]:
+    owner = Owner(name=options.github_owner, base_url=options.github_base_url, transport=transport)
+    with transport.metrics.phase('list repositories'):
+        repositories = owner.get_repositories(include=options.include_repos, exclude=options.exclude_repos)
+
+    sweep_checkpoint = None
+    if options.cache_dir is not None and options.max_runtime > 0:
+        os.makedirs(os.path.join(options.cache_dir, 'checkpoint'), exist_ok=True)
+        sweep_checkpoint = SweepCheckpoint(path=os.path.join(options.cache_dir, 'sweep_checkpoint.json'))
+        repositories = sweep_checkpoint.order(repositories=repositories)
+    print(f'Sweeping {len(repositories)} repositories of `{owner.name}`: {repositories}')
+
+    rate_limiter = transport.rate_limiter
+    results = {}
+
+    # The repository the next sweep starts from, when this one runs out of time before getting through them all
+    stopped_at = None
+
+    for index, repo in enumerate(repositories):
+        if deadline.expired():
+            print(f'Skipping repository `{repo}` because the deadline was reached')
+            stopped_at = repo if stopped_at is None else stopped_at
+            results[repo] = []
+            continue
+
+        if options.request_budget > 0:
+            # Each repository gets an equal share of what's left of the budget, so whatever one doesn't spend is
+            # handed on to the ones after it and a single huge repository can't starve the rest
+            left = options.request_budget - rate_limiter.spent
+            if left < SCAN_SETUP_REQUESTS:
+                print(f'Skipping repository `{repo}` because the request budget is exhausted')
+                results[repo] = []
+                continue
+            # A share too small to get to the first branch would be spent for nothing
+            share = max(left // (len(repositories) - index), SCAN_SETUP_REQUESTS)
+            rate_limiter.request_budget = rate_limiter.spent + share
+
+        checkpoint_path = None
+        if sweep_checkpoint is not None:
+            checkpoint_path = os.path.join(options.cache_dir, 'checkpoint', f'{repo.replace("/", "__")}.json')
+
+        checkpoint = Checkpoint(path=checkpoint_path, mode=get_scan_mode(options=options), deadline=deadline)
+
+        print(f'Cleaning up repository `{repo}`')
+        try:
+            results[repo] = clean_repository(
+                repo=repo,
+                options=options,
+                transport=transport,
+                commit_cache=commit_cache,
+                checkpoint=checkpoint,
+                plan=plan,
+            )
+        except RequestBudgetExhausted as ex:
+            # One repository running out of its share doesn't end the sweep
+            print(f'{ex}. Skipping the rest of repository `{repo}`')
+            results[repo] = []
+
+        if deadline.expired() and checkpoint.finished is False and stopped_at is None:
+            stopped_at = repo
+
+    if sweep_checkpoint is not None:
+        sweep_checkpoint.save(next_repository=stopped_at)
+
+    return results
+
+
+def clean_repository(
+        repo: str,
+        options: Options,
+        transport: Transport,
+        commit_cache: CommitDateCache,
+        checkpoint: Checkpoint,
+        plan: dict[str, list[dict]] = None,
+) -> list:
+    github = make_github(
+        repo=repo,
+        options=options,
+        transport=transport,
+        commit_cache=commit_cache,
+        checkpoint=checkpoint,
+        keep_plan=plan is not None,
+    )
+
+    try:
+        with transport.metrics.phase('scan'):
+            branches = find_deletable_branches(github=github, options=options)
+
+        if plan is not None:
+            plan[repo] = github.get_plan(branches=branches)
+
+        print(f"Branches queued for deletion: {branches}")
+        deletable_branches = branches
+        gone_branches = []
+        failed_branches = []
+        if options.dry_run is False:
+            print('This is NOT a dry run, deleting branches')
+            with transport.metrics.phase('delete'), transport.rate_limiter.deleting():
+                results = github.delete_branches(branches=branches)
+
+            # Only report what was actually removed
+            gone_branches = [branch for branch in branches if results[branch] in (DELETED, ALREADY_GONE)]
+            failed_branches = [branch for branch in branches if results[branch] == FAILED]
+            branches = [branch for branch in branches if results[branch] == DELETED]
+            print(f'Deleted {len(branches)} branches, {len(gone_branches) - len(branches)} were already gone')
+        else:
+            print('This is a dry run, skipping deletion of branches')
+
+        # Deleting branches doesn't remove their pull requests, so only branch listings shift
+        checkpoint.save(
+            deletable=deletable_branches,
+            deleted=0 if options.only_closed_prs is True else len(gone_branches),
+            failed=failed_branches,
+        )
+    finally:
+        github.close()
+
+    return branches
+
+
+def make_github(
+        repo: str,
+        options: Options,
+        transport: Transport,
+        commit_cache: CommitDateCache = None,
+        checkpoint: Checkpoint = None,
+        keep_plan: bool = False,
+):
+    # A local clone leaves a handful of requests to make, not worth an event loop
+    if options.use_async is True and options.local_clone is None:
+        from src.async_github import AsyncGithubFacade
+        from src.async_requests import AsyncTransport
+
+        # Keeps the run's rate limits, budget and response cache, only the connections are the event loop's own
+        return AsyncGithubFacade(
+            repo=repo,
+            token=options.github_token,
+            base_url=options.github_base_url,
+            owner=options.github_owner,
+            concurrency=options.concurrency,
+            transport=AsyncTransport(
+                token=options.github_token,
+                pool_size=max(options.concurrency, DEFAULT_POOL_SIZE),
+                rate_limiter=transport.rate_limiter,
+                response_cache=transport.response_cache,
+                metrics=transport.metrics,
+            ),
+            commit_cache=commit_cache,
+            checkpoint=checkpoint,
+            shard=options.shard,
+            keep_plan=keep_plan,
+        )
+
+    return Github(
+        repo=repo,
         token=options.github_token,
         base_url=options.github_base_url,
-        owner=options.github_owner
+        owner=options.github_owner,
+        concurrency=options.concurrency,
+        transport=transport,
+        commit_cache=commit_cache,
+        checkpoint=checkpoint,
+        shard=options.shard,
+        keep_plan=keep_plan,
     )
 
+
+def apply_plan(options: Options, transport: Transport):
+    """
+    Deletes the branches of a deletion plan without scanning again. A branch is only deleted if its head is still the
+    commit the plan was made on. Returns the deleted branches like a scan would.
+    """
+    plan = read_plan(path=options.plan_file)
+    if options.org_sweep is False and list(plan) != [options.github_repo]:
+        raise RuntimeError(f'The deletion plan is for {list(plan)}, not for `{options.github_repo}`')
+
+    results = {}
+    for repo, entries in plan.items():
+        branches = [entry['branch'] for entry in entries]
+        print(f'Branches planned for deletion in `{repo}`: {branches}')
+        if options.dry_run is True:
+            print('This is a dry run, skipping deletion of branches')
+            results[repo] = branches
+            continue
+
+        print('This is NOT a dry run, deleting branches')
+        github = make_github(repo=repo, options=options, transport=transport)
+        try:
+            with transport.metrics.phase('delete'), transport.rate_limiter.deleting():
+                deletions = github.delete_branches(
+                    branches=branches,
+                    expected_hashes={entry['branch']: entry['commit_hash'] for entry in entries},
+                )
+        finally:
+            github.close()
+
+        results[repo] = [branch for branch in branches if deletions[branch] == DELETED]
+        gone = [branch for branch in branches if deletions[branch] == ALREADY_GONE]
+        moved = [branch for branch in branches if deletions[branch] == MOVED]
+        print(
+            f'Deleted {len(results[repo])} branches, {len(gone)} were already gone and {len(moved)} had new commits '
+            f'since the plan was made'
+        )
+
+    if options.org_sweep is True:
+        return results
+
+    return results[options.github_repo]
+
+
+def get_scan_mode(options: Options) -> str:
+    """
+    Which kind of scan find_deletable_branches runs, each of them pages through something different
+    """
+    if options.only_closed_prs is True:
+        return 'closed_prs'
+    if options.local_clone is not None:
+        return 'local_clone'
+    if options.use_graphql is True:
+        return 'graphql'
+
+    return 'rest'
+
+
+def find_deletable_branches(github: Github, options: Options) -> list:
+    # Every shard gets its part of the limit, so that together they don't go over it
+    branch_limit = options.shard.get_branch_limit(branch_limit=options.branch_limit)
+
     if options.only_closed_prs is True:
-        branches = github.get_deletable_branches_from_closed_pull_requests(
+        return github.get_deletable_branches_from_closed_pull_requests(
             last_commit_age_days=options.last_commit_age_days,
-            ignore_branches=options.ignore_branches,
-            allowed_prefixes=options.allowed_prefixes,
-            branch_limit=options.branch_limit,
+            ignore_branches=options.ignore_branches_matcher,
+            allowed_prefixes=options.allowed_prefixes_matcher,
+            branch_limit=branch_limit,
         )
-    else:
-        branches = github.get_deletable_branches(
+
+    if options.local_clone is not None:
+        return github.get_deletable_branches_from_local_clone(
+            local_repository=LocalRepository(path=options.local_clone),
             last_commit_age_days=options.last_commit_age_days,
-            ignore_branches=options.ignore_branches,
-            allowed_prefixes=options.allowed_prefixes,
-            branch_limit=options.branch_limit,
+            ignore_branches=options.ignore_branches_matcher,
+            allowed_prefixes=options.allowed_prefixes_matcher,
+            branch_limit=branch_limit,
         )
 
-    print(f"Branches queued for deletion: {branches}")
-    if options.dry_run is False:
-        print('This is NOT a dry run, deleting branches')
-        github.delete_branches(branches=branches)
-    else:
-        print('This is a dry run, skipping deletion of branches')
+    if options.use_graphql is True:
+        return github.get_deletable_branches_from_graphql(
+            last_commit_age_days=options.last_commit_age_days,
+            ignore_branches=options.ignore_branches_matcher,
+            allowed_prefixes=options.allowed_prefixes_matcher,
+            branch_limit=branch_limit,
+        )
 
-    return branches
+    return github.get_deletable_branches(
+        last_commit_age_days=options.last_commit_age_days,
+        ignore_branches=options.ignore_branches_matcher,
+        allowed_prefixes=options.allowed_prefixes_matcher,
+        branch_limit=branch_limit,
+    )
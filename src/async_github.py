@@ -0,0 +1,636 @@
+import asyncio
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
+
+import aiohttp
+
+from src.async_requests import AsyncTransport
+from src.cache import CommitDateCache
+from src.checkpoint import Checkpoint
+from src.checks import Candidate, CheckPipeline
+from src.log import detail
+from src.matcher import BranchMatcher
+from src.github import END, Github, GraphqlTimeout
+from src.pages import PageSizer
+from src.pulls import OpenPullRequestIndex
+from src.ratelimit import RequestBudgetExhausted
+from src.records import PullRequestRecord
+from src.requests import DEFAULT_POOL_SIZE
+from src.shard import Shard
+
+
+class AsyncGithub:
+    """
+    The operations of Github as coroutines, on a single event loop and connection pool. Candidates are evaluated as
+    tasks, as many at once as `concurrency` allows, instead of one thread each, so it can be set in the thousands.
+    Queries, checks, paging and the parsing of responses are Github's, only the requests differ.
+    """
+
+    def __init__(
+            self,
+            repo: str,
+            token: str,
+            base_url: str,
+            owner: str,
+            concurrency: int = 1,
+            transport: AsyncTransport = None,
+            commit_cache: CommitDateCache = None,
+            checkpoint: Checkpoint = None,
+            shard: Shard = None,
+            keep_plan: bool = False,
+    ):
+        self.concurrency = concurrency
+        self.semaphore = asyncio.Semaphore(max(concurrency, 1))
+
+        if transport is None:
+            transport = AsyncTransport(token=token, pool_size=max(concurrency, DEFAULT_POOL_SIZE))
+        self.transport = transport
+
+        # Never makes a request. Given this transport so that it doesn't open a session of its own.
+        self.github = Github(
+            repo=repo,
+            token=token,
+            base_url=base_url,
+            owner=owner,
+            transport=transport,
+            commit_cache=commit_cache,
+            checkpoint=checkpoint,
+            shard=shard,
+            keep_plan=keep_plan,
+        )
+        self.checkpoint = self.github.checkpoint
+
+    async def close(self) -> None:
+        await self.transport.close()
+
+    async def iter_branch_pages(self) -> AsyncIterator[list]:
+        page = self.checkpoint.start_position or 1
+
+        while page is not None:
+            url = self.github.get_paginated_branches_url(page=page)
+            response = await self.transport.get(url=url, cacheable=True)
+            branches, page = self.github.read_branch_page(url=url, page=page, response=response)
+            if branches is not None:
+                yield branches
+
+    async def get_deletable_branches(
+            self,
+            last_commit_age_days: int,
+            ignore_branches: BranchMatcher,
+            allowed_prefixes: BranchMatcher,
+            branch_limit: int,
+    ) -> list[str]:
+        if branch_limit < 1:
+            return []
+
+        # Default branch might not be protected
+        setup = await self.gather_setup(self.get_default_branch(), self.get_open_pulls_index())
+        if setup is None:
+            return []
+        default_branch, open_pulls = setup
+
+        checks = CheckPipeline(checks=self.github.make_branch_checks(
+            default_branch=default_branch,
+            open_pulls=open_pulls,
+            last_commit_age_days=last_commit_age_days,
+            ignore_branches=ignore_branches,
+            allowed_prefixes=allowed_prefixes,
+            branch_info_cost=0,
+            commit_date_cost=1,
+        ))
+
+        return await self.evaluate_pages(
+            pages=self.iter_branch_pages(),
+            evaluate=lambda branch: self.evaluate_candidate(
+                candidate=self.github.make_branch_candidate(
+                    branch=branch,
+                    loaders=self.make_candidate_loaders(open_pulls=open_pulls),
+                ),
+                checks=checks,
+            ),
+            checks=checks,
+            branch_limit=branch_limit,
+        )
+
+    def make_candidate_loaders(self, open_pulls: OpenPullRequestIndex) -> dict:
+        async def load_commit_date(candidate: Candidate) -> str:
+            commit_url = await candidate.resolve(lambda: candidate.get('commit_url'))
+            if commit_url is None:
+                return None
+
+            return await self.get_commit_date(commit_url=commit_url)
+
+        return self.github.make_candidate_loaders(open_pulls=open_pulls, load_commit_date=load_commit_date)
+
+    async def evaluate_candidate(self, candidate: Candidate, checks: CheckPipeline) -> str:
+        """
+        Returns the name of the candidate's branch if it meets the criteria for deletion, None otherwise
+        """
+        async with self.semaphore:
+            detail(f'Analyzing {candidate.description}...')
+
+            rejected_by = await checks.evaluate_async(candidate=candidate)
+
+            return self.github.read_verdict(candidate=candidate, rejected_by=rejected_by)
+
+    async def gather_setup(self, *lookups: Awaitable) -> Optional[list]:
+        """
+        Runs the lookups a scan makes before its first page together, and returns None when they exhaust the request
+        budget. When one of them fails, the others are cancelled instead of being left running once the scan gives up.
+        """
+        tasks = [asyncio.ensure_future(lookup) for lookup in lookups]
+        try:
+            return await asyncio.gather(*tasks)
+        except RequestBudgetExhausted as ex:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            print(f'{ex}. Stopping before evaluating any branch')
+
+            return None
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    async def evaluate_pages(
+            self,
+            pages: AsyncIterator[list],
+            evaluate: Callable[[Any], Awaitable[Optional[str]]],
+            checks: CheckPipeline,
+            branch_limit: int,
+    ) -> list[str]:
+        """
+        Runs `evaluate` over every candidate of every page and returns the deletable branch names, in page order, up
+        to branch_limit. Candidates of later pages are started while earlier ones are still being evaluated, and the
+        next page is fetched in the background whenever fewer than `concurrency` candidates are pending.
+        """
+        deletable_branches = []
+        pending: deque[asyncio.Task] = deque()
+        next_page = asyncio.ensure_future(anext(pages, None))
+
+        # How many candidates of each page started are still pending, a page is done once it gets to 0
+        page_pending: deque[int] = deque()
+
+        def complete_pages() -> None:
+            while len(page_pending) > 0 and page_pending[0] == 0:
+                page_pending.popleft()
+                self.checkpoint.complete_page()
+
+        try:
+            while next_page is not None or len(pending) > 0:
+                if next_page is not None and self.checkpoint.deadline.expired():
+                    # Candidates already started are still collected, no new ones are
+                    print(f'Reached the deadline. Finishing the {len(pending)} branches under evaluation')
+                    next_page.cancel()
+                    await asyncio.gather(next_page, return_exceptions=True)
+                    next_page = None
+                    continue
+
+                if next_page is not None and len(pending) < self.concurrency and (next_page.done() or len(pending) == 0):
+                    candidates = await next_page
+                    if candidates is None:
+                        next_page = None
+                        continue
+
+                    pending.extend(asyncio.ensure_future(evaluate(candidate)) for candidate in candidates)
+                    page_pending.append(len(candidates))
+                    complete_pages()
+                    next_page = asyncio.ensure_future(anext(pages, None))
+                    continue
+
+                # Collecting in submission order keeps the result identical to a sequential scan
+                branch_name = await pending.popleft()
+                if branch_name is not None:
+                    # Before its page may be completed
+                    self.checkpoint.found(branch=branch_name)
+                page_pending[0] -= 1
+                complete_pages()
+                if branch_name is not None:
+                    deletable_branches.append(branch_name)
+
+                    # Exit early if we have reached our branch limit
+                    if len(deletable_branches) == branch_limit:
+                        break
+        except RequestBudgetExhausted as ex:
+            print(f'{ex}. Returning {len(deletable_branches)} branches')
+        finally:
+            leftovers = list(pending) + ([next_page] if next_page is not None else [])
+            for task in leftovers:
+                task.cancel()
+            await asyncio.gather(*leftovers, return_exceptions=True)
+
+            print(f'Branch checks: {checks.report()}')
+
+        return deletable_branches
+
+    async def iter_graphql_branch_pages(self) -> AsyncIterator[tuple]:
+        """
+        Yields each page of branches along with the name of the default branch
+        """
+        cursor = self.checkpoint.start_position
+        first = True
+
+        while cursor is not END:
+            branches, default_branch, after_cursor, has_next_page = await self.fetch_branches(after_cursor=cursor)
+            cursor = self.github.read_cursor_page(
+                nodes=branches,
+                cursor=cursor,
+                after_cursor=after_cursor,
+                has_next_page=has_next_page,
+                first=first,
+                what='branches',
+                last_branch=branches[-1].name if len(branches) > 0 else None,
+            )
+            if cursor is None:
+                return
+
+            yield self.checkpoint.pending(branches=branches), default_branch
+            first = False
+
+    async def get_deletable_branches_from_graphql(
+            self,
+            last_commit_age_days: int,
+            ignore_branches: BranchMatcher,
+            allowed_prefixes: BranchMatcher,
+            branch_limit: int,
+    ) -> list[str]:
+        if branch_limit < 1:
+            return []
+
+        pages = self.iter_graphql_branch_pages()
+
+        # Open pull requests can't be looked up by base from a ref, so check bases against the index. The default
+        # branch only comes with the pages.
+        setup = await self.gather_setup(self.get_open_pulls_index(), anext(pages))
+        if setup is None:
+            return []
+        open_pulls, (branches, default_branch) = setup
+
+        # Everything comes with the page, no check costs a request
+        checks = CheckPipeline(checks=self.github.make_branch_checks(
+            default_branch=default_branch,
+            open_pulls=open_pulls,
+            last_commit_age_days=last_commit_age_days,
+            ignore_branches=ignore_branches,
+            allowed_prefixes=allowed_prefixes,
+            branch_info_cost=0,
+            commit_date_cost=0,
+        ))
+
+        async def branch_pages() -> AsyncIterator[list]:
+            yield branches
+            async for next_branches, _ in pages:
+                yield next_branches
+
+        return await self.evaluate_pages(
+            pages=branch_pages(),
+            evaluate=lambda branch: self.evaluate_candidate(
+                candidate=self.github.make_graphql_branch_candidate(branch=branch, open_pulls=open_pulls),
+                checks=checks,
+            ),
+            checks=checks,
+            branch_limit=branch_limit,
+        )
+
+    async def iter_closed_pull_request_pages(self, older_than_days: int) -> AsyncIterator[list]:
+        seen_head_branches = set()
+        cursor = self.checkpoint.start_position
+        first = True
+
+        while cursor is not END:
+            closed_pull_requests, after_cursor, has_next_page = await self.fetch_pull_requests(after_cursor=cursor)
+            cursor = self.github.read_cursor_page(
+                nodes=closed_pull_requests,
+                cursor=cursor,
+                after_cursor=after_cursor,
+                has_next_page=has_next_page,
+                first=first,
+                what='pull requests',
+            )
+            if cursor is None:
+                return
+
+            yield self.github.drop_seen_head_branches(
+                pull_requests=closed_pull_requests,
+                seen=seen_head_branches,
+                older_than_days=older_than_days,
+            )
+            first = False
+
+    async def get_deletable_branches_from_closed_pull_requests(
+            self,
+            last_commit_age_days: int,
+            ignore_branches: BranchMatcher,
+            allowed_prefixes: BranchMatcher,
+            branch_limit: int,
+    ) -> list[str]:
+        if branch_limit < 1:
+            return []
+
+        # Default branch might not be protected
+        setup = await self.gather_setup(self.get_default_branch(), self.get_open_pulls_index())
+        if setup is None:
+            return []
+        default_branch, open_pulls = setup
+
+        checks = CheckPipeline(checks=self.github.make_pull_request_checks(
+            default_branch=default_branch,
+            open_pulls=open_pulls,
+            last_commit_age_days=last_commit_age_days,
+            ignore_branches=ignore_branches,
+            allowed_prefixes=allowed_prefixes,
+        ))
+
+        return await self.evaluate_pages(
+            pages=self.iter_closed_pull_request_pages(older_than_days=last_commit_age_days),
+            evaluate=lambda pull_request: self.evaluate_pull_request(
+                pull_request=pull_request,
+                open_pulls=open_pulls,
+                checks=checks,
+            ),
+            checks=checks,
+            branch_limit=branch_limit,
+        )
+
+    async def evaluate_pull_request(
+            self,
+            pull_request: PullRequestRecord,
+            open_pulls: OpenPullRequestIndex,
+            checks: CheckPipeline,
+    ) -> str:
+        """
+        Returns the name of the pull request's head branch if it meets the criteria for deletion, None otherwise
+        """
+        async def load_branch(candidate: Candidate) -> dict:
+            return await self.get_branch_info(branch=candidate.name) or {}
+
+        candidate = self.github.make_pull_request_candidate(
+            pull_request=pull_request,
+            open_pulls=open_pulls,
+            loaders={**self.make_candidate_loaders(open_pulls=open_pulls), 'branch': load_branch},
+        )
+        if candidate is None:
+            return None
+
+        return await self.evaluate_candidate(candidate=candidate, checks=checks)
+
+    async def delete_branches(self, branches: list[str], expected_hashes: dict[str, str] = None) -> dict[str, str]:
+        """
+        Same as Github.delete_branches: batches of deleteRef mutations, with the REST api as a fallback
+        """
+        results = {}
+
+        for batch in self.github.iter_delete_batches(branches=branches):
+            try:
+                batch_results = await self.delete_branches_with_graphql(branches=batch, expected_hashes=expected_hashes)
+                if batch_results is None:
+                    print('Could not delete branches through GraphQL, falling back to the REST api')
+                    batch_results = await self.delete_branches_with_rest(branches=batch, expected_hashes=expected_hashes)
+            except RequestBudgetExhausted as ex:
+                results.update(self.github.fail_remaining_deletions(branches=branches, results=results, ex=ex))
+                break
+
+            results.update(batch_results)
+
+        self.github.report_deletions(branches=branches, results=results)
+
+        return results
+
+    async def delete_branches_with_graphql(
+            self,
+            branches: list[str],
+            expected_hashes: dict[str, str] = None,
+    ) -> dict[str, str]:
+        """
+        Returns None if the refs could not be looked up or the mutation request failed altogether
+        """
+        data = await self.execute_graphql(query=self.github.make_ref_query(branches=branches), name='ref ids')
+        refs = self.github.parse_ref_ids(branches=branches, data=data, expected_hashes=expected_hashes)
+        if refs is None:
+            return None
+
+        results, ref_ids = refs
+        if len(ref_ids) == 0:
+            return results
+
+        data = await self.execute_graphql(query=self.github.make_delete_refs_mutation(ref_ids=ref_ids), name='deleteRef')
+
+        return self.github.parse_delete_refs_results(branches=branches, ref_ids=ref_ids, data=data, results=results)
+
+    async def delete_branches_with_rest(
+            self,
+            branches: list[str],
+            expected_hashes: dict[str, str] = None,
+    ) -> dict[str, str]:
+        async def delete_branch(branch: str) -> str:
+            async with self.semaphore:
+                return await self.delete_branch(branch=branch, expected_hashes=expected_hashes)
+
+        return dict(zip(branches, await asyncio.gather(*[delete_branch(branch) for branch in branches])))
+
+    async def delete_branch(self, branch: str, expected_hashes: dict[str, str] = None) -> str:
+        url = self.github.get_ref_url(branch=branch)
+
+        if expected_hashes is not None:
+            info = await self.get_branch_info(branch=branch)
+            head_result = self.github.parse_head(branch=branch, info=info, expected_hashes=expected_hashes)
+            if head_result is not None:
+                return head_result
+
+        response = await self.transport.request(method='DELETE', url=url)
+
+        return self.github.parse_delete_result(url=url, response=response)
+
+    async def get_default_branch(self) -> str:
+        response = await self.transport.get(url=self.github.get_repository_url(), cacheable=True)
+
+        return self.github.parse_default_branch(response=response)
+
+    async def get_branch_info(self, branch: str):
+        url = self.github.get_branch_url(branch=branch)
+
+        return self.github.parse_branch_info(url=url, response=await self.transport.get(url=url, cacheable=True))
+
+    async def get_open_pulls_index(self) -> OpenPullRequestIndex:
+        """
+        Pages through every open pull request once per run. The result is reused by all later branch checks.
+        """
+        if self.github.open_pulls is not None:
+            return self.github.open_pulls
+
+        open_pulls = OpenPullRequestIndex(repo=self.github.repo)
+        page = 1
+
+        while page is not None:
+            url = self.github.get_open_pulls_url(page=page)
+            response = await self.transport.get(url=url)
+            page = self.github.read_open_pulls_page(open_pulls=open_pulls, url=url, page=page, response=response)
+
+        return self.github.keep_open_pulls_index(open_pulls=open_pulls)
+
+    async def get_commit_date(self, commit_url: str) -> str:
+        commit_date_raw = self.github.get_cached_commit_date(commit_url=commit_url)
+        if commit_date_raw is not None:
+            return commit_date_raw
+
+        return self.github.parse_commit_date(commit_url=commit_url, response=await self.transport.get(url=commit_url))
+
+    async def execute_graphql(
+            self,
+            query: str,
+            name: str,
+            page_sizer: PageSizer = None,
+            page_size: int = None,
+    ) -> dict:
+        """
+        Same as Github.execute_graphql
+        """
+        request = self.github.make_graphql_request(query=query, name=name, page_sizer=page_sizer)
+        data = {}
+        attempt = 0
+
+        while True:
+            try:
+                response = await self.transport.request(**request)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f"Error fetching GraphQL result:\n{e}\ndata: {data}")
+                return data
+
+            data, delay = self.github.read_graphql_response(
+                response=response,
+                name=name,
+                attempt=attempt,
+                page_sizer=page_sizer,
+                page_size=page_size,
+            )
+            if delay is None:
+                return data
+
+            attempt += 1
+            print(f"Retrying in {delay:.1f} seconds (attempt {attempt})\n")
+            await asyncio.sleep(delay)
+
+    async def execute_paged_graphql(self, make_query: Callable[[int], str], page_sizer: PageSizer, name: str) -> dict:
+        """
+        Same as Github.execute_paged_graphql
+        """
+        while True:
+            page_size = page_sizer.get_size(points_left=self.transport.rate_limiter.points_left)
+            try:
+                return await self.execute_graphql(
+                    query=make_query(page_size),
+                    name=name,
+                    page_sizer=page_sizer,
+                    page_size=page_size,
+                )
+            except GraphqlTimeout as ex:
+                if self.github.shrink_timed_out_page(ex=ex, page_sizer=page_sizer, page_size=page_size) is False:
+                    return {}
+
+    async def fetch_pull_requests(self, after_cursor: str = None):
+        data = await self.execute_paged_graphql(
+            make_query=lambda count: self.github.make_pull_request_query(count, after_cursor),
+            page_sizer=self.github.pull_request_page_sizer,
+            name='pullRequests',
+        )
+
+        return self.github.parse_pull_requests(data=data)
+
+    async def fetch_branches(self, after_cursor: str = None):
+        data = await self.execute_paged_graphql(
+            make_query=lambda count: self.github.make_branch_query(count, after_cursor),
+            page_sizer=self.github.branch_page_sizer,
+            name='refs',
+        )
+
+        return self.github.parse_branches(data=data)
+
+
+class AsyncGithubFacade:
+    """
+    Blocking front to AsyncGithub, with the methods run_action uses on Github. Every call runs on the facade's own
+    event loop, so the connection pool lives on between calls until close().
+    """
+
+    def __init__(
+            self,
+            repo: str,
+            token: str,
+            base_url: str,
+            owner: str,
+            concurrency: int = 1,
+            transport: AsyncTransport = None,
+            commit_cache: CommitDateCache = None,
+            checkpoint: Checkpoint = None,
+            shard: Shard = None,
+            keep_plan: bool = False,
+    ):
+        self.loop = asyncio.new_event_loop()
+        self.github = AsyncGithub(
+            repo=repo,
+            token=token,
+            base_url=base_url,
+            owner=owner,
+            concurrency=concurrency,
+            transport=transport,
+            commit_cache=commit_cache,
+            checkpoint=checkpoint,
+            shard=shard,
+            keep_plan=keep_plan,
+        )
+
+    def get_deletable_branches(
+            self,
+            last_commit_age_days: int,
+            ignore_branches: BranchMatcher,
+            allowed_prefixes: BranchMatcher,
+            branch_limit: int,
+    ) -> list[str]:
+        return self.loop.run_until_complete(self.github.get_deletable_branches(
+            last_commit_age_days=last_commit_age_days,
+            ignore_branches=ignore_branches,
+            allowed_prefixes=allowed_prefixes,
+            branch_limit=branch_limit,
+        ))
+
+    def get_deletable_branches_from_graphql(
+            self,
+            last_commit_age_days: int,
+            ignore_branches: BranchMatcher,
+            allowed_prefixes: BranchMatcher,
+            branch_limit: int,
+    ) -> list[str]:
+        return self.loop.run_until_complete(self.github.get_deletable_branches_from_graphql(
+            last_commit_age_days=last_commit_age_days,
+            ignore_branches=ignore_branches,
+            allowed_prefixes=allowed_prefixes,
+            branch_limit=branch_limit,
+        ))
+
+    def get_deletable_branches_from_closed_pull_requests(
+            self,
+            last_commit_age_days: int,
+            ignore_branches: BranchMatcher,
+            allowed_prefixes: BranchMatcher,
+            branch_limit: int,
+    ) -> list[str]:
+        return self.loop.run_until_complete(self.github.get_deletable_branches_from_closed_pull_requests(
+            last_commit_age_days=last_commit_age_days,
+            ignore_branches=ignore_branches,
+            allowed_prefixes=allowed_prefixes,
+            branch_limit=branch_limit,
+        ))
+
+    def delete_branches(self, branches: list[str], expected_hashes: dict[str, str] = None) -> dict[str, str]:
+        return self.loop.run_until_complete(
+            self.github.delete_branches(branches=branches, expected_hashes=expected_hashes),
+        )
+
+    def get_plan(self, branches: list[str]) -> list[dict]:
+        return self.github.github.get_plan(branches=branches)
+
+    def close(self) -> None:
+        self.loop.run_until_complete(self.github.close())
+        self.loop.close()
@@ -0,0 +1,137 @@
+import asyncio
+from time import perf_counter
+
+import aiohttp
+from requests.models import Response
+
+from src.cache import ResponseCache
+from src.metrics import Metrics, endpoint_name
+from src.ratelimit import RETRYABLE_STATUS_CODES, RateLimiter
+from src.requests import CACHED_HEADERS, DEFAULT_POOL_SIZE, make_cached_response, make_response
+
+
+class AsyncTransport:
+    """
+    asyncio counterpart of Transport. A single aiohttp session, whose connector caps how many connections are open at
+    once, is shared by every request. Responses are handed back as requests Responses, so they are handled exactly
+    like the ones of the synchronous transport. Must only be used from one event loop.
+    """
+
+    def __init__(
+            self,
+            token: str = None,
+            pool_size: int = DEFAULT_POOL_SIZE,
+            rate_limiter: RateLimiter = None,
+            response_cache: ResponseCache = None,
+            metrics: Metrics = None,
+    ):
+        self.token = token
+        self.pool_size = pool_size
+        self.rate_limiter = RateLimiter() if rate_limiter is None else rate_limiter
+        self.response_cache = response_cache
+        self.metrics = metrics
+        self.session: aiohttp.ClientSession = None
+
+    def get_session(self) -> aiohttp.ClientSession:
+        # aiohttp sessions belong to the loop they're created in, so wait until there is one
+        if self.session is None:
+            headers = {'accept': 'application/vnd.github.v3+json'}
+            if self.token is not None:
+                headers['authorization'] = f'Bearer {self.token}'
+
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                headers=headers,
+            )
+
+        return self.session
+
+    async def get(self, url: str, headers: dict = None, cacheable: bool = False) -> Response:
+        if self.response_cache is None or cacheable is False:
+            return await self.request(method='get', url=url, headers=headers)
+
+        validators = self.response_cache.get_validators(url=url)
+        response = await self.request(method='get', url=url, headers={**(headers or {}), **validators})
+
+        if response.status_code == 304:
+            cached = self.response_cache.get(url=url)
+            if cached is not None:
+                return make_cached_response(url=url, headers=cached[0], body=cached[1])
+
+            # Evicted in the meantime, ask again without validators
+            return await self.request(method='get', url=url, headers=headers)
+
+        etag = response.headers.get('etag')
+        last_modified = response.headers.get('last-modified')
+        if response.status_code == 200 and (etag is not None or last_modified is not None):
+            self.response_cache.put(
+                url=url,
+                etag=etag,
+                last_modified=last_modified,
+                headers={name: response.headers[name] for name in CACHED_HEADERS if name in response.headers},
+                body=response.content,
+            )
+
+        return response
+
+    async def request(
+            self,
+            method: str,
+            url: str,
+            json: dict = None,
+            headers: dict = None,
+            resource: str = 'core',
+            endpoint: str = None,
+            retry_server_errors: bool = True,
+    ) -> Response:
+        attempt = 0
+        if self.metrics is not None and endpoint is None:
+            endpoint = endpoint_name(method=method, url=url)
+
+        while True:
+            delay = self.rate_limiter.reserve(resource=resource)
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            started = perf_counter()
+            try:
+                async with self.get_session().request(method=method, url=url, json=json, headers=headers) as raw:
+                    response = make_response(
+                        url=url,
+                        status_code=raw.status,
+                        headers=dict(raw.headers),
+                        body=await raw.read(),
+                        elapsed=perf_counter() - started,
+                    )
+            except (aiohttp.ClientError, asyncio.TimeoutError) as ex:
+                if self.metrics is not None:
+                    self.metrics.record_request(endpoint=endpoint, seconds=perf_counter() - started)
+
+                delay = self.rate_limiter.retry_delay(response=None, attempt=attempt)
+                if delay is None:
+                    raise ex
+
+                print(f'Request to {url} failed ({ex}). Retrying in {delay:.1f} seconds')
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+
+            if self.metrics is not None:
+                self.metrics.record_request(endpoint=endpoint, seconds=perf_counter() - started, response=response)
+
+            self.rate_limiter.record(response)
+
+            if retry_server_errors is False and response.status_code in RETRYABLE_STATUS_CODES:
+                return response
+
+            delay = self.rate_limiter.retry_delay(response=response, attempt=attempt)
+            if delay is None:
+                return response
+
+            print(f'Request to {url} returned {response.status_code}. Retrying in {delay:.1f} seconds')
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def close(self) -> None:
+        if self.session is not None:
+            await self.session.close()
@@ -0,0 +1,150 @@
+import json
+import threading
+from time import time
+
+DEFAULT_MAX_ENTRIES = 200_000
+
+
+def connect(path: str):
+    import sqlite3
+
+    return sqlite3.connect(path, check_same_thread=False)
+
+
+class CommitDateCache:
+    """
+    On-disk map of commit SHA to commit date. A commit's date never changes, so entries never go stale and are only
+    evicted, least recently used first, to keep the file under max_entries. Keep the file around between runs (for
+    instance with actions/cache) to skip fetching commits that were already seen.
+    """
+
+    def __init__(self, path: str, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        self.connection = connect(path=path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS commit_dates (sha TEXT PRIMARY KEY, date TEXT NOT NULL, last_used INTEGER)'
+        )
+        self.connection.execute('CREATE INDEX IF NOT EXISTS commit_dates_last_used ON commit_dates (last_used)')
+
+    def get(self, sha: str) -> str:
+        """
+        Returns the date of the given commit, or None if it's not cached
+        """
+        with self.lock:
+            row = self.connection.execute('SELECT date FROM commit_dates WHERE sha = ?', (sha,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.connection.execute('UPDATE commit_dates SET last_used = ? WHERE sha = ?', (int(time()), sha))
+
+            return row[0]
+
+    def put(self, sha: str, date: str) -> None:
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO commit_dates (sha, date, last_used) VALUES (?, ?, ?)',
+                (sha, date, int(time())),
+            )
+
+    def close(self) -> None:
+        with self.lock:
+            count = self.connection.execute('SELECT COUNT(*) FROM commit_dates').fetchone()[0]
+            if count > self.max_entries:
+                self.connection.execute(
+                    'DELETE FROM commit_dates WHERE sha IN '
+                    '(SELECT sha FROM commit_dates ORDER BY last_used ASC LIMIT ?)',
+                    (count - self.max_entries,),
+                )
+
+            self.connection.commit()
+            self.connection.close()
+
+    def report(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+class ResponseCache:
+    """
+    On-disk copy of GET responses along with their ETag / Last-Modified validators. Lets the transport make
+    conditional requests, which GitHub answers with a 304 that doesn't count against the rate limit when nothing
+    changed since the previous run.
+    """
+
+    def __init__(self, path: str, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        self.connection = connect(path=path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS responses '
+            '(url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, headers TEXT, body BLOB, last_used INTEGER)'
+        )
+        self.connection.execute('CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)')
+
+    def get_validators(self, url: str) -> dict:
+        """
+        Returns the conditional request headers to send for the given url, empty if there is no cached response
+        """
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT etag, last_modified FROM responses WHERE url = ?', (url,)
+            ).fetchone()
+
+        if row is None:
+            return {}
+
+        headers = {}
+        if row[0] is not None:
+            headers['if-none-match'] = row[0]
+        if row[1] is not None:
+            headers['if-modified-since'] = row[1]
+
+        return headers
+
+    def get(self, url: str) -> tuple:
+        """
+        Returns the cached headers and body for the given url, after the server confirmed they're still current
+        """
+        with self.lock:
+            row = self.connection.execute('SELECT headers, body FROM responses WHERE url = ?', (url,)).fetchone()
+            if row is None:
+                return None
+
+            self.hits += 1
+            self.connection.execute('UPDATE responses SET last_used = ? WHERE url = ?', (int(time()), url))
+
+        return (json.loads(row[0]), row[1])
+
+    def put(self, url: str, etag: str, last_modified: str, headers: dict, body: bytes) -> None:
+        with self.lock:
+            self.misses += 1
+            self.connection.execute(
+                'INSERT OR REPLACE INTO responses (url, etag, last_modified, headers, body, last_used) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (url, etag, last_modified, json.dumps(headers), body, int(time())),
+            )
+
+    def close(self) -> None:
+        with self.lock:
+            count = self.connection.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+            if count > self.max_entries:
+                self.connection.execute(
+                    'DELETE FROM responses WHERE url IN (SELECT url FROM responses ORDER BY last_used ASC LIMIT ?)',
+                    (count - self.max_entries,),
+                )
+
+            self.connection.commit()
+            self.connection.close()
+
+    def report(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,227 @@
+import json
+import os
+import threading
+from collections import deque
+from time import monotonic
+from typing import Any
+
+# Share of max_runtime spent scanning, the rest is left to delete what was found and save the checkpoint
+SCAN_SHARE = 0.8
+
+
+class Deadline:
+    """
+    Point in time past which a run stops evaluating branches. Never expires without a number of seconds.
+    """
+
+    def __init__(self, seconds: float = 0):
+        self.seconds = seconds
+        self.expires_at = monotonic() + seconds if seconds > 0 else None
+
+    def expired(self) -> bool:
+        return self.expires_at is not None and monotonic() >= self.expires_at
+
+
+class Checkpoint:
+    """
+    Where a scan that stopped early, at its deadline, its budget or its branch limit, left off, so that the next run
+    of the same scan resumes there instead of starting over. Pages are recorded as they are fetched, along with the
+    position the next page starts at (a REST page number or a GraphQL cursor), and marked done once every candidate
+    on them was evaluated.
+
+    Both page numbers and cursors count branches, so deleting branches shifts the pages after them. The position
+    saved is moved back over enough pages to make up for the branches deleted, and the next run skips branches up
+    to the last one evaluated, which it can do because branches are listed by name. When a branch could not be
+    deleted, the checkpoint goes back to before its page, for the next run to find it again.
+    """
+
+    def __init__(self, path: str = None, mode: str = None, deadline: Deadline = None):
+        self.path = path
+        self.mode = mode
+        self.deadline = Deadline() if deadline is None else deadline
+        self.lock = threading.Lock()
+
+        # Left by the previous runs of the scan
+        self.start_position: Any = None
+        self.resume_after: str = None
+        self.deletable: list[str] = []
+        self.runs = 0
+
+        if path is not None and os.path.exists(path):
+            with open(path) as checkpoint_file:
+                saved = json.load(checkpoint_file)
+
+            if saved.get('mode') == mode:
+                self.start_position = saved.get('position')
+                self.resume_after = saved.get('last_branch')
+                self.deletable = saved.get('deletable', [])
+                self.runs = saved.get('runs', 0)
+            else:
+                print(f'Ignoring the checkpoint of a {saved.get("mode")} scan, starting a {mode} scan over')
+
+        # Pages fetched but not evaluated yet and pages evaluated, as (length, position after it, last branch)
+        self.fetched: deque[tuple] = deque()
+        self.done: list[tuple] = []
+
+        # Index in `done` of the page each deletable branch was found on
+        self.found_on: dict[str, int] = {}
+        self.last_branch = self.resume_after
+        self.exhausted = False
+
+    @property
+    def resumed(self) -> bool:
+        return self.runs > 0
+
+    @property
+    def finished(self) -> bool:
+        """
+        Whether the scan got through its last page
+        """
+        with self.lock:
+            return self.exhausted is True and len(self.fetched) == 0
+
+    def add_page(self, length: int, position: Any, last_branch: str = None) -> None:
+        """
+        Records a page of `length` candidates as fetched. `position` is where the page after it starts.
+        """
+        with self.lock:
+            self.fetched.append((length, position, last_branch))
+
+    def pending(self, branches: list) -> list:
+        """
+        The branches of a page not evaluated by a previous run yet
+        """
+        if self.resume_after is None:
+            return branches
+
+        return [branch for branch in branches if branch.name > self.resume_after]
+
+    def complete_page(self) -> None:
+        """
+        Marks the oldest page fetched as evaluated. Pages are evaluated in the order they are fetched.
+        """
+        with self.lock:
+            length, position, last_branch = self.fetched.popleft()
+            self.done.append((length, position, last_branch))
+            if last_branch is not None:
+                self.last_branch = last_branch
+
+    def found(self, branch: str) -> None:
+        """
+        Records `branch` as deletable, found on the oldest page not evaluated yet
+        """
+        with self.lock:
+            self.found_on[branch] = len(self.done)
+
+    def rewind(self, pages: int) -> None:
+        """
+        Forgets every page evaluated after the first `pages` ones, for the next run to evaluate them again
+        """
+        with self.lock:
+            self.done = self.done[:pages]
+            self.last_branch = next(
+                (last_branch for _, _, last_branch in reversed(self.done) if last_branch is not None),
+                self.resume_after,
+            )
+            self.exhausted = False
+
+    def end(self) -> None:
+        """
+        Called once there are no pages left to fetch
+        """
+        with self.lock:
+            self.exhausted = True
+
+    def get_resume_position(self, deleted: int) -> Any:
+        """
+        Where the next run starts: after the last page evaluated, moved back over as many pages as it takes to make
+        up for `deleted` branches
+        """
+        position = self.done[-1][1] if len(self.done) > 0 else self.start_position
+        shifted = 0
+        for index in range(len(self.done) - 1, -1, -1):
+            if shifted >= deleted:
+                break
+
+            shifted += self.done[index][0]
+            position = self.done[index - 1][1] if index > 0 else self.start_position
+
+        return position
+
+    def save(self, deletable: list[str], deleted: int = 0, failed: list[str] = None) -> None:
+        """
+        Saves where the scan stopped, or removes the checkpoint once the scan got through every page. `deletable` is
+        what this run found, `deleted` how many branches it removed from the listing and `failed` the ones it could
+        not delete.
+        """
+        if self.path is None:
+            return
+
+        failed_pages = [self.found_on[branch] for branch in failed or [] if branch in self.found_on]
+        if len(failed_pages) > 0:
+            pages = min(failed_pages)
+            print(f'Could not delete {len(failed_pages)} branches, the next run evaluates them again')
+            self.rewind(pages=pages)
+
+            # Only branches of the pages kept count, the next run finds the others again
+            deletable = [branch for branch in deletable if self.found_on.get(branch, pages) < pages]
+            deleted = min(deleted, len(deletable))
+
+        self.deletable.extend(deletable)
+
+        if self.finished is True:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+            if self.resumed is True:
+                print(
+                    f'Scan complete after {self.runs + 1} runs, {len(self.deletable)} branches were found deletable '
+                    f'along the way: {self.deletable}'
+                )
+            return
+
+        with open(self.path, 'w') as checkpoint_file:
+            json.dump({
+                'mode': self.mode,
+                'position': self.get_resume_position(deleted=deleted),
+                'last_branch': self.last_branch,
+                'deletable': self.deletable,
+                'runs': self.runs + 1,
+            }, checkpoint_file)
+
+        if self.last_branch is not None:
+            print(f'Scan stopped early, the next run resumes after branch `{self.last_branch}`')
+        else:
+            print(f'Scan stopped early after {len(self.done)} pages, the next run resumes from there')
+
+
+class SweepCheckpoint:
+    """
+    The repository a sweep of a whole owner stopped at, so the next sweep starts from it rather than from the first
+    repository again, and every repository gets its turn however long the first ones take
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.next_repository: str = None
+
+        if os.path.exists(path):
+            with open(path) as checkpoint_file:
+                self.next_repository = json.load(checkpoint_file).get('next_repository')
+
+    def order(self, repositories: list[str]) -> list[str]:
+        if self.next_repository not in repositories:
+            return repositories
+
+        index = repositories.index(self.next_repository)
+
+        return repositories[index:] + repositories[:index]
+
+    def save(self, next_repository: str = None) -> None:
+        if next_repository is None:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return
+
+        with open(self.path, 'w') as checkpoint_file:
+            json.dump({'next_repository': next_repository}, checkpoint_file)
@@ -0,0 +1,148 @@
+import inspect
+import threading
+from typing import Any, Callable
+
+# How many candidates to evaluate between two reorderings of a pipeline
+REORDER_EVERY = 20
+
+
+class NotLoaded(Exception):
+    """
+    Raised when a value is read that only an async loader can provide and it hasn't been loaded yet
+    """
+
+    def __init__(self, key: str):
+        super().__init__(f'`{key}` must be loaded asynchronously first')
+        self.key = key
+
+
+class Candidate:
+    """
+    A branch under evaluation. Values that cost a request to find out are only loaded, through `loaders`, the first
+    time a check reads them, so the order checks run in decides what gets paid for. Loaders may be coroutines, in
+    which case reads must go through `resolve`.
+    """
+
+    def __init__(self, name: str, description: str, loaders: dict[str, Callable[['Candidate'], Any]] = None, **values):
+        self.name = name
+        self.description = description
+        self.loaders = loaders or {}
+        self.values = values
+
+    def get(self, key: str) -> Any:
+        if key not in self.values:
+            loader = self.loaders[key]
+            if inspect.iscoroutinefunction(loader):
+                raise NotLoaded(key)
+
+            self.values[key] = loader(self)
+
+        return self.values[key]
+
+    async def resolve(self, read: Callable[[], Any]) -> Any:
+        """
+        Calls `read` until it gets through, awaiting the async loader of every value it needed but wasn't loaded
+        yet. `read` may run more than once, so it must not have side effects before its last get().
+        """
+        while True:
+            try:
+                return read()
+            except NotLoaded as ex:
+                self.values[ex.key] = await self.loaders[ex.key](self)
+
+
+class Check:
+    """
+    A single eligibility rule. `passes` returns false to reject a branch, `cost` is roughly how many requests it
+    takes to decide and `reason` explains a rejection, formatted with the candidate's name and values.
+    """
+
+    def __init__(self, name: str, cost: float, passes: Callable[[Candidate], bool], reason: str):
+        self.name = name
+        self.cost = cost
+        self.passes = passes
+        self.reason = reason
+        self.evaluated = 0
+        self.rejected = 0
+
+    @property
+    def rejection_rate(self) -> float:
+        # Smoothed so checks that haven't run yet are neither favoured nor starved
+        return (self.rejected + 1) / (self.evaluated + 2)
+
+    @property
+    def rank(self) -> float:
+        """
+        Expected cost of running this check per rejection, cheapest first
+        """
+        return self.cost / self.rejection_rate
+
+    def format_reason(self, candidate: Candidate) -> str:
+        return self.reason.format(name=candidate.name, **candidate.values)
+
+
+class CheckPipeline:
+    """
+    Runs checks until one rejects the candidate. A branch is deletable only if every check passes, so their order
+    doesn't change verdicts, only cost. The pipeline records how often each check rejects and keeps cheap checks
+    that reject a lot at the front.
+    """
+
+    def __init__(self, checks: list[Check]):
+        # Until rejection rates are known, simply run the cheapest checks first
+        self.checks = sorted(checks, key=lambda check: check.rank)
+        self.evaluations = 0
+        self.lock = threading.Lock()
+
+    def evaluate(self, candidate: Candidate) -> Check:
+        """
+        Returns the first check that rejects the candidate, None if it passes them all
+        """
+        rejected_by = None
+        ran = []
+
+        for check in self.checks:
+            ran.append(check)
+            if check.passes(candidate) is not True:
+                rejected_by = check
+                break
+
+        self.record(ran=ran, rejected_by=rejected_by)
+
+        return rejected_by
+
+    async def evaluate_async(self, candidate: Candidate) -> Check:
+        """
+        Same as evaluate, for candidates with async loaders
+        """
+        rejected_by = None
+        ran = []
+
+        for check in self.checks:
+            ran.append(check)
+            if await candidate.resolve(lambda: check.passes(candidate)) is not True:
+                rejected_by = check
+                break
+
+        self.record(ran=ran, rejected_by=rejected_by)
+
+        return rejected_by
+
+    def record(self, ran: list[Check], rejected_by: Check) -> None:
+        with self.lock:
+            for check in ran:
+                check.evaluated += 1
+            if rejected_by is not None:
+                rejected_by.rejected += 1
+
+            self.evaluations += 1
+            if self.evaluations % REORDER_EVERY == 0:
+                # Stable sort, so checks of equal rank keep their declared order
+                self.checks = sorted(self.checks, key=lambda check: check.rank)
+
+    def report(self) -> list[dict]:
+        with self.lock:
+            return [
+                {'check': check.name, 'cost': check.cost, 'evaluated': check.evaluated, 'rejected': check.rejected}
+                for check in self.checks
+            ]
@@ -1,268 +1,1133 @@
+import json
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
+from functools import partial
+from itertools import chain
 from time import sleep
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Iterator, Optional, Union
+from urllib.parse import parse_qs, urlparse
 
-from src import requests
+from src.cache import CommitDateCache
+from src.checkpoint import Checkpoint
+from src.checks import Candidate, Check, CheckPipeline
+from src.local_git import LocalRepository
+from src.log import detail
+from src.matcher import BranchMatcher
+from src.pages import PageSizer, Prefetcher
+from src.pulls import OpenPullRequestIndex
+from src.metrics import Metrics
+from src.ratelimit import RETRYABLE_STATUS_CODES, RateLimiter, RequestBudgetExhausted
+from src.records import BranchRecord, PullRequestRecord, read_graphql_object, read_rest_object, to_datetime
+from src.requests import DEFAULT_POOL_SIZE, Transport
+from src.shard import Shard
+
+import requests
+from requests.models import Response
+
+if TYPE_CHECKING:
+    from src.async_requests import AsyncTransport
+
+
+BRANCH_PAGE_SIZE = 30
+
+DELETE_BATCH_SIZE = 50
+
+# Nodes per GraphQL page, the most a connection can return at once. Pages get smaller when they're slow, time out or
+# would cost more points than the budget has left
+GRAPHQL_PAGE_SIZE = 100
+
+# Branches of a local clone cost nothing to list, pages only set how often the branch limit is looked at
+LOCAL_BRANCH_PAGE_SIZE = 100
+
+# Returned by read_cursor_page once a connection has no pages left, None being the cursor of the first page
+END = object()
+
+DELETED = 'deleted'
+ALREADY_GONE = 'already_gone'
+FAILED = 'failed'
+# The branch's head is no longer the commit it was found deletable on
+MOVED = 'moved'
+
+
+class GraphqlTimeout(RuntimeError):
+    pass
 
-from python_graphql_client import GraphqlClient
 
 class Github:
-    def __init__(self, repo: str, token: str, base_url: str, owner: str):
+    def __init__(
+            self,
+            repo: str,
+            token: str,
+            base_url: str,
+            owner: str,
+            concurrency: int = 1,
+            transport: Union[Transport, 'AsyncTransport'] = None,
+            commit_cache: CommitDateCache = None,
+            checkpoint: Checkpoint = None,
+            shard: Shard = None,
+            keep_plan: bool = False,
+    ):
         self.token = token
         self.repo = repo
         self.base_url = base_url
         self.owner = owner
-        self.client = GraphqlClient(endpoint="https://api.github.com/graphql")
-
-    def make_headers(self) -> dict:
-        return {
-            'authorization': f'Bearer {self.token}',
-            'content-type': 'application/vnd.github.v3+json',
-        }
+        self.open_pulls: OpenPullRequestIndex = None
+        self.concurrency = concurrency
+        self.executor: ThreadPoolExecutor = None
+        self.commit_cache = commit_cache
+        self.checkpoint = Checkpoint() if checkpoint is None else checkpoint
+        self.shard = Shard() if shard is None else shard
+        self.branch_page_sizer = PageSizer(max_size=GRAPHQL_PAGE_SIZE)
+        self.pull_request_page_sizer = PageSizer(max_size=GRAPHQL_PAGE_SIZE)
+
+        # What the deletion plan says of every branch found deletable, by name. Only kept when a plan is written.
+        self.plan_entries: dict[str, dict] = {} if keep_plan is True else None
+
+        # Every worker needs its own connection, otherwise they queue up for the pool. An AsyncTransport when lent to
+        # AsyncGithub, which makes the requests and only uses the rest
+        if transport is None:
+            transport = Transport(token=token, pool_size=max(concurrency, DEFAULT_POOL_SIZE))
+        self.transport = transport
+
+    def close(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def get_graphql_url(self) -> str:
+        # Github Enterprise serves the REST api under /api/v3 and GraphQL under /api/graphql
+        if self.base_url.endswith('/api/v3'):
+            return f'{self.base_url[:-len("/v3")]}/graphql'
+
+        return f'{self.base_url}/graphql'
 
     def get_paginated_branches_url(self, page: int = 0) -> str:
-        return f'{self.base_url}/repos/{self.repo}/branches?protected=false&per_page=30&page={page}'
+        return f'{self.base_url}/repos/{self.repo}/branches?protected=false&per_page={BRANCH_PAGE_SIZE}&page={page}'
+
+    def iter_branch_pages(self) -> Iterator[list]:
+        page = self.checkpoint.start_position or 1
+
+        while page is not None:
+            url = self.get_paginated_branches_url(page=page)
+            response = self.transport.get(url=url, cacheable=True)
+            branches, page = self.read_branch_page(url=url, page=page, response=response)
+            if branches is not None:
+                yield branches
+
+    def read_branch_page(self, url: str, page: int, response: Response) -> tuple[Optional[list], Optional[int]]:
+        """
+        Records a page of branches. Returns those left to evaluate, None if the page was empty, and the number of the
+        next page, None after the last one.
+        """
+        if response.status_code != 200:
+            raise RuntimeError(f'Failed to make request to {url}. {response} {response.json()}')
+
+        # Read straight into records, the page's objects don't stay around
+        branches: list[BranchRecord] = json.loads(response.content, object_hook=read_rest_object)
+        pending = None
+        if len(branches) > 0:
+            self.checkpoint.add_page(length=len(branches), position=page + 1, last_branch=branches[-1].name)
+            pending = self.checkpoint.pending(branches=branches)
+
+        # A short page is the last one, no need to ask for an empty one after it
+        if len(branches) < BRANCH_PAGE_SIZE:
+            self.checkpoint.end()
+            return pending, None
+
+        return pending, page + 1
 
     def get_deletable_branches(
             self,
             last_commit_age_days: int,
-            ignore_branches: list[str],
-            allowed_prefixes: list[str],
+            ignore_branches: BranchMatcher,
+            allowed_prefixes: BranchMatcher,
             branch_limit: int,
     ) -> list[str]:
+        return list(self.iter_deletable_branches(
+            last_commit_age_days=last_commit_age_days,
+            ignore_branches=ignore_branches,
+            allowed_prefixes=allowed_prefixes,
+            branch_limit=branch_limit,
+        ))
+
+    def iter_deletable_branches(
+            self,
+            last_commit_age_days: int,
+            ignore_branches: BranchMatcher,
+            allowed_prefixes: BranchMatcher,
+            branch_limit: int,
+    ) -> Iterator[str]:
+        """
+        Yields deletable branches in page order as soon as they're found. The next page of branches is fetched while
+        the current one is evaluated.
+        """
         if branch_limit < 1:
-            return []
+            return
+
+        # The first page comes in while the default branch and open pull requests are looked up
+        pages = Prefetcher(pages=self.iter_branch_pages())
+
+        with self.scanning(pages=pages):
+            # Default branch might not be protected
+            default_branch = self.get_default_branch()
+            open_pulls = self.get_open_pulls_index()
+
+            checks = CheckPipeline(checks=self.make_branch_checks(
+                default_branch=default_branch,
+                open_pulls=open_pulls,
+                last_commit_age_days=last_commit_age_days,
+                ignore_branches=ignore_branches,
+                allowed_prefixes=allowed_prefixes,
+                branch_info_cost=0,
+                commit_date_cost=1,
+            ))
+
+            yield from self.evaluate_pages(
+                pages=pages,
+                evaluate=lambda branch: self.evaluate_candidate(
+                    candidate=self.make_branch_candidate(
+                        branch=branch,
+                        loaders=self.make_candidate_loaders(open_pulls=open_pulls),
+                    ),
+                    checks=checks,
+                ),
+                checks=checks,
+                branch_limit=branch_limit,
+            )
 
-        # Default branch might not be protected
-        default_branch = self.get_default_branch()
+    @contextmanager
+    def scanning(self, pages: Union[Prefetcher, Iterator]):
+        """
+        Closes the pages of a scan once it's over. evaluate_pages keeps what it found when the request budget runs out,
+        only the lookups a scan makes before its first page get here.
+        """
+        try:
+            yield
+        except RequestBudgetExhausted as ex:
+            print(f'{ex}. Stopping before evaluating any branch')
+        finally:
+            pages.close()
+
+    def make_branch_checks(
+            self,
+            default_branch: str,
+            open_pulls: OpenPullRequestIndex,
+            last_commit_age_days: int,
+            ignore_branches: BranchMatcher,
+            allowed_prefixes: BranchMatcher,
+            branch_info_cost: float,
+            commit_date_cost: float,
+    ) -> list[Check]:
+        """
+        The criteria a branch must meet to be deleted. Costs depend on the scan: some get protection and head commit
+        along with the branch name, others have to look them up (branch_info_cost) before fetching the commit date.
+        """
+        checks = [
+            Check(
+                name='default branch',
+                cost=0,
+                passes=lambda candidate: candidate.name != default_branch,
+                reason='Ignoring `{name}` because it is the default branch',
+            ),
+            # We're usually retrieving non-protected branches from the API already, but it pays being careful when
+            # dealing with third party apis
+            Check(
+                name='protected',
+                cost=branch_info_cost,
+                passes=lambda candidate: candidate.get('protected') is not True,
+                reason='Ignoring `{name}` because it is protected',
+            ),
+            Check(
+                name='ignored branches',
+                cost=0,
+                passes=lambda candidate: not ignore_branches.matches(candidate.name),
+                reason='Ignoring `{name}` because it is on the list of ignored branch prefixes',
+            ),
+            # If allowed_prefixes are provided, only consider branches that match one of the prefixes
+            Check(
+                name='allowed prefixes',
+                cost=0,
+                passes=lambda candidate: len(allowed_prefixes) == 0 or allowed_prefixes.matches(candidate.name),
+                reason='Ignoring `{name}` because it does not match any provided allowed_prefixes',
+            ),
+            Check(
+                name='open pull requests',
+                cost=branch_info_cost,
+                passes=lambda candidate: candidate.get('has_open_pulls') is not True,
+                reason='Ignoring `{name}` because it has open pull requests',
+            ),
+            Check(
+                name='pull request base',
+                cost=0,
+                passes=lambda candidate: open_pulls.is_pull_request_base(branch=candidate.name) is False,
+                reason='Ignoring `{name}` because it is the base for a pull request of another branch',
+            ),
+            Check(
+                name='last commit age',
+                cost=branch_info_cost + commit_date_cost,
+                passes=lambda candidate: self.is_date_older_than(
+                    date_raw=candidate.get('commit_date'),
+                    older_than_days=last_commit_age_days,
+                ),
+                reason=f'Ignoring `{{name}}` because last commit is newer than {last_commit_age_days} days',
+            ),
+        ]
+
+        # Branches of the other shards are left to their own jobs, before anything is paid for them
+        if self.shard.count > 1:
+            checks.insert(0, Check(
+                name='shard',
+                cost=0,
+                passes=lambda candidate: self.shard.owns(candidate.name),
+                reason=f'Ignoring `{{name}}` because it belongs to another shard than {self.shard.index}',
+            ))
+
+        return checks
+
+    def make_candidate_loaders(self, open_pulls: OpenPullRequestIndex, load_commit_date: Callable = None) -> dict:
+        """
+        Loaders for the values that take a request or a lookup, shared by branch and pull request candidates. Scans
+        that make their requests some other way pass their own load_commit_date.
+        """
+        def load_commit_date_with_request(candidate: Candidate) -> str:
+            if candidate.get('commit_url') is None:
+                return None
 
-        url = self.get_paginated_branches_url()
-        headers = self.make_headers()
+            return self.get_commit_date(commit_url=candidate.get('commit_url'))
 
-        response = requests.get(url=url, headers=headers)
-        if response.status_code != 200:
-            raise RuntimeError(f'Failed to make request to {url}. {response} {response.json()}')
+        return {
+            'has_open_pulls': lambda candidate: open_pulls.has_open_pulls(
+                branch=candidate.name,
+                commit_hash=candidate.get('commit_hash'),
+            ),
+            'commit_date': load_commit_date or load_commit_date_with_request,
+        }
 
-        deletable_branches = []
-        branch: dict
-        branches: list = response.json()
-        current_page = 1
-
-        while len(branches) > 0:
-            for branch in branches:
-                branch_name = branch.get('name')
-
-                commit_hash = branch.get('commit', {}).get('sha')
-                commit_url = branch.get('commit', {}).get('url')
-
-                print(f'Analyzing branch `{branch_name}`...')
-
-                # Immediately discard protected branches, default branch, ignored branches and branches not in prefix
-                if branch_name == default_branch:
-                    print(f'Ignoring `{branch_name}` because it is the default branch')
-                    continue
-
-                # We're already retrieving non-protected branches from the API, but it pays being careful when dealing
-                # with third party apis
-                if branch.get('protected') is True:
-                    print(f'Ignoring `{branch_name}` because it is protected')
-                    continue
-                
-                found_ignored_prefix = False
-                for prefix in ignore_branches:
-                    if branch_name.startswith(prefix):
-                        found_ignored_prefix = True
+    def make_branch_candidate(self, branch: BranchRecord, loaders: dict) -> Candidate:
+        return Candidate(
+            name=branch.name,
+            description=f'branch `{branch.name}`',
+            loaders=loaders,
+            protected=branch.protected,
+            commit_hash=branch.commit_hash,
+            commit_url=self.get_commit_url(commit_hash=branch.commit_hash),
+        )
+
+    def get_commit_url(self, commit_hash: str) -> str:
+        # The url the api gives along with every branch, built when needed rather than kept for every branch
+        if commit_hash is None:
+            return None
+
+        return f'{self.base_url}/repos/{self.repo}/commits/{commit_hash}'
+
+    def evaluate_candidate(self, candidate: Candidate, checks: CheckPipeline) -> str:
+        """
+        Returns the name of the candidate's branch if it meets the criteria for deletion, None otherwise
+        """
+        detail(f'Analyzing {candidate.description}...')
+
+        return self.read_verdict(candidate=candidate, rejected_by=checks.evaluate(candidate=candidate))
+
+    def read_verdict(self, candidate: Candidate, rejected_by: Optional[Check]) -> Optional[str]:
+        """
+        Logs what the checks made of a candidate. Returns the name of its branch if none of them rejected it.
+        """
+        if rejected_by is not None:
+            detail(rejected_by.format_reason(candidate=candidate))
+            return None
+
+        detail(f'Branch `{candidate.name}` meets the criteria for deletion')
+        if self.plan_entries is not None:
+            self.record_plan_entry(candidate=candidate)
+
+        return candidate.name
+
+    def record_plan_entry(self, candidate: Candidate) -> None:
+        """
+        Keeps what a deletion plan needs of a deletable candidate. Only reads values the checks already loaded, a
+        branch that passed them all had its head commit and its dates looked up.
+        """
+        reasons = []
+        if candidate.values.get('url') is not None:
+            days = self.get_days_since(date_raw=candidate.values.get('updated_at'))
+            reasons.append(f'pull request {candidate.values.get("url")} closed and last updated {days} days ago')
+        if candidate.values.get('commit_date') is not None:
+            reasons.append(f'last commit {self.get_days_since(date_raw=candidate.values.get("commit_date"))} days ago')
+        reasons.append('not protected, ignored nor needed by an open pull request')
+
+        self.plan_entries[candidate.name] = {
+            'branch': candidate.name,
+            'commit_hash': candidate.values.get('commit_hash'),
+            'reason': ', '.join(reasons),
+        }
+
+    def get_plan(self, branches: list[str]) -> list[dict]:
+        return [self.plan_entries[branch] for branch in branches]
+
+    def evaluate_pages(
+            self,
+            pages: Iterable[list],
+            evaluate: Callable[[Any], Optional[str]],
+            checks: CheckPipeline,
+            branch_limit: int,
+    ) -> Iterator[str]:
+        """
+        Runs `evaluate` over every candidate of every page and yields the deletable branch names it returns, in page
+        order, until branch_limit is reached. With concurrency, candidates of later pages are started while earlier
+        ones are still being evaluated, and the next page is taken whenever fewer than `concurrency` are pending.
+        """
+        found = 0
+        pages = iter(pages)
+        exhausted = False
+        # Candidates started, as futures of the executor or, without concurrency, evaluations left for when collected
+        pending: deque[Union[Future, partial]] = deque()
+
+        # How many candidates of each page started are still pending, a page is done once it gets to 0
+        page_pending: deque[int] = deque()
+
+        def complete_pages() -> None:
+            while len(page_pending) > 0 and page_pending[0] == 0:
+                page_pending.popleft()
+                self.checkpoint.complete_page()
+
+        try:
+            while True:
+                while not exhausted and len(pending) < max(self.concurrency, 1):
+                    if self.checkpoint.deadline.expired():
+                        # Candidates already started are still collected, no new ones are
+                        print(f'Reached the deadline. Finishing the {len(pending)} branches under evaluation')
+                        exhausted = True
                         break
-                if found_ignored_prefix is True:
-                    print(f'Ignoring `{branch_name}` because it is on the list of ignored branch prefixes')
-                    continue
-
-                # If allowed_prefixes are provided, only consider branches that match one of the prefixes
-                if len(allowed_prefixes) > 0:
-                    found_prefix = False
-                    for prefix in allowed_prefixes:
-                        if branch_name.startswith(prefix):
-                            found_prefix = True
-                    if found_prefix is False:
-                        print(f'Ignoring `{branch_name}` because it does not match any provided allowed_prefixes')
-                        continue
-
-                # Move on if commit is in an open pull request
-                if self.has_open_pulls(commit_hash=commit_hash):
-                    print(f'Ignoring `{branch_name}` because it has open pull requests')
-                    continue
-
-                # Move on if branch is base for a pull request
-                if self.is_pull_request_base(branch=branch_name):
-                    print(f'Ignoring `{branch_name}` because it is the base for a pull request of another branch')
-                    continue
-
-                # Move on if last commit is newer than last_commit_age_days
-                if self.is_commit_older_than(commit_url=commit_url, older_than_days=last_commit_age_days) is False:
-                    print(f'Ignoring `{branch_name}` because last commit is newer than {last_commit_age_days} days')
-                    continue
-
-                print(f'Branch `{branch_name}` meets the criteria for deletion')
-                deletable_branches.append(branch_name)
-
-                # Exit early if we have reached our branch limit
-                if len(deletable_branches) == branch_limit:
-                    return deletable_branches
-
-            # Re-request next page
-            current_page += 1
-
-            response = requests.get(url=self.get_paginated_branches_url(page=current_page), headers=headers)
-            if response.status_code != 200:
-                raise RuntimeError(f'Failed to make request to {url}. {response} {response.json()}')
 
-            branches: list = response.json()
+                    candidates = next(pages, None)
+                    if candidates is None:
+                        exhausted = True
+                        break
+
+                    pending.extend(
+                        self.start_evaluation(candidate=candidate, evaluate=evaluate) for candidate in candidates
+                    )
+                    page_pending.append(len(candidates))
+                    complete_pages()
+
+                if len(pending) == 0:
+                    return
+
+                # Collecting in submission order keeps the result identical to a sequential scan
+                result = pending.popleft()
+                branch_name = result.result() if isinstance(result, Future) else result()
+                if branch_name is not None:
+                    # Before its page may be completed
+                    self.checkpoint.found(branch=branch_name)
+                page_pending[0] -= 1
+                complete_pages()
+                if branch_name is not None:
+                    yield branch_name
+
+                    # Exit early if we have reached our branch limit
+                    found += 1
+                    if found == branch_limit:
+                        return
+        except RequestBudgetExhausted as ex:
+            print(f'{ex}. Stopping after {found} branches')
+        finally:
+            for result in pending:
+                if isinstance(result, Future):
+                    result.cancel()
+
+            print(f'Branch checks: {checks.report()}')
+
+    def start_evaluation(
+            self,
+            candidate: Any,
+            evaluate: Callable[[Any], Optional[str]],
+    ) -> Union[Future, partial]:
+        """
+        Starts evaluating a candidate in the executor when concurrency allows, or leaves it to be evaluated when it's
+        collected
+        """
+        if self.concurrency <= 1:
+            return partial(evaluate, candidate)
+
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.concurrency)
+
+        return self.executor.submit(evaluate, candidate)
+
+    def iter_graphql_branch_pages(self) -> Iterator[tuple]:
+        """
+        Yields each page of branches along with the name of the default branch
+        """
+        cursor = self.checkpoint.start_position
+        first = True
+
+        while cursor is not END:
+            branches, default_branch, after_cursor, has_next_page = self.fetch_branches(after_cursor=cursor)
+            cursor = self.read_cursor_page(
+                nodes=branches,
+                cursor=cursor,
+                after_cursor=after_cursor,
+                has_next_page=has_next_page,
+                first=first,
+                what='branches',
+                last_branch=branches[-1].name if len(branches) > 0 else None,
+            )
+            if cursor is None:
+                return
+
+            yield self.checkpoint.pending(branches=branches), default_branch
+            first = False
+
+    def read_cursor_page(
+            self,
+            nodes: list,
+            cursor: Optional[str],
+            after_cursor: Optional[str],
+            has_next_page: bool,
+            first: bool,
+            what: str,
+            last_branch: str = None,
+    ) -> Any:
+        """
+        Records a page of a GraphQL connection asked for from `cursor`. Returns the cursor to ask for the next page
+        from, END after the last page, or None when the page didn't come and the scan goes on with what it has.
+        """
+        if after_cursor is None:
+            if first is False:
+                # If we can't get any more, go on with whatever we have
+                print(f'Could not get any more {what}')
+                return None
+            if cursor is None:
+                raise RuntimeError(f'Could not get any {what} from GraphQL.')
+
+        self.checkpoint.add_page(length=len(nodes), position=after_cursor or cursor, last_branch=last_branch)
 
-        return deletable_branches
+        if has_next_page is not True or len(nodes) == 0:
+            self.checkpoint.end()
+            return END
+
+        return after_cursor
+
+    def get_deletable_branches_from_graphql(
+            self,
+            last_commit_age_days: int,
+            ignore_branches: BranchMatcher,
+            allowed_prefixes: BranchMatcher,
+            branch_limit: int,
+    ) -> list[str]:
+        return list(self.iter_deletable_branches_from_graphql(
+            last_commit_age_days=last_commit_age_days,
+            ignore_branches=ignore_branches,
+            allowed_prefixes=allowed_prefixes,
+            branch_limit=branch_limit,
+        ))
+
+    def iter_deletable_branches_from_graphql(
+            self,
+            last_commit_age_days: int,
+            ignore_branches: BranchMatcher,
+            allowed_prefixes: BranchMatcher,
+            branch_limit: int,
+    ) -> Iterator[str]:
+        """
+        Same verdicts as iter_deletable_branches, but each page of 100 branches comes back from a single GraphQL
+        query carrying the commit date, protection status and associated pull requests of every branch.
+        """
+        if branch_limit < 1:
+            return
+
+        pages = Prefetcher(pages=self.iter_graphql_branch_pages())
+
+        with self.scanning(pages=pages):
+            # Open pull requests can't be looked up by base from a ref, so check bases against the index
+            open_pulls = self.get_open_pulls_index()
+
+            # The default branch only comes with the pages
+            branches, default_branch = next(pages)
+
+            # Everything comes with the page, no check costs a request
+            checks = CheckPipeline(checks=self.make_branch_checks(
+                default_branch=default_branch,
+                open_pulls=open_pulls,
+                last_commit_age_days=last_commit_age_days,
+                ignore_branches=ignore_branches,
+                allowed_prefixes=allowed_prefixes,
+                branch_info_cost=0,
+                commit_date_cost=0,
+            ))
+
+            yield from self.evaluate_pages(
+                pages=chain([branches], (branches for branches, _ in pages)),
+                evaluate=lambda branch: self.evaluate_candidate(
+                    candidate=self.make_graphql_branch_candidate(branch=branch, open_pulls=open_pulls),
+                    checks=checks,
+                ),
+                checks=checks,
+                branch_limit=branch_limit,
+            )
+
+    def make_graphql_branch_candidate(self, branch: BranchRecord, open_pulls: OpenPullRequestIndex) -> Candidate:
+        return Candidate(
+            name=branch.name,
+            description=f'branch `{branch.name}`',
+            protected=branch.protected,
+            # Open pull requests of the ref, or like a REST scan, whose head is the branch's commit
+            has_open_pulls=branch.has_open_pulls or open_pulls.has_open_pulls(
+                branch=branch.name,
+                commit_hash=branch.commit_hash,
+            ),
+            commit_hash=branch.commit_hash,
+            commit_date=branch.commit_date,
+        )
+
+    def get_deletable_branches_from_local_clone(
+            self,
+            local_repository: LocalRepository,
+            last_commit_age_days: int,
+            ignore_branches: BranchMatcher,
+            allowed_prefixes: BranchMatcher,
+            branch_limit: int,
+    ) -> list[str]:
+        return list(self.iter_deletable_branches_from_local_clone(
+            local_repository=local_repository,
+            last_commit_age_days=last_commit_age_days,
+            ignore_branches=ignore_branches,
+            allowed_prefixes=allowed_prefixes,
+            branch_limit=branch_limit,
+        ))
+
+    def iter_deletable_branches_from_local_clone(
+            self,
+            local_repository: LocalRepository,
+            last_commit_age_days: int,
+            ignore_branches: BranchMatcher,
+            allowed_prefixes: BranchMatcher,
+            branch_limit: int,
+    ) -> Iterator[str]:
+        """
+        Same verdicts as iter_deletable_branches, but branches, their head commit and its date are read from a local
+        clone. The api is only asked what git can't tell: the number of branches the clone should have, the default
+        branch, protected branches and open pull requests, a few requests whatever the number of branches.
+        """
+        if branch_limit < 1:
+            return
+
+        pages = self.iter_local_branch_pages(local_repository=local_repository)
+        with self.scanning(pages=pages):
+            self.check_local_clone(local_repository=local_repository)
+            default_branch = self.get_default_branch()
+            protected_branches = self.get_protected_branches()
+            open_pulls = self.get_open_pulls_index()
+
+            # Everything is known upfront, no check costs a request
+            checks = CheckPipeline(checks=self.make_branch_checks(
+                default_branch=default_branch,
+                open_pulls=open_pulls,
+                last_commit_age_days=last_commit_age_days,
+                ignore_branches=ignore_branches,
+                allowed_prefixes=allowed_prefixes,
+                branch_info_cost=0,
+                commit_date_cost=0,
+            ))
+
+            yield from self.evaluate_pages(
+                pages=pages,
+                evaluate=lambda branch: self.evaluate_candidate(
+                    candidate=self.make_local_branch_candidate(
+                        branch=branch,
+                        protected_branches=protected_branches,
+                        open_pulls=open_pulls,
+                    ),
+                    checks=checks,
+                ),
+                checks=checks,
+                branch_limit=branch_limit,
+            )
+
+    def check_local_clone(self, local_repository: LocalRepository) -> None:
+        """
+        Fails when the clone is missing branches, such as the one actions/checkout makes by default, which only
+        fetches the branch it checks out
+        """
+        branch_count = self.get_branch_count()
+        local_branch_count = local_repository.count_branches()
+        if local_branch_count < branch_count:
+            raise RuntimeError(
+                f'The clone at `{local_repository.path}` has {local_branch_count} of the {branch_count} branches of '
+                f'`{self.repo}`. Was it checked out with fetch-depth: 0?'
+            )
+
+    def iter_local_branch_pages(self, local_repository: LocalRepository) -> Iterator[list]:
+        # The whole listing is read again on every run, only the branches evaluated by previous ones are skipped
+        for branches in local_repository.iter_branch_pages(page_size=LOCAL_BRANCH_PAGE_SIZE):
+            self.checkpoint.add_page(length=len(branches), position=None, last_branch=branches[-1].name)
+            yield self.checkpoint.pending(branches=branches)
+
+        self.checkpoint.end()
+
+    def make_local_branch_candidate(
+            self,
+            branch: BranchRecord,
+            protected_branches: set[str],
+            open_pulls: OpenPullRequestIndex,
+    ) -> Candidate:
+        return Candidate(
+            name=branch.name,
+            description=f'branch `{branch.name}`',
+            loaders=self.make_candidate_loaders(open_pulls=open_pulls),
+            protected=branch.name in protected_branches,
+            commit_hash=branch.commit_hash,
+            commit_date=branch.commit_date,
+        )
+
+    def iter_closed_pull_request_pages(self, older_than_days: int) -> Iterator[list]:
+        seen_head_branches = set()
+
+        # Deleting branches doesn't remove their pull requests, so cursors into the pull requests never shift
+        cursor = self.checkpoint.start_position
+        first = True
+
+        while cursor is not END:
+            closed_pull_requests, after_cursor, has_next_page = self.fetch_pull_requests(after_cursor=cursor)
+            cursor = self.read_cursor_page(
+                nodes=closed_pull_requests,
+                cursor=cursor,
+                after_cursor=after_cursor,
+                has_next_page=has_next_page,
+                first=first,
+                what='pull requests',
+            )
+            if cursor is None:
+                return
+
+            yield self.drop_seen_head_branches(
+                pull_requests=closed_pull_requests,
+                seen=seen_head_branches,
+                older_than_days=older_than_days,
+            )
+            first = False
+
+    def drop_seen_head_branches(
+            self,
+            pull_requests: list[PullRequestRecord],
+            seen: set[str],
+            older_than_days: int,
+    ) -> list[PullRequestRecord]:
+        """
+        Drops pull requests whose head branch was already evaluated, which would take the same checks to reach the
+        same verdict. Pull requests updated too recently are rejected before looking at their branch, so their branch
+        only counts as evaluated once an older pull request of it comes through.
+        """
+        unseen = []
+        for pull_request in pull_requests:
+            head_branch = pull_request.head_branch
+            if head_branch in seen:
+                continue
+
+            if self.get_days_since(date_raw=pull_request.updated_at) >= older_than_days:
+                seen.add(head_branch)
+            unseen.append(pull_request)
+
+        return unseen
 
     def get_deletable_branches_from_closed_pull_requests(
             self,
             last_commit_age_days: int,
-            ignore_branches: list[str],
-            allowed_prefixes: list[str],
+            ignore_branches: BranchMatcher,
+            allowed_prefixes: BranchMatcher,
             branch_limit: int,
     ) -> list[str]:
+        return list(self.iter_deletable_branches_from_closed_pull_requests(
+            last_commit_age_days=last_commit_age_days,
+            ignore_branches=ignore_branches,
+            allowed_prefixes=allowed_prefixes,
+            branch_limit=branch_limit,
+        ))
+
+    def iter_deletable_branches_from_closed_pull_requests(
+            self,
+            last_commit_age_days: int,
+            ignore_branches: BranchMatcher,
+            allowed_prefixes: BranchMatcher,
+            branch_limit: int,
+    ) -> Iterator[str]:
         if branch_limit < 1:
-            return []
-
-        # Default branch might not be protected
-        default_branch = self.get_default_branch()
-
-        response = self.fetch_pull_requests()
-        if response[1] is None:
-            raise RuntimeError("Could not get any pull request info from GraphQL.")
-        closed_pull_requests = response[0]
-        after_cursor = response[1]
-        has_next_page = response[2]
-
-        deletable_branches = []
-        branch: dict
-
-        while len(closed_pull_requests) > 0:
-            for pull_request in closed_pull_requests:
-                html_url = pull_request.get('url')
-                updated_at = pull_request.get('updatedAt')
-                branch_name = pull_request.get('headRefName')
-                head_branch = pull_request.get('headRef')
-
-                print(f'Analyzing pull request {html_url}')
-                
-                if head_branch is None:
-                    print(f'Ignoring {html_url} because head branch is already deleted')
-                    continue
-
-                # Immediately discard default branch
-                if branch_name == default_branch:
-                    print(f'Ignoring `{branch_name}` because it is the default branch')
-                    continue
-                
-                found_ignored_prefix = False
-                for prefix in ignore_branches:
-                    if branch_name.startswith(prefix):
-                        found_ignored_prefix = True
-                        break
-                if found_ignored_prefix is True:
-                    print(f'Ignoring `{branch_name}` because it is on the list of ignored branch prefixes')
-                    continue
-
-                # If allowed_prefixes are provided, only consider branches that match one of the prefixes
-                if len(allowed_prefixes) > 0:
-                    found_prefix = False
-                    for prefix in allowed_prefixes:
-                        if branch_name.startswith(prefix):
-                            found_prefix = True
-                    if found_prefix is False:
-                        print(f'Ignoring `{branch_name}` because it does not match any provided allowed_prefixes')
-                        continue
-                
-                # Move on if last updated at is newer than last_commit_age_days
-                if self.is_updated_at_older_than(updated_at=updated_at, older_than_days=last_commit_age_days) is False:
-                    print(f'Ignoring {html_url} because last updated time is newer than {last_commit_age_days} days')
-                    continue
-
-                branch = self.get_branch_info(branch=branch_name)
-
-                # Don't delete protected branches
-                if branch.get('protected') is True:
-                    print(f'Ignoring `{branch_name}` because it is protected')
-                    continue
-
-                commit_hash = branch.get('commit', {}).get('sha')
-                commit_url = branch.get('commit', {}).get('url')
-
-                # Move on if commit is in an open pull request
-                if self.has_open_pulls(commit_hash=commit_hash):
-                    print(f'Ignoring `{branch_name}` because it has open pull requests')
-                    continue
-
-                # Move on if branch is base for a pull request
-                if self.is_pull_request_base(branch=branch_name):
-                    print(f'Ignoring `{branch_name}` because it is the base for a pull request of another branch')
-                    continue
-
-                # Move on if last commit is newer than last_commit_age_days
-                if self.is_commit_older_than(commit_url=commit_url, older_than_days=last_commit_age_days) is False:
-                    print(f'Ignoring `{branch_name}` because last commit is newer than {last_commit_age_days} days')
-                    continue
-
-                print(f'Branch `{branch_name}` meets the criteria for deletion')
-                deletable_branches.append(branch_name)
-
-                # Exit early if we have reached our branch limit
-                if len(deletable_branches) == branch_limit:
-                    return deletable_branches
-
-            if has_next_page is True:
-                response = self.fetch_pull_requests(after_cursor=after_cursor)
-                if response[1] is None:
-                    # If we can't get any more pull requests, return whatever we have
-                    if len(deletable_branches) > 0:
-                        print(f'Could not get any more pull requests. Returning {len(deletable_branches)} branches')
-                        return deletable_branches
-                    else:
-                        raise RuntimeError("Could not get any pull request info from GraphQL.")
-                closed_pull_requests = response[0]
-                after_cursor = response[1]
-                has_next_page = response[2]
-            else: 
+            return
+
+        # The first page comes in while the default branch and open pull requests are looked up
+        pages = Prefetcher(pages=self.iter_closed_pull_request_pages(older_than_days=last_commit_age_days))
+
+        with self.scanning(pages=pages):
+            # Default branch might not be protected
+            default_branch = self.get_default_branch()
+            open_pulls = self.get_open_pulls_index()
+
+            checks = CheckPipeline(checks=self.make_pull_request_checks(
+                default_branch=default_branch,
+                open_pulls=open_pulls,
+                last_commit_age_days=last_commit_age_days,
+                ignore_branches=ignore_branches,
+                allowed_prefixes=allowed_prefixes,
+            ))
+
+            yield from self.evaluate_pages(
+                pages=pages,
+                evaluate=lambda pull_request: self.evaluate_pull_request(
+                    pull_request=pull_request,
+                    open_pulls=open_pulls,
+                    checks=checks,
+                ),
+                checks=checks,
+                branch_limit=branch_limit,
+            )
+
+    def make_pull_request_checks(
+            self,
+            default_branch: str,
+            open_pulls: OpenPullRequestIndex,
+            last_commit_age_days: int,
+            ignore_branches: BranchMatcher,
+            allowed_prefixes: BranchMatcher,
+    ) -> list[Check]:
+        """
+        The criteria the head branch of a closed pull request must meet to be deleted. Protection and head commit come
+        with the page, only pull requests from forks have to fetch the branch.
+        """
+        return [
+            Check(
+                name='pull request update age',
+                cost=0,
+                passes=lambda candidate: self.is_updated_at_older_than(
+                    updated_at=candidate.get('updated_at'),
+                    older_than_days=last_commit_age_days,
+                ),
+                reason=f'Ignoring {{url}} because last updated time is newer than {last_commit_age_days} days',
+            ),
+            *self.make_branch_checks(
+                default_branch=default_branch,
+                open_pulls=open_pulls,
+                last_commit_age_days=last_commit_age_days,
+                ignore_branches=ignore_branches,
+                allowed_prefixes=allowed_prefixes,
+                branch_info_cost=0,
+                commit_date_cost=0,
+            ),
+        ]
+
+    def evaluate_pull_request(
+            self,
+            pull_request: PullRequestRecord,
+            open_pulls: OpenPullRequestIndex,
+            checks: CheckPipeline,
+    ) -> str:
+        """
+        Returns the name of the pull request's head branch if it meets the criteria for deletion, None otherwise
+        """
+        candidate = self.make_pull_request_candidate(
+            pull_request=pull_request,
+            open_pulls=open_pulls,
+            loaders={
+                **self.make_candidate_loaders(open_pulls=open_pulls),
+                'branch': lambda candidate: self.get_branch_info(branch=candidate.name) or {},
+            },
+        )
+        if candidate is None:
+            return None
+
+        return self.evaluate_candidate(candidate=candidate, checks=checks)
+
+    def make_pull_request_candidate(
+            self,
+            pull_request: PullRequestRecord,
+            open_pulls: OpenPullRequestIndex,
+            loaders: dict,
+    ) -> Optional[Candidate]:
+        """
+        The candidate of a pull request's head branch, None if the branch is already deleted. `loaders` must be able
+        to load the branch, which the rest of the values it doesn't come with are read from.
+        """
+        if pull_request.head_ref is None:
+            detail(f'Ignoring {pull_request.url} because head branch is already deleted')
+            return None
+
+        return Candidate(
+            name=pull_request.head_branch,
+            description=f'pull request {pull_request.url}',
+            loaders={
+                **loaders,
+                'protected': lambda candidate: candidate.get('branch').get('protected'),
+                'commit_hash': lambda candidate: candidate.get('branch').get('commit', {}).get('sha'),
+                'commit_url': lambda candidate: candidate.get('branch').get('commit', {}).get('url'),
+            },
+            url=pull_request.url,
+            updated_at=pull_request.updated_at,
+            **self.get_head_ref_values(pull_request=pull_request, open_pulls=open_pulls),
+        )
+
+    def get_head_ref_values(self, pull_request: PullRequestRecord, open_pulls: OpenPullRequestIndex) -> dict:
+        """
+        Candidate values of the pull request's head branch that came with the page. The head of a pull request from
+        a fork is a branch of the fork, whose protection and commits say nothing about ours: those are looked up.
+        """
+        head_ref = pull_request.head_ref
+        if pull_request.cross_repository is not False or head_ref.commit_hash is None:
+            return {}
+
+        return {
+            'protected': head_ref.protected,
+            'commit_hash': head_ref.commit_hash,
+            'commit_date': head_ref.commit_date,
+            'has_open_pulls': head_ref.has_open_pulls or open_pulls.has_open_pulls(
+                branch=pull_request.head_branch,
+                commit_hash=head_ref.commit_hash,
+            ),
+        }
+
+    def delete_branches(self, branches: list[str], expected_hashes: dict[str, str] = None) -> dict[str, str]:
+        """
+        Deletes the given branches, packing up to DELETE_BATCH_SIZE deleteRef mutations in a single GraphQL request.
+        Batches GraphQL can't handle are deleted through the REST api instead. With expected_hashes, only branches
+        whose head is still the commit expected are deleted. Returns what happened to each branch: DELETED,
+        ALREADY_GONE, MOVED or FAILED.
+        """
+        results = {}
+
+        for batch in self.iter_delete_batches(branches=branches):
+            try:
+                batch_results = self.delete_branches_with_graphql(branches=batch, expected_hashes=expected_hashes)
+                if batch_results is None:
+                    print('Could not delete branches through GraphQL, falling back to the REST api')
+                    batch_results = self.delete_branches_with_rest(branches=batch, expected_hashes=expected_hashes)
+            except RequestBudgetExhausted as ex:
+                results.update(self.fail_remaining_deletions(branches=branches, results=results, ex=ex))
                 break
 
-        return deletable_branches
+            results.update(batch_results)
 
-    def delete_branches(self, branches: list[str]) -> None:
-        for branch in branches:
-            print(f'Deleting branch `{branch}`...')
-            url = f'{self.base_url}/repos/{self.repo}/git/refs/heads/{branch.replace("#", "%23")}'
+        self.report_deletions(branches=branches, results=results)
 
-            response = requests.request(method='DELETE', url=url, headers=self.make_headers())
-            if response.status_code != 204:
+        return results
+
+    def iter_delete_batches(self, branches: list[str]) -> Iterator[list[str]]:
+        for start in range(0, len(branches), DELETE_BATCH_SIZE):
+            batch = branches[start:start + DELETE_BATCH_SIZE]
+            print(f'Deleting branches {batch}...')
+            yield batch
+
+    def fail_remaining_deletions(
+            self,
+            branches: list[str],
+            results: dict[str, str],
+            ex: RequestBudgetExhausted,
+    ) -> dict[str, str]:
+        remaining = [branch for branch in branches if branch not in results]
+        print(f'{ex}. Not deleting {remaining[:DELETE_BATCH_SIZE]} nor any branch after them')
+
+        return {branch: FAILED for branch in remaining}
+
+    def report_deletions(self, branches: list[str], results: dict[str, str]) -> None:
+        for branch in branches:
+            if results[branch] == DELETED:
+                detail(f'Branch `{branch}` DELETED!')
+            elif results[branch] == ALREADY_GONE:
+                detail(f'Branch `{branch}` was already deleted')
+            elif results[branch] == MOVED:
+                print(f'Not deleting branch `{branch}` because new commits were pushed to it')
+            else:
                 print(f'Failed to delete branch `{branch}`')
-                # Warn if deleting a single branch failed, but continue the rest of the action
-                print(f'Failed to make DELETE request to {url}. {response} {response.json()}')
 
-            print(f'Branch `{branch}` DELETED!')
+    def delete_branches_with_graphql(
+            self,
+            branches: list[str],
+            expected_hashes: dict[str, str] = None,
+    ) -> dict[str, str]:
+        """
+        Returns None if the refs could not be looked up or the mutation request failed altogether
+        """
+        data = self.execute_graphql(query=self.make_ref_query(branches=branches), name='ref ids')
+        refs = self.parse_ref_ids(branches=branches, data=data, expected_hashes=expected_hashes)
+        if refs is None:
+            return None
 
-    def get_default_branch(self) -> str:
-        url = f'{self.base_url}/repos/{self.repo}'
-        headers = self.make_headers()
+        results, ref_ids = refs
+        if len(ref_ids) == 0:
+            return results
+
+        data = self.execute_graphql(query=self.make_delete_refs_mutation(ref_ids=ref_ids), name='deleteRef')
+
+        return self.parse_delete_refs_results(branches=branches, ref_ids=ref_ids, data=data, results=results)
+
+    def parse_ref_ids(
+            self,
+            branches: list[str],
+            data: dict,
+            expected_hashes: dict[str, str] = None,
+    ) -> Optional[tuple[dict[str, str], dict[int, str]]]:
+        """
+        Returns the branches that are already gone or whose head moved from the one expected, and the ref ids of the
+        others by their index in `branches`. None if the refs could not be looked up.
+        """
+        if data.get("data") is None:
+            return None
+
+        repository: dict = data["data"]["repository"]
+        results = {}
+        ref_ids = {}
+        for index, branch in enumerate(branches):
+            ref = repository.get(f'ref{index}')
+            if ref is None:
+                results[branch] = ALREADY_GONE
+            elif expected_hashes is not None and (ref.get('target') or {}).get('oid') != expected_hashes.get(branch):
+                results[branch] = MOVED
+            else:
+                ref_ids[index] = ref['id']
+
+        return results, ref_ids
+
+    def parse_delete_refs_results(
+            self,
+            branches: list[str],
+            ref_ids: dict[int, str],
+            data: dict,
+            results: dict[str, str],
+    ) -> Optional[dict[str, str]]:
+        """
+        Adds what happened to the branches whose refs the mutation deleted to `results`. None if it failed altogether.
+        """
+        if data.get("data") is None:
+            return None
+
+        results = dict(results)
+
+        # Each mutation fails on its own, errors point at the alias of the one that did
+        failed_aliases = {}
+        for error in data.get("errors", []):
+            path = error.get('path') or ['']
+            failed_aliases[path[0]] = error
+
+        for index in ref_ids:
+            branch = branches[index]
+            error = failed_aliases.get(f'delete{index}')
+            if error is None:
+                results[branch] = DELETED
+            elif error.get('type') == 'NOT_FOUND':
+                results[branch] = ALREADY_GONE
+            else:
+                print(f'Failed to delete branch `{branch}`: {error.get("message")}')
+                results[branch] = FAILED
+
+        return results
+
+    def delete_branches_with_rest(self, branches: list[str], expected_hashes: dict[str, str] = None) -> dict[str, str]:
+        if self.concurrency <= 1:
+            return {branch: self.delete_branch(branch=branch, expected_hashes=expected_hashes) for branch in branches}
+
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.concurrency)
+
+        return dict(zip(branches, self.executor.map(
+            lambda branch: self.delete_branch(branch=branch, expected_hashes=expected_hashes),
+            branches,
+        )))
+
+    def get_ref_url(self, branch: str) -> str:
+        return f'{self.base_url}/repos/{self.repo}/git/refs/heads/{branch.replace("#", "%23")}'
 
-        response = requests.get(url=url, headers=headers)
+    def delete_branch(self, branch: str, expected_hashes: dict[str, str] = None) -> str:
+        url = self.get_ref_url(branch=branch)
 
+        # The REST api has no conditional delete either, the head is looked up right before
+        if expected_hashes is not None:
+            info = self.get_branch_info(branch=branch)
+            head_result = self.parse_head(branch=branch, info=info, expected_hashes=expected_hashes)
+            if head_result is not None:
+                return head_result
+
+        response = self.transport.request(method='DELETE', url=url)
+
+        return self.parse_delete_result(url=url, response=response)
+
+    @staticmethod
+    def parse_head(branch: str, info: dict, expected_hashes: dict[str, str]) -> Optional[str]:
+        """
+        Returns ALREADY_GONE or MOVED when a branch looked up through the REST api can't be deleted as planned, None
+        when its head is still the commit expected
+        """
+        if info is None:
+            return ALREADY_GONE
+        if info.get('commit', {}).get('sha') != expected_hashes.get(branch):
+            return MOVED
+
+        return None
+
+    def parse_delete_result(self, url: str, response: Response) -> str:
+        if response.status_code == 204:
+            return DELETED
+
+        # 422 "Reference does not exist"
+        if response.status_code in (404, 422):
+            return ALREADY_GONE
+
+        # Warn if deleting a single branch failed, but continue the rest of the action
+        print(f'Failed to make DELETE request to {url}. {response} {response.text}')
+
+        return FAILED
+
+    def get_repository_url(self) -> str:
+        return f'{self.base_url}/repos/{self.repo}'
+
+    def get_default_branch(self) -> str:
+        return self.parse_default_branch(response=self.transport.get(url=self.get_repository_url(), cacheable=True))
+
+    def parse_default_branch(self, response: Response) -> str:
         if response.status_code != 200:
             raise RuntimeError('Error: could not determine default branch. This is a big one.')
 
         return response.json().get('default_branch')
     
+    def get_branch_count(self) -> int:
+        """
+        Lists branches one per page, the number of the last page is how many there are
+        """
+        url = f'{self.base_url}/repos/{self.repo}/branches?per_page=1'
+        response = self.transport.get(url=url, cacheable=True)
+        if response.status_code != 200:
+            raise RuntimeError(f'Failed to make request to {url}. {response} {response.json()}')
+
+        last_page = response.links.get('last')
+        if last_page is None:
+            return len(response.json())
+
+        return int(parse_qs(urlparse(last_page['url']).query)['page'][0])
+
+    def get_protected_branches(self) -> set[str]:
+        protected_branches = set()
+        page = 1
+
+        while True:
+            url = f'{self.base_url}/repos/{self.repo}/branches?protected=true&per_page=100&page={page}'
+            response = self.transport.get(url=url, cacheable=True)
+            if response.status_code != 200:
+                raise RuntimeError(f'Failed to make request to {url}. {response} {response.json()}')
+
+            branches: list = response.json()
+            protected_branches.update(branch.get('name') for branch in branches)
+
+            if len(branches) < 100:
+                return protected_branches
+
+            page += 1
+
+    def get_branch_url(self, branch: str) -> str:
+        return f'{self.base_url}/repos/{self.repo}/branches/{branch}'
+
     def get_branch_info(self, branch: str):
-        url = f'{self.base_url}/repos/{self.repo}/branches/{branch}'
-        headers = self.make_headers()
+        url = self.get_branch_url(branch=branch)
 
-        response = requests.get(url=url, headers=headers)
+        return self.parse_branch_info(url=url, response=self.transport.get(url=url, cacheable=True))
 
+    def parse_branch_info(self, url: str, response: Response) -> Optional[dict]:
         if response.status_code == 404:
             return None
 
@@ -271,41 +1136,69 @@ class Github:
 
         return response.json()
 
-    def has_open_pulls(self, commit_hash: str) -> bool:
+    def get_open_pulls_index(self) -> OpenPullRequestIndex:
         """
-        Returns true if commit is part of an open pull request or the branch is the base for a pull request
+        Pages through every open pull request once per run. The result is reused by all later branch checks.
         """
-        url = f'{self.base_url}/repos/{self.repo}/commits/{commit_hash}/pulls'
-        headers = self.make_headers()
-        headers['accept'] = 'application/vnd.github.groot-preview+json'
+        if self.open_pulls is not None:
+            return self.open_pulls
 
-        response = requests.get(url=url, headers=headers)
-        if response.status_code != 200:
-            raise RuntimeError(f'Failed to make request to {url}. {response} {response.json()}')
+        open_pulls = OpenPullRequestIndex(repo=self.repo)
+        page = 1
 
-        pull_request: dict
-        for pull_request in response.json():
-            if pull_request.get('state') == 'open':
-                return True
+        while page is not None:
+            url = self.get_open_pulls_url(page=page)
+            response = self.transport.get(url=url)
+            page = self.read_open_pulls_page(open_pulls=open_pulls, url=url, page=page, response=response)
 
-        return False
+        return self.keep_open_pulls_index(open_pulls=open_pulls)
 
-    def is_pull_request_base(self, branch: str) -> bool:
+    def get_open_pulls_url(self, page: int) -> str:
+        return f'{self.base_url}/repos/{self.repo}/pulls?state=open&per_page=100&page={page}'
+
+    def read_open_pulls_page(
+            self,
+            open_pulls: OpenPullRequestIndex,
+            url: str,
+            page: int,
+            response: Response,
+    ) -> Optional[int]:
         """
-        Returns true if the given branch is base for another pull request.
+        Adds a page of open pull requests to the index. Returns the number of the next page, None after the last one.
         """
-        url = f'{self.base_url}/repos/{self.repo}/pulls?base={branch}'
-        headers = self.make_headers()
-        headers['accept'] = 'application/vnd.github.groot-preview+json'
-
-        response = requests.get(url=url, headers=headers)
         if response.status_code != 200:
             raise RuntimeError(f'Failed to make request to {url}. {response} {response.json()}')
 
-        return len(response.json()) > 0
+        pull_requests: list = response.json()
+        for pull_request in pull_requests:
+            open_pulls.add(pull_request)
+
+        if len(pull_requests) < 100:
+            return None
+
+        return page + 1
+
+    def keep_open_pulls_index(self, open_pulls: OpenPullRequestIndex) -> OpenPullRequestIndex:
+        print(f'Found {open_pulls.size} open pull requests')
+        self.open_pulls = open_pulls
+
+        return open_pulls
+
+    def get_commit_date(self, commit_url: str) -> str:
+        commit_date_raw = self.get_cached_commit_date(commit_url=commit_url)
+        if commit_date_raw is not None:
+            return commit_date_raw
+
+        return self.parse_commit_date(commit_url=commit_url, response=self.transport.get(url=commit_url))
 
-    def is_commit_older_than(self, commit_url: str, older_than_days: int):
-        response = requests.get(url=commit_url, headers=self.make_headers())
+    def get_cached_commit_date(self, commit_url: str) -> Optional[str]:
+        # Commit urls end in the commit's sha, whose date can be reused from previous runs
+        if self.commit_cache is None:
+            return None
+
+        return self.commit_cache.get(sha=commit_url.rsplit('/', 1)[-1])
+
+    def parse_commit_date(self, commit_url: str, response: Response) -> str:
         if response.status_code != 200:
             raise RuntimeError(f'Failed to make request to {commit_url}. {response} {response.json()}')
 
@@ -317,30 +1210,41 @@ class Github:
         # for instance coming from a merge where the committer is bringing in commits from other authors
         # Fall back to author's commit date if none found for whatever bizarre reason
         commit_date_raw = committer.get('date', author.get('date'))
-        if commit_date_raw is None:
-            print(f"Warning: could not determine commit date for {commit_url}. Assuming it's not old enough to delete")
+        if commit_date_raw is not None and self.commit_cache is not None:
+            self.commit_cache.put(sha=commit_url.rsplit('/', 1)[-1], date=commit_date_raw)
+
+        return commit_date_raw
+
+    def is_date_older_than(self, date_raw, older_than_days: int) -> bool:
+        if date_raw is None:
+            print("Warning: could not determine commit date. Assuming it's not old enough to delete")
             return False
 
-        # Dates are formatted like so: '2021-02-04T10:52:40Z'
-        commit_date = datetime.strptime(commit_date_raw, "%Y-%m-%dT%H:%M:%SZ")
+        commit_date = to_datetime(date_raw)
 
         delta = datetime.now() - commit_date
-        print(f'Last commit was on {commit_date_raw} ({delta.days} days ago)')
+        detail(f'Last commit was on {commit_date:%Y-%m-%dT%H:%M:%SZ} ({delta.days} days ago)')
 
         return delta.days >= older_than_days
 
-    def is_updated_at_older_than(self, updated_at: str, older_than_days: int):
-        # Dates are formatted like so: '2021-02-04T10:52:40Z'
-        updated_date = datetime.strptime(updated_at, "%Y-%m-%dT%H:%M:%SZ")
+    def is_updated_at_older_than(self, updated_at, older_than_days: int):
+        days = self.get_days_since(date_raw=updated_at)
+        detail(f'PR was last updated on {to_datetime(updated_at):%Y-%m-%dT%H:%M:%SZ} ({days} days ago)')
 
-        delta = datetime.now() - updated_date
-        print(f'PR was last updated on {updated_at} ({delta.days} days ago)')
+        return days >= older_than_days
 
-        return delta.days >= older_than_days
+    def get_days_since(self, date_raw) -> int:
+        # Either as the api formats dates or in seconds since the epoch, as records keep them
+        return (datetime.now() - to_datetime(date_raw)).days
 
     def make_pull_request_query(self, count: int, after_cursor: str = None):
         query = """
                 query {
+                    rateLimit {
+                        cost
+                        remaining
+                        resetAt
+                    }
                     repository(owner: OWNER, name: REPO) {
                         pullRequests(
                             states: CLOSED,
@@ -357,8 +1261,21 @@ class Github:
                                     title
                                     url
                                     updatedAt
+                                    isCrossRepository
                                     headRef {
                                         name
+                                        branchProtectionRule {
+                                            id
+                                        }
+                                        associatedPullRequests(states: OPEN) {
+                                            totalCount
+                                        }
+                                        target {
+                                            ... on Commit {
+                                                oid
+                                                committedDate
+                                            }
+                                        }
                                     }
                                     headRefName
                                 }
@@ -382,35 +1299,279 @@ class Github:
             )
 
 
-    def fetch_pull_requests(self, after_cursor: str = None):
-        pull_requests = []
+    def execute_graphql(self, query: str, name: str, page_sizer: PageSizer = None, page_size: int = None) -> dict:
+        """
+        Runs a query, retrying it while it is rate limited. Pages of a paginated query are reported to their
+        page_sizer, and raise GraphqlTimeout instead of being retried when they time out.
+        """
+        request = self.make_graphql_request(query=query, name=name, page_sizer=page_sizer)
         data = {}
-        attempts = 4
-        
-        while attempts > 0:
+        attempt = 0
+
+        while True:
+            try:
+                response = self.transport.request(**request)
+            except requests.exceptions.RequestException as e:
+                print(f"Error fetching GraphQL result:\n{e}\ndata: {data}")
+                return data
+
+            data, delay = self.read_graphql_response(
+                response=response,
+                name=name,
+                attempt=attempt,
+                page_sizer=page_sizer,
+                page_size=page_size,
+            )
+            if delay is None:
+                return data
+
+            attempt += 1
+            print(f"Retrying in {delay:.1f} seconds (attempt {attempt})\n")
+            sleep(delay)
+
+    def make_graphql_request(self, query: str, name: str, page_sizer: PageSizer = None) -> dict:
+        """
+        Arguments of the transport's request() for a query. Errors and rate limited responses are already retried by
+        the transport, timed out pages are asked again with fewer nodes instead.
+        """
+        return {
+            'method': 'post',
+            'url': self.get_graphql_url(),
+            'json': {'query': query},
+            'resource': 'graphql',
+            'endpoint': f'POST /graphql {name}',
+            'retry_server_errors': page_sizer is None,
+        }
+
+    def read_graphql_response(
+            self,
+            response: Response,
+            name: str,
+            attempt: int,
+            page_sizer: PageSizer = None,
+            page_size: int = None,
+    ) -> tuple[dict, Optional[float]]:
+        """
+        Returns the data of a query's response, and how long to wait before asking again when it was rate limited,
+        None when it shouldn't be asked again
+        """
+        rate_limiter = self.transport.rate_limiter
+
+        if page_sizer is not None and response.status_code in RETRYABLE_STATUS_CODES:
+            raise GraphqlTimeout(f'GraphQL {name} query for {page_size} nodes failed with {response.status_code}')
+
+        if response.status_code != 200:
+            print(f"Error fetching GraphQL result:\n{response} {response.text}")
+            return {}, None
+
+        # Nodes are folded into records as they're decoded
+        data = json.loads(response.content, object_hook=read_graphql_object)
+        rate_limit = self.record_graphql_rate_limit(
+            name=name,
+            data=data,
+            rate_limiter=rate_limiter,
+            metrics=self.transport.metrics,
+        )
+        if data.get("data") is not None:
+            if page_sizer is not None:
+                page_sizer.record(
+                    size=page_size,
+                    seconds=response.elapsed.total_seconds(),
+                    cost=None if rate_limit is None else rate_limit.get("cost"),
+                )
+            return data, None
+
+        print(f"GraphQL query returned no data: {data}")
+        errors: list = data.get("errors", [])
+        if page_sizer is not None and self.is_graphql_timeout(errors=errors):
+            raise GraphqlTimeout(f'GraphQL {name} query for {page_size} nodes timed out')
+
+        if not any(error.get("type") == "RATE_LIMITED" for error in errors):
+            return data, None
+
+        return data, rate_limiter.retry_delay(attempt=attempt)
+
+    def record_graphql_rate_limit(
+            self,
+            name: str,
+            data: dict,
+            rate_limiter: RateLimiter,
+            metrics: Optional[Metrics],
+    ) -> Optional[dict]:
+        """
+        Accounts for the points a query cost, and returns its rateLimit if it asked for it
+        """
+        rate_limit = (data.get("data") or {}).get("rateLimit")
+        if rate_limit is not None:
+            rate_limiter.record_points(rate_limit=rate_limit)
+        if metrics is not None:
+            metrics.record_graphql_cost(query=name, data=data)
+
+        return rate_limit
+
+    def is_graphql_timeout(self, errors: list) -> bool:
+        # GitHub gives up on queries that run for too long with a 200 and an error saying it may have timed out
+        return any('timeout' in (error.get("message") or "").lower() for error in errors)
+
+    def execute_paged_graphql(self, make_query: Callable[[int], str], page_sizer: PageSizer, name: str) -> dict:
+        """
+        Runs a page of a paginated query with as many nodes as page_sizer allows. A page that times out is asked again
+        with half the nodes, rather than retrying the same expensive query.
+        """
+        while True:
+            page_size = page_sizer.get_size(points_left=self.transport.rate_limiter.points_left)
             try:
-                data = self.client.execute(
-                    query=self.make_pull_request_query(20, after_cursor),
-                    headers={"Authorization": "Bearer {}".format(self.token)},
+                return self.execute_graphql(
+                    query=make_query(page_size),
+                    name=name,
+                    page_sizer=page_sizer,
+                    page_size=page_size,
                 )
-                if "data" in data:
-                    break
+            except GraphqlTimeout as ex:
+                if self.shrink_timed_out_page(ex=ex, page_sizer=page_sizer, page_size=page_size) is False:
+                    return {}
 
-            except Exception as e:
-                print(f"Error fetching GraphQL result:\n{e}\ndata: {data}")
-                attempts -= 1
-                if attempts > 0:
-                    exponential_backoff_seconds = 3 ** (4 - attempts)
-                    print(f"Retrying in {exponential_backoff_seconds} seconds (attempt {4 - attempts})\n")
-                    sleep(exponential_backoff_seconds)
+    def shrink_timed_out_page(self, ex: GraphqlTimeout, page_sizer: PageSizer, page_size: int) -> bool:
+        """
+        Returns False when a page that timed out can't get any smaller, and is given up on
+        """
+        if page_sizer.shrink(size=page_size) is False:
+            print(f'{ex}. Giving up on it')
+            return False
 
-        if "data" not in data:
-            return ([], None, False)
+        print(f'{ex}. Asking for {page_sizer.size} nodes instead')
+
+        return True
+
+    def fetch_pull_requests(self, after_cursor: str = None):
+        data = self.execute_paged_graphql(
+            make_query=lambda count: self.make_pull_request_query(count, after_cursor),
+            page_sizer=self.pull_request_page_sizer,
+            name='pullRequests',
+        )
 
-        for pull_request in data["data"]["repository"]["pullRequests"]["nodes"]:
-            pull_requests.append(pull_request)
+        return self.parse_pull_requests(data=data)
 
+    def parse_pull_requests(self, data: dict):
+        if data.get("data") is None:
+            return ([], None, False)
+
+        pull_requests: list[PullRequestRecord] = data["data"]["repository"]["pullRequests"]["nodes"]
         after_cursor = data["data"]["repository"]["pullRequests"]["pageInfo"]["endCursor"]
         has_next_page = data["data"]["repository"]["pullRequests"]["pageInfo"]["hasNextPage"]
 
-        return (pull_requests, after_cursor, has_next_page)
\ No newline at end of file
+        return (pull_requests, after_cursor, has_next_page)
+
+    def make_branch_query(self, count: int, after_cursor: str = None):
+        query = """
+                query {
+                    rateLimit {
+                        cost
+                        remaining
+                        resetAt
+                    }
+                    repository(owner: OWNER, name: REPO) {
+                        defaultBranchRef {
+                            name
+                        }
+                        refs(
+                            refPrefix: "refs/heads/",
+                            first: COUNT,
+                            after: AFTER,
+                            orderBy: {
+                                direction: ASC,
+                                field: ALPHABETICAL
+                            }
+                        ) {
+                            nodes {
+                                name
+                                branchProtectionRule {
+                                    id
+                                }
+                                associatedPullRequests(states: OPEN) {
+                                    totalCount
+                                }
+                                target {
+                                    ... on Commit {
+                                        oid
+                                        committedDate
+                                    }
+                                }
+                            }
+                            pageInfo {
+                                hasNextPage,
+                                endCursor
+                            }
+                        }
+                    }
+                }
+                """
+        return query.replace(
+                "AFTER", '"{}"'.format(after_cursor) if after_cursor else "null"
+            ).replace(
+                "OWNER", '"{}"'.format(self.owner)
+            ).replace(
+                "REPO", '"{}"'.format(self.repo.split('/')[-1])
+            ).replace(
+                "COUNT", str(count)
+            )
+
+    def fetch_branches(self, after_cursor: str = None):
+        data = self.execute_paged_graphql(
+            make_query=lambda count: self.make_branch_query(count, after_cursor),
+            page_sizer=self.branch_page_sizer,
+            name='refs',
+        )
+
+        return self.parse_branches(data=data)
+
+    def parse_branches(self, data: dict):
+        if data.get("data") is None:
+            return ([], None, None, False)
+
+        repository = data["data"]["repository"]
+        default_branch = (repository.get("defaultBranchRef") or {}).get("name")
+        branches = repository["refs"]["nodes"]
+        after_cursor = repository["refs"]["pageInfo"]["endCursor"]
+        has_next_page = repository["refs"]["pageInfo"]["hasNextPage"]
+
+        return (branches, default_branch, after_cursor, has_next_page)
+
+    def make_ref_query(self, branches: list[str]):
+        refs = '\n'.join(
+            f'ref{index}: ref(qualifiedName: {json.dumps("refs/heads/" + branch)}) {{ id target {{ oid }} }}'
+            for index, branch in enumerate(branches)
+        )
+
+        return """
+                query {
+                    rateLimit {
+                        cost
+                        remaining
+                        resetAt
+                    }
+                    repository(owner: OWNER, name: REPO) {
+                        REFS
+                    }
+                }
+                """.replace(
+                "OWNER", '"{}"'.format(self.owner)
+            ).replace(
+                "REPO", '"{}"'.format(self.repo.split('/')[-1])
+            ).replace(
+                "REFS", refs
+            )
+
+    def make_delete_refs_mutation(self, ref_ids: dict[int, str]):
+        mutations = '\n'.join(
+            f'delete{index}: deleteRef(input: {{refId: {json.dumps(ref_id)}}}) {{ clientMutationId }}'
+            for index, ref_id in ref_ids.items()
+        )
+
+        return """
+                mutation {
+                    MUTATIONS
+                }
+                """.replace(
+                "MUTATIONS", mutations
+            )
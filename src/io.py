@@ -1,6 +1,9 @@
 import argparse
 from os import getenv
 
+from src.matcher import BranchMatcher
+from src.shard import Shard
+
 DEFAULT_GITHUB_API_URL = 'https://api.github.com'
 
 
@@ -17,6 +20,27 @@ class Options:
             dry_run: bool = True,
             github_base_url: str = DEFAULT_GITHUB_API_URL,
             only_closed_prs: bool = False,
+            use_graphql: bool = False,
+            concurrency: int = 1,
+            request_budget: int = 0,
+            graphql_point_budget: int = 0,
+            max_runtime: float = 0,
+            cache_dir: str = None,
+            org_sweep: bool = False,
+            include_repos: list[str] = None,
+            exclude_repos: list[str] = None,
+            use_async: bool = False,
+            verbose: bool = False,
+            metrics_file: str = None,
+            local_clone: str = None,
+            shard_index: int = 0,
+            shard_count: int = 1,
+            shard_results_dir: str = None,
+            merge_shards: bool = False,
+            plan_file: str = None,
+            apply_plan: bool = False,
+            ignore_branches_matcher: BranchMatcher = None,
+            allowed_prefixes_matcher: BranchMatcher = None,
     ):
         self.ignore_branches = ignore_branches
         self.last_commit_age_days = last_commit_age_days
@@ -28,6 +52,33 @@ class Options:
         self.github_base_url = github_base_url
         self.branch_limit = branch_limit
         self.only_closed_prs = only_closed_prs
+        self.use_graphql = use_graphql
+        self.concurrency = concurrency
+        self.request_budget = request_budget
+        self.graphql_point_budget = graphql_point_budget
+        self.max_runtime = max_runtime
+        self.cache_dir = cache_dir
+        self.org_sweep = org_sweep
+        self.include_repos = [] if include_repos is None else include_repos
+        self.exclude_repos = [] if exclude_repos is None else exclude_repos
+        self.use_async = use_async
+        self.verbose = verbose
+        self.metrics_file = metrics_file
+        self.local_clone = local_clone
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+        self.shard_results_dir = shard_results_dir
+        self.merge_shards = merge_shards
+        self.shard = Shard(index=shard_index, count=shard_count)
+        self.plan_file = plan_file
+        self.apply_plan = apply_plan
+
+        if ignore_branches_matcher is None:
+            ignore_branches_matcher = BranchMatcher(rules=ignore_branches)
+        if allowed_prefixes_matcher is None:
+            allowed_prefixes_matcher = BranchMatcher(rules=allowed_prefixes)
+        self.ignore_branches_matcher = ignore_branches_matcher
+        self.allowed_prefixes_matcher = allowed_prefixes_matcher
 
 
 class InputParser:
@@ -35,11 +86,14 @@ class InputParser:
     def get_args() -> argparse.Namespace:
         parser = argparse.ArgumentParser('Github Actions Delete Old Branches')
 
-        parser.add_argument("--ignore-branches", help="Comma-separated list of branches to ignore")
+        parser.add_argument(
+            "--ignore-branches",
+            help="Comma-separated list of branch prefixes, globs or /regular expressions/ to ignore"
+        )
 
         parser.add_argument(
             "--allowed-prefixes",
-            help="Comma-separated list of prefixes a branch must match to be deleted"
+            help="Comma-separated list of prefixes, globs or /regular expressions/ a branch must match to be deleted"
         )
 
         parser.add_argument("--github-token", required=True)
@@ -78,6 +132,122 @@ class InputParser:
             help="Whether we're only deleting branches that belong to closed PRs. Defaults to 'no'. Possible values: yes, no (case sensitive)"
         )
 
+        parser.add_argument(
+            "--use-graphql",
+            choices=["yes", "no"],
+            default="no",
+            help="Whether to scan branches with the GraphQL api, 100 branches per request. Defaults to 'no'. Possible values: yes, no (case sensitive)"
+        )
+
+        parser.add_argument(
+            "--concurrency",
+            help="How many branches to evaluate in parallel. Defaults to 1",
+            default=1,
+            type=int,
+        )
+
+        parser.add_argument(
+            "--request-budget",
+            help="The max number of api requests a run can make. Defaults to 0 (no limit other than GitHub's own)",
+            default=0,
+            type=int,
+        )
+
+        parser.add_argument(
+            "--graphql-point-budget",
+            help="The max number of GraphQL rate limit points a run can spend. Defaults to 0 (no limit other than GitHub's own)",
+            default=0,
+            type=int,
+        )
+
+        parser.add_argument(
+            "--max-runtime",
+            help="Minutes a run may take. Scanning stops after 80%% of them, and the next run resumes where it stopped when --cache-dir is kept. Defaults to 0 (no limit)",
+            default=0,
+            type=float,
+        )
+
+        parser.add_argument(
+            "--cache-dir",
+            help="Directory to keep data between runs in, such as commit dates. Defaults to none (no caching)"
+        )
+
+        parser.add_argument(
+            "--org-sweep",
+            choices=["yes", "no"],
+            default="no",
+            help="Whether to clean up every repository of the owner instead of the current one. Defaults to 'no'. Possible values: yes, no (case sensitive)"
+        )
+
+        parser.add_argument(
+            "--include-repos",
+            help="Comma-separated list of glob patterns a repository name must match to be swept"
+        )
+
+        parser.add_argument("--exclude-repos", help="Comma-separated list of glob patterns of repositories to skip")
+
+        parser.add_argument(
+            "--use-async",
+            choices=["yes", "no"],
+            default="no",
+            help="Whether to make requests from an asyncio event loop instead of threads, which allows a much higher concurrency. Defaults to 'no'. Possible values: yes, no (case sensitive)"
+        )
+
+        parser.add_argument(
+            "--verbose",
+            choices=["yes", "no"],
+            default="no",
+            help="Whether to log every branch, pull request and repository looked at. Defaults to 'no'. Possible values: yes, no (case sensitive)"
+        )
+
+        parser.add_argument(
+            "--metrics-file",
+            help="File to write a json report of the requests made, their latency and the time spent per phase to. Defaults to none"
+        )
+
+        parser.add_argument(
+            "--local-clone",
+            help="Path to a clone of the repository with every branch fetched, to read branches and commit dates from instead of the api. Defaults to none"
+        )
+
+        parser.add_argument(
+            "--shard-index",
+            help="Which slice of the branches this job evaluates, from 0 to --shard-count - 1. Defaults to 0",
+            default=0,
+            type=int,
+        )
+
+        parser.add_argument(
+            "--shard-count",
+            help="How many jobs split the branches between them. Each gets an equal part of --branch-limit. Defaults to 1",
+            default=1,
+            type=int,
+        )
+
+        parser.add_argument(
+            "--shard-results-dir",
+            help="Directory each shard writes its result to, and --merge-shards reads them from. Defaults to none"
+        )
+
+        parser.add_argument(
+            "--merge-shards",
+            choices=["yes", "no"],
+            default="no",
+            help="Whether to combine the results of every shard in --shard-results-dir instead of scanning. Defaults to 'no'. Possible values: yes, no (case sensitive)"
+        )
+
+        parser.add_argument(
+            "--plan-file",
+            help="File to write the branches found deletable to, with the head commit each was judged on and why, or to read them from with --apply-plan. Defaults to none"
+        )
+
+        parser.add_argument(
+            "--apply-plan",
+            choices=["yes", "no"],
+            default="no",
+            help="Whether to delete the branches of --plan-file whose head didn't move instead of scanning. Defaults to 'no'. Possible values: yes, no (case sensitive)"
+        )
+
         return parser.parse_args()
 
     def parse_input(self) -> Options:
@@ -93,9 +263,25 @@ class InputParser:
         if allowed_prefixes == ['']:
             allowed_prefixes = []
 
+        include_repos_raw: str = "" if args.include_repos is None else args.include_repos
+        include_repos = include_repos_raw.split(',')
+        if include_repos == ['']:
+            include_repos = []
+
+        exclude_repos_raw: str = "" if args.exclude_repos is None else args.exclude_repos
+        exclude_repos = exclude_repos_raw.split(',')
+        if exclude_repos == ['']:
+            exclude_repos = []
+
         # Dry run can only be either `true` or `false`, as strings due to github actions input limitations
         dry_run = False if args.dry_run == 'no' else True
         only_closed_prs = False if args.only_closed_prs == 'no' else True
+        use_graphql = False if args.use_graphql == 'no' else True
+        org_sweep = False if args.org_sweep == 'no' else True
+        use_async = False if args.use_async == 'no' else True
+        verbose = False if args.verbose == 'no' else True
+        merge_shards = False if args.merge_shards == 'no' else True
+        apply_plan = False if args.apply_plan == 'no' else True
 
         return Options(
             ignore_branches=ignore_branches,
@@ -108,6 +294,28 @@ class InputParser:
             github_base_url=args.github_base_url,
             branch_limit=args.branch_limit,
             only_closed_prs=only_closed_prs,
+            use_graphql=use_graphql,
+            concurrency=max(args.concurrency, 1),
+            request_budget=args.request_budget,
+            graphql_point_budget=args.graphql_point_budget,
+            max_runtime=max(args.max_runtime, 0),
+            cache_dir=args.cache_dir if args.cache_dir else None,
+            org_sweep=org_sweep,
+            include_repos=include_repos,
+            exclude_repos=exclude_repos,
+            use_async=use_async,
+            verbose=verbose,
+            metrics_file=args.metrics_file if args.metrics_file else None,
+            local_clone=args.local_clone if args.local_clone else None,
+            shard_index=args.shard_index,
+            shard_count=args.shard_count,
+            shard_results_dir=args.shard_results_dir if args.shard_results_dir else None,
+            merge_shards=merge_shards,
+            plan_file=args.plan_file if args.plan_file else None,
+            apply_plan=apply_plan,
+            # Compiled once here, every branch of every repository is matched against them
+            ignore_branches_matcher=BranchMatcher(rules=ignore_branches),
+            allowed_prefixes_matcher=BranchMatcher(rules=allowed_prefixes),
         )
 
 
@@ -117,3 +325,15 @@ def format_output(output_strings: dict) -> None:
     with open(file_path, "a") as gh_output:
         for name, value in output_strings.items():
             gh_output.write(f'{name}={value}\n')
+
+
+def write_step_summary(summary: str) -> None:
+    """
+    Adds markdown to the job's summary page. Does nothing outside of github actions
+    """
+    file_path = getenv('GITHUB_STEP_SUMMARY')
+    if not file_path:
+        return
+
+    with open(file_path, "a") as step_summary:
+        step_summary.write(summary)
@@ -0,0 +1,127 @@
+from typing import TYPE_CHECKING, Iterator
+
+from src.records import BranchRecord
+
+if TYPE_CHECKING:
+    import subprocess
+
+# Clones made by actions/checkout keep branches as remote-tracking refs, bare mirrors keep them as local branches
+REMOTE_NAMESPACE = 'refs/remotes/origin/'
+BRANCH_NAMESPACES = (REMOTE_NAMESPACE, 'refs/heads/')
+
+# What a clone's origin fetches when it gets every branch, `git clone --single-branch` only fetches one
+FETCH_EVERY_BRANCH = 'refs/heads/*:refs/remotes/origin/*'
+
+# The fields we need out of every ref, NUL separated since branch names can't contain NUL
+REF_FORMAT = '%(refname)%00%(objectname)%00%(committerdate:unix)'
+
+
+class LocalRepository:
+    """
+    Branches of a local clone of the repository, read with `git for-each-ref`. Names, head commits and commit dates
+    come out of a single git command instead of a request per page and per commit. The clone may be bare, shallow
+    history is fine as long as every branch was fetched, and blobs aren't needed (`--filter=blob:none`).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.namespace: str = None
+
+    def run_git(self, *args: str) -> 'subprocess.Popen':
+        import subprocess
+
+        return subprocess.Popen(
+            ['git', '-C', self.path, *args],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+
+    def get_namespace(self) -> str:
+        """
+        Returns the first namespace with any branch in it
+        """
+        if self.namespace is not None:
+            return self.namespace
+
+        for namespace in BRANCH_NAMESPACES:
+            process = self.run_git('for-each-ref', '--count=1', '--format=%(refname)', namespace)
+            output, error = process.communicate()
+            if process.returncode != 0:
+                raise RuntimeError(f'Could not read branches from the clone at `{self.path}`: {error.strip()}')
+            if output.strip() != '':
+                if namespace == REMOTE_NAMESPACE:
+                    self.check_fetch_refspecs()
+                self.namespace = namespace
+
+                return namespace
+
+        raise RuntimeError(f'The clone at `{self.path}` has no branches. Was it checked out with fetch-depth: 0?')
+
+    def check_fetch_refspecs(self) -> None:
+        """
+        Fails unless origin fetches every branch, otherwise the scan would only see the branches that were fetched
+        """
+        process = self.run_git('config', '--get-all', 'remote.origin.fetch')
+        output, _ = process.communicate()
+        refspecs = output.split()
+        if FETCH_EVERY_BRANCH not in (refspec.lstrip('+') for refspec in refspecs):
+            raise RuntimeError(
+                f'The clone at `{self.path}` only fetches {refspecs} from origin, not every branch. Was it checked out '
+                f'with fetch-depth: 0?'
+            )
+
+    def count_branches(self) -> int:
+        namespace = self.get_namespace()
+        process = self.run_git('for-each-ref', '--format=%(refname)', namespace)
+        output, error = process.communicate()
+        if process.returncode != 0:
+            raise RuntimeError(f'Could not read branches from the clone at `{self.path}`: {error.strip()}')
+
+        # origin/HEAD only points at the default branch
+        return sum(1 for refname in output.splitlines() if refname != f'{namespace}HEAD')
+
+    def iter_branches(self) -> Iterator[BranchRecord]:
+        """
+        Yields the name, head commit and committer date of every branch, in the order GitHub lists them
+        """
+        namespace = self.get_namespace()
+
+        # Sorted by refname, and so by branch name since they all share the namespace, just like the api sorts them
+        process = self.run_git('for-each-ref', f'--format={REF_FORMAT}', '--sort=refname', namespace)
+        completed = False
+        try:
+            for line in process.stdout:
+                refname, commit_hash, timestamp = line.rstrip('\n').split('\0')
+                name = refname[len(namespace):]
+
+                # origin/HEAD only points at the default branch
+                if name == 'HEAD':
+                    continue
+
+                yield BranchRecord(name=name, commit_hash=commit_hash, commit_date=int(timestamp))
+
+            completed = True
+        finally:
+            # Stopped early, e.g. when the branch limit is reached. git doesn't need to list the rest
+            if completed is False:
+                process.kill()
+
+            process.stdout.close()
+            error = process.stderr.read()
+            process.stderr.close()
+            return_code = process.wait()
+
+        if return_code != 0:
+            raise RuntimeError(f'Could not read branches from the clone at `{self.path}`: {error.strip()}')
+
+    def iter_branch_pages(self, page_size: int) -> Iterator[list]:
+        page = []
+        for branch in self.iter_branches():
+            page.append(branch)
+            if len(page) == page_size:
+                yield page
+                page = []
+
+        if len(page) > 0:
+            yield page
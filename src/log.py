@@ -0,0 +1,15 @@
+verbose = False
+
+
+def set_verbose(value: bool) -> None:
+    global verbose
+    verbose = value
+
+
+def detail(message: str) -> None:
+    """
+    Prints a line about a single branch, pull request or repository. Large runs produce hundreds of thousands of those,
+    so they only show up in verbose mode.
+    """
+    if verbose is True:
+        print(message)
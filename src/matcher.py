@@ -0,0 +1,81 @@
+import re
+from fnmatch import translate
+
+# Git doesn't allow any of these in a branch name, so a rule using them can only be a glob
+GLOB_CHARACTERS = ('*', '?', '[')
+
+# Marks the trie nodes a prefix ends at. Every other key is a single character
+PREFIX_END = None
+
+
+class BranchMatcher:
+    """
+    Matches branch names against ignore_branches or allowed_prefixes rules, compiled once per run so that a lookup
+    doesn't depend on how many rules there are. A rule is either:
+
+    - a prefix, such as `feature/`, matching every branch starting with it,
+    - a glob, such as `*/wip-*`, matching whole branch names,
+    - a regular expression between slashes, such as `/release-\\d+$/`, matching from the start of branch names.
+
+    Prefixes live in a trie walked once per branch name. Globs are combined into a single pattern. Regular
+    expressions are compiled one by one, so that their groups, backreferences and flags stay their own.
+    """
+
+    def __init__(self, rules: list[str]):
+        self.rules = rules
+        self.trie = {}
+        self.glob_pattern: re.Pattern = None
+        self.patterns: list[re.Pattern] = []
+
+        globs = []
+        for rule in rules:
+            if len(rule) > 2 and rule.startswith('/') and rule.endswith('/'):
+                self.patterns.append(self.compile(rule=rule, pattern=rule[1:-1]))
+            elif any(character in rule for character in GLOB_CHARACTERS):
+                globs.append(translate(rule))
+            else:
+                self.add_prefix(prefix=rule)
+
+        if len(globs) > 0:
+            self.glob_pattern = re.compile('|'.join(f'(?:{glob})' for glob in globs))
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    def __repr__(self) -> str:
+        return f'BranchMatcher({self.rules})'
+
+    @staticmethod
+    def compile(rule: str, pattern: str) -> re.Pattern:
+        try:
+            return re.compile(pattern)
+        except re.error as ex:
+            raise RuntimeError(f'Invalid branch pattern `{rule}`: {ex}')
+
+    def add_prefix(self, prefix: str) -> None:
+        node = self.trie
+        for character in prefix:
+            node = node.setdefault(character, {})
+        node[PREFIX_END] = True
+
+    def matches(self, name: str) -> bool:
+        if self.matches_prefix(name=name):
+            return True
+        if self.glob_pattern is not None and self.glob_pattern.match(name) is not None:
+            return True
+
+        return any(pattern.match(name) is not None for pattern in self.patterns)
+
+    def matches_prefix(self, name: str) -> bool:
+        node = self.trie
+        if PREFIX_END in node:
+            return True
+
+        for character in name:
+            node = node.get(character)
+            if node is None:
+                return False
+            if PREFIX_END in node:
+                return True
+
+        return False
@@ -0,0 +1,175 @@
+import json
+import re
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+from urllib.parse import urlparse
+
+from requests.models import Response
+
+# Upper bounds of the latency histogram buckets, in milliseconds
+LATENCY_BUCKETS_MS = (25, 50, 100, 250, 500, 1000, 2500, 5000, float('inf'))
+
+# Turn request paths into the endpoint they hit, so requests for different branches or commits add up together
+ENDPOINT_PATTERNS = (
+    (re.compile(r'/repos/[^/]+/[^/]+/commits/[^/]+/pulls$'), '/repos/{repo}/commits/{sha}/pulls'),
+    (re.compile(r'/repos/[^/]+/[^/]+/commits/[^/]+$'), '/repos/{repo}/commits/{sha}'),
+    (re.compile(r'/repos/[^/]+/[^/]+/branches/.+$'), '/repos/{repo}/branches/{branch}'),
+    (re.compile(r'/repos/[^/]+/[^/]+/git/refs/heads/.+$'), '/repos/{repo}/git/refs/heads/{branch}'),
+    (re.compile(r'/repos/[^/]+/[^/]+(?P<rest>/[a-z]+)?$'), r'/repos/{repo}\g<rest>'),
+    (re.compile(r'/(?P<kind>orgs|users)/[^/]+/repos$'), r'/\g<kind>/{owner}/repos'),
+)
+
+
+def endpoint_name(method: str, url: str) -> str:
+    path = urlparse(url).path
+    for pattern, template in ENDPOINT_PATTERNS:
+        match = pattern.search(path)
+        if match is not None:
+            return f'{method.upper()} {match.expand(template)}'
+
+    return f'{method.upper()} {path}'
+
+
+class EndpointStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.histogram = [0] * len(LATENCY_BUCKETS_MS)
+
+    def add(self, seconds: float, size: int, failed: bool) -> None:
+        self.requests += 1
+        self.errors += 1 if failed else 0
+        self.bytes += size
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+        milliseconds = seconds * 1000
+        for index, bound in enumerate(LATENCY_BUCKETS_MS):
+            if milliseconds <= bound:
+                self.histogram[index] += 1
+                break
+
+    def report(self) -> dict:
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'bytes': self.bytes,
+            'mean_ms': round(self.seconds * 1000 / self.requests, 1) if self.requests > 0 else 0,
+            'max_ms': round(self.max_seconds * 1000, 1),
+            'latency_histogram_ms': {
+                f'<={bound:g}' if bound != float('inf') else f'>{LATENCY_BUCKETS_MS[-2]:g}': count
+                for bound, count in zip(LATENCY_BUCKETS_MS, self.histogram)
+            },
+        }
+
+
+class Metrics:
+    """
+    What a run cost: every request made, by endpoint, with its latency and size, the time spent in each phase of the
+    run, the points GraphQL queries cost and the rate limit quota left when the run started and when it ended.
+    Shared by every transport of a run.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints: dict[str, EndpointStats] = {}
+        self.phases: dict[str, float] = {}
+        self.graphql_costs: dict[str, int] = {}
+        self.first_remaining: dict[str, int] = {}
+        self.last_remaining: dict[str, int] = {}
+
+    def record_request(self, endpoint: str, seconds: float, response: Response = None) -> None:
+        """
+        Records a request that took `seconds`. `response` is None if the request failed without one.
+        """
+        failed = response is None or response.status_code >= 400
+        size = 0 if response is None else len(response.content)
+
+        with self.lock:
+            if endpoint not in self.endpoints:
+                self.endpoints[endpoint] = EndpointStats()
+            self.endpoints[endpoint].add(seconds=seconds, size=size, failed=failed)
+
+            if response is not None and 'x-ratelimit-remaining' in response.headers:
+                resource = response.headers.get('x-ratelimit-resource', 'core')
+                remaining = int(response.headers['x-ratelimit-remaining'])
+                self.first_remaining.setdefault(resource, remaining)
+                self.last_remaining[resource] = remaining
+
+    def record_graphql_cost(self, query: str, data: dict) -> None:
+        """
+        Adds the points a response to `query` says it cost, if it asked for them
+        """
+        rate_limit = (data.get('data') or {}).get('rateLimit')
+        if rate_limit is None:
+            return
+
+        with self.lock:
+            self.graphql_costs[query] = self.graphql_costs.get(query, 0) + rate_limit['cost']
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Adds the time spent in the block to the phase's total
+        """
+        started = perf_counter()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.phases[name] = self.phases.get(name, 0.0) + perf_counter() - started
+
+    def report(self) -> dict:
+        with self.lock:
+            return {
+                'requests': sum(stats.requests for stats in self.endpoints.values()),
+                'endpoints': {endpoint: stats.report() for endpoint, stats in sorted(self.endpoints.items())},
+                'phases_seconds': {phase: round(seconds, 3) for phase, seconds in self.phases.items()},
+                'graphql_cost': dict(self.graphql_costs),
+                'rate_limit_remaining': {
+                    resource: {'first': self.first_remaining[resource], 'last': self.last_remaining[resource]}
+                    for resource in self.first_remaining
+                },
+            }
+
+    def write_report(self, path: str) -> None:
+        with open(path, 'w') as report_file:
+            json.dump(self.report(), report_file, indent=2)
+
+    def format_summary(self) -> str:
+        """
+        The report as a few markdown tables, for the job's step summary
+        """
+        report = self.report()
+
+        lines = [
+            '### Delete abandoned branches: run metrics',
+            '',
+            '| Endpoint | Requests | Errors | Mean ms | Max ms | KB |',
+            '|---|---:|---:|---:|---:|---:|',
+        ]
+        for endpoint, stats in report['endpoints'].items():
+            lines.append(
+                f'| `{endpoint}` | {stats["requests"]} | {stats["errors"]} | {stats["mean_ms"]} | {stats["max_ms"]} '
+                f'| {stats["bytes"] // 1024} |'
+            )
+
+        lines.extend(['', '| Phase | Seconds |', '|---|---:|'])
+        lines.extend(f'| {phase} | {seconds} |' for phase, seconds in report['phases_seconds'].items())
+
+        if len(report['rate_limit_remaining']) > 0:
+            lines.extend(['', '| Rate limit | First seen remaining | Last seen remaining |', '|---|---:|---:|'])
+            lines.extend(
+                f'| {resource} | {remaining["first"]} | {remaining["last"]} |'
+                for resource, remaining in report['rate_limit_remaining'].items()
+            )
+
+        if len(report['graphql_cost']) > 0:
+            lines.extend(['', '| GraphQL query | Points |', '|---|---:|'])
+            lines.extend(f'| {query} | {cost} |' for query, cost in report['graphql_cost'].items())
+
+        return '\n'.join(lines) + '\n'
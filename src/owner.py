@@ -0,0 +1,64 @@
+from fnmatch import fnmatchcase
+
+from src.log import detail
+from src.requests import Transport
+
+
+class Owner:
+    """
+    An organization or user whose repositories are swept in a single run
+    """
+
+    def __init__(self, name: str, base_url: str, transport: Transport):
+        self.name = name
+        self.base_url = base_url
+        self.transport = transport
+
+    def get_repositories(self, include: list[str], exclude: list[str]) -> list[str]:
+        """
+        Returns the full names of the owner's repositories, filtered by glob patterns on their names. Archived
+        repositories are read only, so they're always left out.
+        """
+        repositories = []
+
+        for repository in self.get_all_repositories():
+            name = repository.get('name')
+
+            if repository.get('archived') is True:
+                detail(f'Ignoring repository `{name}` because it is archived')
+                continue
+
+            if len(include) > 0 and not any(fnmatchcase(name, pattern) for pattern in include):
+                detail(f'Ignoring repository `{name}` because it does not match any provided include_repos')
+                continue
+
+            if any(fnmatchcase(name, pattern) for pattern in exclude):
+                detail(f'Ignoring repository `{name}` because it is on the list of excluded repositories')
+                continue
+
+            repositories.append(repository.get('full_name'))
+
+        return repositories
+
+    def get_all_repositories(self) -> list[dict]:
+        repositories = []
+        url = f'{self.base_url}/orgs/{self.name}/repos?per_page=100'
+
+        response = self.transport.get(url=f'{url}&page=1')
+        if response.status_code == 404:
+            # Not an organization, list the user's repositories instead
+            url = f'{self.base_url}/users/{self.name}/repos?per_page=100'
+            response = self.transport.get(url=f'{url}&page=1')
+
+        page = 1
+        while True:
+            if response.status_code != 200:
+                raise RuntimeError(f'Failed to make request to {url}. {response} {response.json()}')
+
+            page_repositories: list = response.json()
+            repositories.extend(page_repositories)
+            if len(page_repositories) < 100:
+                return repositories
+
+            page += 1
+            response = self.transport.get(url=f'{url}&page={page}')
@@ -0,0 +1,93 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator
+
+# Returned by next() once the pages run out, pages themselves can be anything
+_EXHAUSTED = object()
+
+
+class Prefetcher:
+    """
+    Iterates over the same pages as `pages`, but always has the next one requested in the background while the
+    caller works on the current one. The first page is requested right away. Errors raised fetching a page come out
+    of the next() call that would have returned it. Once closed, nothing is fetched past the page already in flight.
+    """
+
+    def __init__(self, pages: Iterator):
+        self.pages = pages
+        self.closed = False
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='prefetch')
+        self.future = self.executor.submit(next, pages, _EXHAUSTED)
+
+    def __iter__(self) -> 'Prefetcher':
+        return self
+
+    def __next__(self):
+        if self.closed is True:
+            raise StopIteration
+
+        page = self.future.result()
+        if page is _EXHAUSTED:
+            self.close()
+            raise StopIteration
+
+        self.future = self.executor.submit(next, self.pages, _EXHAUSTED)
+
+        return page
+
+    def close(self) -> None:
+        # A request already on the wire can't be taken back, its page is simply dropped
+        self.closed = True
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class PageSizer:
+    """
+    Picks how many nodes to ask a GraphQL connection for. Pages grow back up to `max_size` while they come back well
+    within `target_seconds`, shrink in proportion when they take longer, and are halved when a query times out. They
+never grow back to a size that timed out.
+    Queries cost points in proportion to the nodes asked for, so pages are also kept small enough for their expected
+    cost to fit in whatever is left of a points budget.
+    """
+
+    def __init__(self, max_size: int = 100, min_size: int = 1, target_seconds: float = 4.0):
+        self.max_size = max_size
+        self.min_size = min_size
+        self.target_seconds = target_seconds
+        self.size = max_size
+        self.timed_out_size: int = None
+        self.cost_per_node: float = None
+
+    def get_size(self, points_left: int = None) -> int:
+        if points_left is None or self.cost_per_node is None or self.cost_per_node == 0:
+            return self.size
+
+        return max(self.min_size, min(self.size, int(points_left / self.cost_per_node)))
+
+    def record(self, size: int, seconds: float, cost: int = None) -> None:
+        """
+        Adjusts the size of the next pages after a page of `size` nodes took `seconds` and cost `cost` points
+        """
+        if cost is not None:
+            self.cost_per_node = cost / size
+
+        if seconds > self.target_seconds:
+            self.size = max(self.min_size, int(size * self.target_seconds / seconds))
+        elif seconds < self.target_seconds / 2:
+            if self.timed_out_size is None:
+                self.size = min(self.max_size, max(self.size, size * 2))
+            else:
+                # Halfway to the smallest size that timed out, so it's closed in on instead of hit again
+                self.size = max(self.size, min(size * 2, (size + self.timed_out_size) // 2))
+
+    def shrink(self, size: int) -> bool:
+        """
+        Halves the page size after a page of `size` nodes timed out. Returns False if it can't get any smaller.
+        """
+        if size <= self.min_size:
+            return False
+
+        if self.timed_out_size is None or size < self.timed_out_size:
+            self.timed_out_size = size
+        self.size = max(self.min_size, size // 2)
+
+        return True
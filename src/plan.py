@@ -0,0 +1,31 @@
+import json
+from datetime import datetime, timezone
+
+PLAN_VERSION = 1
+
+
+def write_plan(path: str, plan: dict[str, list[dict]]) -> None:
+    """
+    Writes the branches a scan found deletable, by repository. Every entry has the branch, the head commit it was
+    judged on and why it is deletable, for a reviewer to go through before the plan is applied.
+    """
+    with open(path, 'w') as plan_file:
+        json.dump({
+            'version': PLAN_VERSION,
+            'created_at': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'repositories': plan,
+        }, plan_file, indent=2)
+
+    print(f'Deletion plan of {sum(len(entries) for entries in plan.values())} branches written to {path}')
+
+
+def read_plan(path: str) -> dict[str, list[dict]]:
+    with open(path) as plan_file:
+        saved = json.load(plan_file)
+
+    if saved.get('version') != PLAN_VERSION:
+        raise RuntimeError(f'`{path}` is not a deletion plan this version can apply')
+
+    print(f'Applying the deletion plan made on {saved.get("created_at")}')
+
+    return saved['repositories']
@@ -0,0 +1,37 @@
+class OpenPullRequestIndex:
+    """
+    Heads and bases of every open pull request in a repository, collected once per run so branches can be checked
+    against them without further requests.
+    """
+
+    def __init__(self, repo: str):
+        self.repo = repo
+        self.head_shas: set[str] = set()
+        self.head_refs: set[str] = set()
+        self.base_refs: set[str] = set()
+        self.size = 0
+
+    def add(self, pull_request: dict) -> None:
+        self.size += 1
+        head: dict = pull_request.get('head') or {}
+        base: dict = pull_request.get('base') or {}
+
+        self.head_shas.add(head.get('sha'))
+        self.base_refs.add(base.get('ref'))
+
+        # Pull requests from forks can share branch names with ours, only their commits can match
+        head_repo: dict = head.get('repo') or {}
+        if head_repo.get('full_name', self.repo) == self.repo:
+            self.head_refs.add(head.get('ref'))
+
+    def has_open_pulls(self, branch: str, commit_hash: str) -> bool:
+        """
+        Returns true if the branch or its head commit is the head of an open pull request
+        """
+        return commit_hash in self.head_shas or branch in self.head_refs
+
+    def is_pull_request_base(self, branch: str) -> bool:
+        """
+        Returns true if the given branch is base for an open pull request.
+        """
+        return branch in self.base_refs
@@ -0,0 +1,217 @@
+import random
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from time import sleep, time
+
+from requests.models import Response
+
+RETRYABLE_STATUS_CODES = (500, 502, 503, 504)
+
+
+class RequestBudgetExhausted(RuntimeError):
+    pass
+
+
+class RateLimiter:
+    """
+    Shared by every request of a run. Keeps track of the quota GitHub reports back, paces requests so the remaining
+    quota lasts until it resets, and decides whether (and for how long) to wait before retrying a failed request.
+    """
+
+    def __init__(
+            self,
+            request_budget: int = 0,
+            max_retries: int = 4,
+            max_backoff_seconds: float = 60,
+            point_budget: int = 0,
+    ):
+        self.request_budget = request_budget
+        self.point_budget = point_budget
+        self.max_retries = max_retries
+        self.max_backoff_seconds = max_backoff_seconds
+        self.lock = threading.Lock()
+
+        # The budgets bound scanning, the branches a scan found within them are deleted whatever it takes
+        self.scanning = True
+
+        # Quota state per X-RateLimit-Resource (core, graphql, search...)
+        self.limits: dict[str, int] = {}
+        self.remaining: dict[str, int] = {}
+        self.resets: dict[str, int] = {}
+        self.used: dict[str, int] = {}
+
+        self.requests = 0
+        self.points = 0
+        self.not_modified = 0
+        self.retries = 0
+        self.blocked_until = 0.0
+        self.next_request_at = 0.0
+
+    def acquire(self, resource: str = 'core') -> None:
+        """
+        Blocks until the next request may go out. Call before every request.
+        """
+        delay = self.reserve(resource=resource)
+        if delay > 0:
+            sleep(delay)
+
+    def reserve(self, resource: str = 'core') -> float:
+        """
+        Counts a request about to go out and returns how many seconds it must wait first, for callers that can't
+        block the thread, such as coroutines
+        """
+        with self.lock:
+            if self.scanning and 0 < self.request_budget <= self.spent:
+                raise RequestBudgetExhausted(f'Request budget of {self.request_budget} requests exhausted')
+            if self.scanning and resource == 'graphql' and 0 < self.point_budget <= self.points:
+                raise RequestBudgetExhausted(f'GraphQL point budget of {self.point_budget} points exhausted')
+
+            now = time()
+            wait_until = max(self.blocked_until, self.next_request_at)
+
+            remaining = self.remaining.get(resource)
+            reset = self.resets.get(resource)
+            limit = self.limits.get(resource)
+            if remaining is not None and reset is not None and reset > now:
+                if remaining <= 0:
+                    wait_until = max(wait_until, reset + 1)
+                elif limit is not None and remaining < limit / 10:
+                    # Running low, spread what is left evenly until the quota resets
+                    self.next_request_at = max(now, self.next_request_at) + (reset - now) / remaining
+
+            self.requests += 1
+
+        if wait_until <= now:
+            return 0
+
+        print(f'Waiting {wait_until - now:.1f} seconds for the GitHub rate limit')
+
+        return wait_until - now
+
+    @contextmanager
+    def deleting(self):
+        """
+        Lets requests go past the request and GraphQL point budgets while deleting branches. They still count towards
+        them.
+        """
+        self.scanning = False
+        try:
+            yield
+        finally:
+            self.scanning = True
+
+    @property
+    def spent(self) -> int:
+        """
+        Requests that counted against the budget. Conditional requests answered with a 304 are free.
+        """
+        return self.requests - self.not_modified
+
+    def record(self, response: Response) -> None:
+        """
+        Updates the quota state from the rate limit headers of a response
+        """
+        if response.status_code == 304:
+            with self.lock:
+                self.not_modified += 1
+
+        headers = response.headers
+        if 'x-ratelimit-remaining' not in headers:
+            return
+
+        resource = headers.get('x-ratelimit-resource', 'core')
+        remaining = int(headers['x-ratelimit-remaining'])
+        reset = int(headers.get('x-ratelimit-reset', 0))
+
+        with self.lock:
+            previous_remaining = self.remaining.get(resource)
+            previous_reset = self.resets.get(resource)
+
+            if 'x-ratelimit-limit' in headers:
+                self.limits[resource] = int(headers['x-ratelimit-limit'])
+
+            if previous_remaining is None:
+                used = 1
+            elif previous_reset == reset:
+                used = max(previous_remaining - remaining, 0)
+            else:
+                # The window reset since the last response, so everything spent is in the new window
+                used = max(self.limits.get(resource, remaining) - remaining, 1)
+
+            self.used[resource] = self.used.get(resource, 0) + used
+            self.remaining[resource] = remaining
+            self.resets[resource] = reset
+
+    @property
+    def points_left(self) -> int:
+        """
+        GraphQL points left in the budget, None without a budget
+        """
+        if self.point_budget <= 0:
+            return None
+
+        return max(self.point_budget - self.points, 0)
+
+    def record_points(self, rate_limit: dict) -> None:
+        """
+        Updates the GraphQL quota state from the `rateLimit { cost remaining resetAt }` of a query, which is there
+        even when headers aren't
+        """
+        with self.lock:
+            self.points += rate_limit.get('cost', 0)
+
+            if 'remaining' in rate_limit and 'resetAt' in rate_limit:
+                # Formatted like so: '2021-02-04T10:52:40Z'
+                reset_at = datetime.strptime(rate_limit['resetAt'], '%Y-%m-%dT%H:%M:%S%z')
+                self.remaining['graphql'] = rate_limit['remaining']
+                self.resets['graphql'] = int(reset_at.timestamp())
+
+    def retry_delay(self, response: Response = None, attempt: int = 0) -> float:
+        """
+        Returns how many seconds to wait before retrying the request that produced `response` (None for network
+        errors), or None if it should not be retried.
+        """
+        if attempt >= self.max_retries:
+            return None
+
+        delay = self.backoff(attempt)
+
+        if response is not None and response.status_code not in RETRYABLE_STATUS_CODES:
+            if response.status_code not in (403, 429):
+                return None
+
+            retry_after = response.headers.get('retry-after')
+            if retry_after is not None:
+                delay = float(retry_after)
+            elif response.headers.get('x-ratelimit-remaining') == '0':
+                delay = int(response.headers.get('x-ratelimit-reset', 0)) - time() + 1
+            elif response.status_code != 429 and 'secondary rate limit' not in response.text.lower():
+                # A plain 403, usually missing permissions
+                return None
+
+            # Rate limits apply to the whole token, so hold off every other request too
+            with self.lock:
+                self.blocked_until = max(self.blocked_until, time() + delay)
+
+        with self.lock:
+            self.retries += 1
+
+        return max(delay, 0)
+
+    def backoff(self, attempt: int) -> float:
+        """
+        Exponential backoff with jitter, so parallel workers don't retry in lockstep
+        """
+        return min(self.max_backoff_seconds, 2 ** attempt) * random.uniform(0.5, 1.5)
+
+    def report(self) -> dict:
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'graphql_points': self.points,
+                'not_modified': self.not_modified,
+                'retries': self.retries,
+                'quota_used': dict(self.used),
+                'quota_remaining': dict(self.remaining),
+            }
@@ -0,0 +1,119 @@
+import sys
+from datetime import datetime, timedelta
+
+# Dates are kept as seconds since this, read as naive UTC like the dates of the api always were
+EPOCH = datetime(1970, 1, 1)
+
+
+def parse_date(date_raw: str) -> int:
+    # Dates are formatted like so: '2021-02-04T10:52:40Z'
+    return int((datetime.strptime(date_raw, '%Y-%m-%dT%H:%M:%SZ') - EPOCH).total_seconds())
+
+
+def to_datetime(date) -> datetime:
+    """
+    Takes a date either as the api formats it or as seconds since the epoch
+    """
+    if isinstance(date, int):
+        return EPOCH + timedelta(seconds=date)
+
+    return datetime.strptime(date, '%Y-%m-%dT%H:%M:%SZ')
+
+
+class BranchRecord:
+    """
+    What a scan keeps of a branch listed by the api or read from a local clone. Names are interned, as the same ones
+    end up in results, pull request lookups and state, and the commit date is in seconds since the epoch. Values the
+    listing doesn't tell are None.
+    """
+
+    __slots__ = ('name', 'commit_hash', 'commit_date', 'protected', 'has_open_pulls')
+
+    def __init__(
+            self,
+            name: str,
+            commit_hash: str = None,
+            commit_date: int = None,
+            protected: bool = None,
+            has_open_pulls: bool = None,
+    ):
+        self.name = sys.intern(name)
+        self.commit_hash = commit_hash
+        self.commit_date = commit_date
+        self.protected = protected
+        self.has_open_pulls = has_open_pulls
+
+    def __repr__(self) -> str:
+        return f'BranchRecord({self.name!r})'
+
+
+class PullRequestRecord:
+    """
+    What a scan of closed pull requests keeps of one. head_ref is None once the head branch was deleted.
+    """
+
+    __slots__ = ('url', 'head_branch', 'updated_at', 'cross_repository', 'head_ref')
+
+    def __init__(
+            self,
+            url: str,
+            head_branch: str,
+            updated_at: int,
+            cross_repository: bool = None,
+            head_ref: BranchRecord = None,
+    ):
+        self.url = url
+        self.head_branch = sys.intern(head_branch)
+        self.updated_at = updated_at
+        self.cross_repository = cross_repository
+        self.head_ref = head_ref
+
+    def __repr__(self) -> str:
+        return f'PullRequestRecord({self.url!r})'
+
+
+def read_rest_object(obj: dict):
+    """
+    json object_hook for pages of /branches: every branch becomes a record as soon as it's decoded, folding in its
+    commit object, decoded just before it. Other objects are left alone.
+    """
+    if 'name' in obj and 'commit' in obj:
+        commit: dict = obj['commit'] or {}
+
+        return BranchRecord(name=obj['name'], commit_hash=commit.get('sha'), protected=obj.get('protected'))
+
+    return obj
+
+
+def read_graphql_object(obj: dict):
+    """
+    json object_hook for GraphQL responses: refs and the head refs and nodes of pull requests become records as soon
+    as they're decoded, so the nested objects they're made of never outlive their node. Other objects are left alone.
+    """
+    if 'headRefName' in obj:
+        updated_at = obj.get('updatedAt')
+
+        return PullRequestRecord(
+            url=obj.get('url'),
+            head_branch=obj['headRefName'],
+            updated_at=parse_date(updated_at) if updated_at is not None else None,
+            cross_repository=obj.get('isCrossRepository'),
+            head_ref=obj.get('headRef'),
+        )
+
+    if 'name' in obj and 'target' in obj:
+        commit: dict = obj['target'] or {}
+        committed_date = commit.get('committedDate')
+
+        # Refs are asked for the number of open pull requests they're the head of
+        has_open_pulls = (obj.get('associatedPullRequests') or {}).get('totalCount', 0) > 0
+
+        return BranchRecord(
+            name=obj['name'],
+            commit_hash=commit.get('oid'),
+            commit_date=parse_date(committed_date) if committed_date is not None else None,
+            protected=obj.get('branchProtectionRule') is not None,
+            has_open_pulls=has_open_pulls,
+        )
+
+    return obj
@@ -1,21 +1,169 @@
+from datetime import timedelta
+from time import perf_counter, sleep
+
 import requests
+from requests.adapters import HTTPAdapter
 from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+
+from src.cache import ResponseCache
+from src.metrics import Metrics, endpoint_name
+from src.ratelimit import RETRYABLE_STATUS_CODES, RateLimiter
+
+DEFAULT_POOL_SIZE = 10
+
+# Headers worth keeping along with a cached body, the rest describe the original response only
+CACHED_HEADERS = ('content-type', 'link')
+
+
+class Transport:
+    """
+    Keep-alive HTTP transport to the GitHub api. A single pooled session is shared by every request, so connections
+    (and their TLS handshakes) are reused instead of opened per request.
+    """
+
+    def __init__(
+            self,
+            token: str = None,
+            pool_size: int = DEFAULT_POOL_SIZE,
+            rate_limiter: RateLimiter = None,
+            response_cache: ResponseCache = None,
+            metrics: Metrics = None,
+    ):
+        self.pool_size = pool_size
+        self.rate_limiter = RateLimiter() if rate_limiter is None else rate_limiter
+        self.response_cache = response_cache
+        self.metrics = metrics
+        self.adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
 
+        self.session = requests.Session()
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+        self.session.headers.update({
+            'accept': 'application/vnd.github.v3+json',
+            'accept-encoding': 'gzip',
+        })
+        if token is not None:
+            self.session.headers['authorization'] = f'Bearer {token}'
 
-def get(url: str, force_debug: bool = False, headers: dict = None) -> Response:
-    return request(method='get', url=url, headers=headers, force_debug=force_debug)
+    def get(self, url: str, force_debug: bool = False, headers: dict = None, cacheable: bool = False) -> Response:
+        """
+        Only cacheable responses are kept in the response cache, the ones that are asked for again on every run and
+        seldom change. Others, such as commits, are either kept elsewhere or not worth the space.
+        """
+        if self.response_cache is None or cacheable is False:
+            return self.request(method='get', url=url, headers=headers, force_debug=force_debug)
 
+        validators = self.response_cache.get_validators(url=url)
+        response = self.request(method='get', url=url, headers={**(headers or {}), **validators}, force_debug=force_debug)
 
-def request(method: str, url: str, json: dict = None, headers: dict = None, force_debug: bool = False) -> Response:
-    try:
-        response = requests.request(method=method, url=url, json=json, headers=headers)
-        if force_debug:
-            debug_request(url, method, response, json, headers)
+        if response.status_code == 304:
+            cached = self.response_cache.get(url=url)
+            if cached is not None:
+                return make_cached_response(url=url, headers=cached[0], body=cached[1])
+
+            # Evicted in the meantime, ask again without validators
+            return self.request(method='get', url=url, headers=headers, force_debug=force_debug)
+
+        etag = response.headers.get('etag')
+        last_modified = response.headers.get('last-modified')
+        if response.status_code == 200 and (etag is not None or last_modified is not None):
+            self.response_cache.put(
+                url=url,
+                etag=etag,
+                last_modified=last_modified,
+                headers={name: response.headers[name] for name in CACHED_HEADERS if name in response.headers},
+                body=response.content,
+            )
 
         return response
-    except Exception as ex:
-        debug_request(url, method, None, json, headers)
-        raise ex
+
+    def request(
+            self,
+            method: str,
+            url: str,
+            json: dict = None,
+            headers: dict = None,
+            force_debug: bool = False,
+            resource: str = 'core',
+            endpoint: str = None,
+            retry_server_errors: bool = True,
+    ) -> Response:
+        """
+        Makes a request, retrying it on network errors, rate limits and server errors. Callers that would rather
+        change the request than repeat it after a server error, such as a timeout, set retry_server_errors to False.
+        """
+        attempt = 0
+        if self.metrics is not None and endpoint is None:
+            endpoint = endpoint_name(method=method, url=url)
+
+        while True:
+            self.rate_limiter.acquire(resource=resource)
+            started = perf_counter()
+            try:
+                response = self.session.request(method=method, url=url, json=json, headers=headers)
+            except requests.exceptions.RequestException as ex:
+                if self.metrics is not None:
+                    self.metrics.record_request(endpoint=endpoint, seconds=perf_counter() - started)
+
+                delay = self.rate_limiter.retry_delay(response=None, attempt=attempt)
+                if delay is None:
+                    debug_request(url, method, None, json, headers)
+                    raise ex
+
+                print(f'Request to {url} failed ({ex}). Retrying in {delay:.1f} seconds')
+                sleep(delay)
+                attempt += 1
+                continue
+
+            if self.metrics is not None:
+                self.metrics.record_request(endpoint=endpoint, seconds=perf_counter() - started, response=response)
+
+            self.rate_limiter.record(response)
+            if force_debug:
+                debug_request(url, method, response, json, headers)
+
+            if retry_server_errors is False and response.status_code in RETRYABLE_STATUS_CODES:
+                return response
+
+            delay = self.rate_limiter.retry_delay(response=response, attempt=attempt)
+            if delay is None:
+                return response
+
+            print(f'Request to {url} returned {response.status_code}. Retrying in {delay:.1f} seconds')
+            sleep(delay)
+            attempt += 1
+
+    @property
+    def connections_opened(self) -> int:
+        """
+        Number of connections opened so far across every host this transport talked to
+        """
+        pools = self.adapter.poolmanager.pools
+
+        return sum(pools[key].num_connections for key in pools.keys())
+
+    def close(self) -> None:
+        self.session.close()
+
+
+def make_cached_response(url: str, headers: dict, body: bytes) -> Response:
+    return make_response(url=url, status_code=200, headers=headers, body=body)
+
+
+def make_response(url: str, status_code: int, headers: dict, body: bytes, elapsed: float = 0.0) -> Response:
+    """
+    Builds a requests Response out of a response that didn't come from requests, so callers handle them all alike
+    """
+    response = Response()
+    response.elapsed = timedelta(seconds=elapsed)
+    response.status_code = status_code
+    response.url = url
+    response.headers = CaseInsensitiveDict(headers)
+    response.encoding = 'utf-8'
+    response._content = body
+
+    return response
 
 
 def debug_request(
@@ -0,0 +1,81 @@
+import json
+import os
+from zlib import crc32
+
+
+class Shard:
+    """
+    One of `count` disjoint slices of the branch namespace, for matrix jobs to split a scan between them. A branch
+    belongs to the shard its name hashes to. The hash is stable across processes and machines, unlike hash(), so
+    every job agrees on who owns what.
+    """
+
+    def __init__(self, index: int = 0, count: int = 1):
+        if count < 1 or index < 0 or index >= count:
+            raise RuntimeError(f'Invalid shard {index} of {count}, the index must be between 0 and {count - 1}')
+
+        self.index = index
+        self.count = count
+
+    def __repr__(self) -> str:
+        return f'Shard({self.index} of {self.count})'
+
+    def owns(self, name: str) -> bool:
+        return self.count == 1 or crc32(name.encode()) % self.count == self.index
+
+    def get_branch_limit(self, branch_limit: int) -> int:
+        """
+        This shard's part of a branch limit shared by every shard. The parts add up to the whole limit.
+        """
+        return branch_limit // self.count + (1 if self.index < branch_limit % self.count else 0)
+
+    def get_result_path(self, results_dir: str) -> str:
+        return os.path.join(results_dir, f'shard-{self.index}-of-{self.count}.json')
+
+
+def write_shard_result(results_dir: str, shard: Shard, branch_limit: int, dry_run: bool, result) -> None:
+    os.makedirs(results_dir, exist_ok=True)
+    with open(shard.get_result_path(results_dir=results_dir), 'w') as result_file:
+        json.dump({
+            'shard_index': shard.index,
+            'shard_count': shard.count,
+            'branch_limit': branch_limit,
+            'dry_run': dry_run,
+            'deleted_branches': result,
+        }, result_file)
+
+
+def merge_shard_results(results_dir: str):
+    """
+    Combines the results every shard wrote to results_dir into the one a single job would have given: a list of
+    branches, or a dict of them by repository when sweeping an owner, sorted by name
+    """
+    import glob
+
+    shard_results = []
+    for path in glob.glob(os.path.join(results_dir, 'shard-*.json')):
+        with open(path) as result_file:
+            shard_results.append(json.load(result_file))
+
+    if len(shard_results) == 0:
+        raise RuntimeError(f'No shard results found in `{results_dir}`')
+
+    settings = {(result['shard_count'], result['branch_limit'], result['dry_run']) for result in shard_results}
+    if len(settings) > 1:
+        raise RuntimeError(f'Shard results in `{results_dir}` come from runs with different settings: {settings}')
+
+    shard_count, branch_limit, _ = settings.pop()
+    indexes = sorted(result['shard_index'] for result in shard_results)
+    if indexes != list(range(shard_count)):
+        raise RuntimeError(f'Expected the results of {shard_count} shards in `{results_dir}`, found shards {indexes}')
+
+    results = [result['deleted_branches'] for result in shard_results]
+    if all(isinstance(result, list) for result in results):
+        return sorted(branch for result in results for branch in result)
+
+    merged = {}
+    for result in results:
+        for repo, branches in result.items():
+            merged.setdefault(repo, []).extend(branches)
+
+    return {repo: sorted(branches) for repo, branches in sorted(merged.items())}